@@ -23,6 +23,7 @@ def create_app():
     from app.routes.telegram import telegram_bp
     from app.routes.assistants import assistants_bp
     from app.routes.webhooks import webhooks_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(appointments_bp)
@@ -31,11 +32,21 @@ def create_app():
     app.register_blueprint(telegram_bp)
     app.register_blueprint(assistants_bp)
     app.register_blueprint(webhooks_bp)
+    app.register_blueprint(metrics_bp)
 
     # Configurar webhooks automáticamente
     with app.app_context():
         setup_webhooks()
 
+    # Precargar el mapeo número/canal -> asistente
+    from app.services.tenant_resolver import tenant_resolver
+    tenant_resolver.preload()
+
+    # Recordatorios automáticos de citas (un solo worker envía: bloqueo junto al cursor)
+    if Config.REMINDER_SCHEDULER_ENABLED:
+        from app.services.reminder_scheduler import reminder_scheduler
+        reminder_scheduler.start()
+
     return app
 
 def setup_webhooks():
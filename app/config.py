@@ -81,9 +81,17 @@ class Config:
     # Security
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-change-in-production'
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
+    # Users allowed to read /api/metrics (comma-separated user IDs)
+    METRICS_ADMIN_USER_IDS = os.environ.get('METRICS_ADMIN_USER_IDS', '')
     
     # Database
     DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
     
     # External APIs
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
@@ -105,6 +113,122 @@ class Config:
     
     # Rate limiting
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL') or 'memory://'
+    RATELIMIT_MAX_KEYS = int(os.environ.get('RATELIMIT_MAX_KEYS', 100000))
+
+    # Knowledge retrieval
+    KNOWLEDGE_INDEX_MAX_ENTRIES = int(os.environ.get('KNOWLEDGE_INDEX_MAX_ENTRIES', 1000))
+
+    # LLM response cache
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+    RESPONSE_CACHE_NEAR_DUPLICATES = os.environ.get('RESPONSE_CACHE_NEAR_DUPLICATES', 'false').lower() == 'true'
+    RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', 0.8))
+
+    # WhatsApp webhook ingestion
+    WHATSAPP_ASYNC_INGESTION = os.environ.get('WHATSAPP_ASYNC_INGESTION', 'false').lower() == 'true'
+    WHATSAPP_INGESTION_WORKERS = int(os.environ.get('WHATSAPP_INGESTION_WORKERS', 4))
+    WHATSAPP_INGESTION_QUEUE_SIZE = int(os.environ.get('WHATSAPP_INGESTION_QUEUE_SIZE', 1000))
+
+    # Webhook deduplication
+    WEBHOOK_DEDUP_STORAGE_URL = os.environ.get('WEBHOOK_DEDUP_STORAGE_URL') or 'memory://'
+    WEBHOOK_DEDUP_TTL = int(os.environ.get('WEBHOOK_DEDUP_TTL', 86400))
+    WEBHOOK_DEDUP_MAX_KEYS = int(os.environ.get('WEBHOOK_DEDUP_MAX_KEYS', 100000))
+
+    # Outbound HTTP (WhatsApp, Telegram, SendGrid, Twilio)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+    HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))
+    HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 10))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+    HTTP_MAX_CONCURRENCY = int(os.environ.get('HTTP_MAX_CONCURRENCY', 20))
+    HTTP_PROVIDER_CONCURRENCY = os.environ.get('HTTP_PROVIDER_CONCURRENCY', 'whatsapp=20,telegram=30,sendgrid=10,twilio=10')
+
+    # Bulk notifications (mensajes por segundo por canal)
+    NOTIFICATION_RATE_LIMITS = os.environ.get('NOTIFICATION_RATE_LIMITS', 'whatsapp=80,sms=1,email=100,voice=1')
+    NOTIFICATION_CHANNEL_WORKERS = int(os.environ.get('NOTIFICATION_CHANNEL_WORKERS', 8))
+    NOTIFICATION_MAX_IN_FLIGHT = int(os.environ.get('NOTIFICATION_MAX_IN_FLIGHT', 500))
+
+    # Appointment reminders
+    REMINDER_SCHEDULER_ENABLED = os.environ.get('REMINDER_SCHEDULER_ENABLED', 'false').lower() == 'true'
+    REMINDER_OFFSETS_MINUTES = os.environ.get('REMINDER_OFFSETS_MINUTES', '1440,120')
+    REMINDER_TICK_SECONDS = int(os.environ.get('REMINDER_TICK_SECONDS', 30))
+    REMINDER_HORIZON_DAYS = int(os.environ.get('REMINDER_HORIZON_DAYS', 7))
+    REMINDER_CURSOR_PATH = os.environ.get('REMINDER_CURSOR_PATH', 'data/reminder_cursor.json')
+
+    # Tenant context resolution (phone / WhatsApp ID / Telegram chat -> assistant)
+    TENANT_CONTEXT_TTL = int(os.environ.get('TENANT_CONTEXT_TTL', 300))
+    TENANT_CONTEXT_NEGATIVE_TTL = int(os.environ.get('TENANT_CONTEXT_NEGATIVE_TTL', 60))
+    TENANT_CONTEXT_MAX_ENTRIES = int(os.environ.get('TENANT_CONTEXT_MAX_ENTRIES', 10000))
+
+    # Conversation memory (multi-turn history per customer)
+    CONVERSATION_MEMORY_ENABLED = os.environ.get('CONVERSATION_MEMORY_ENABLED', 'true').lower() == 'true'
+    CONVERSATION_MEMORY_MAX_CONVERSATIONS = int(os.environ.get('CONVERSATION_MEMORY_MAX_CONVERSATIONS', 10000))
+    CONVERSATION_MEMORY_TOKEN_BUDGET = int(os.environ.get('CONVERSATION_MEMORY_TOKEN_BUDGET', 1000))
+    CONVERSATION_MEMORY_SUMMARIZE_AFTER = int(os.environ.get('CONVERSATION_MEMORY_SUMMARIZE_AFTER', 600))
+    CONVERSATION_MEMORY_IDLE_TTL = int(os.environ.get('CONVERSATION_MEMORY_IDLE_TTL', 86400))
+    CONVERSATION_MEMORY_FLUSH_INTERVAL = float(os.environ.get('CONVERSATION_MEMORY_FLUSH_INTERVAL', 5))
+    CONVERSATION_MEMORY_RELOAD_AFTER = float(os.environ.get('CONVERSATION_MEMORY_RELOAD_AFTER', 300))
+
+    # Conversation log writer (batched inserts, local spill file)
+    CONVERSATION_LOG_BATCH_SIZE = int(os.environ.get('CONVERSATION_LOG_BATCH_SIZE', 200))
+    CONVERSATION_LOG_FLUSH_INTERVAL = float(os.environ.get('CONVERSATION_LOG_FLUSH_INTERVAL', 2))
+    CONVERSATION_LOG_MAX_BUFFER = int(os.environ.get('CONVERSATION_LOG_MAX_BUFFER', 10000))
+    CONVERSATION_LOG_SPILL_PATH = os.environ.get('CONVERSATION_LOG_SPILL_PATH', 'data/conversation_log.ndjson')
+    CONVERSATION_LOG_MAX_SPILL_BYTES = int(os.environ.get('CONVERSATION_LOG_MAX_SPILL_BYTES', 50 * 1024 * 1024))
+
+    # Channel statistics (hourly buckets flushed to channel_stat_rollups)
+    CHANNEL_STATS_RETENTION_HOURS = int(os.environ.get('CHANNEL_STATS_RETENTION_HOURS', 720))
+    CHANNEL_STATS_MAX_TENANTS = int(os.environ.get('CHANNEL_STATS_MAX_TENANTS', 10000))
+    CHANNEL_STATS_FLUSH_INTERVAL = float(os.environ.get('CHANNEL_STATS_FLUSH_INTERVAL', 10))
+
+    # Voice turn latency budget (seconds)
+    VOICE_RESPONSE_BUDGET_SECONDS = float(os.environ.get('VOICE_RESPONSE_BUDGET_SECONDS', 2.5))
+    VOICE_POLL_WAIT_SECONDS = float(os.environ.get('VOICE_POLL_WAIT_SECONDS', 4))
+    VOICE_RESPONSE_DEADLINE_SECONDS = float(os.environ.get('VOICE_RESPONSE_DEADLINE_SECONDS', 10))
+    VOICE_GENERATION_WORKERS = int(os.environ.get('VOICE_GENERATION_WORKERS', 8))
+    VOICE_MAX_PENDING_TURNS = int(os.environ.get('VOICE_MAX_PENDING_TURNS', 1000))
+    # memory:// only with a single worker or sticky routing; sqlite:///path or redis:// are shared
+    VOICE_TURN_STORAGE_URL = os.environ.get('VOICE_TURN_STORAGE_URL') or 'memory://'
+
+    # Intent matcher (compiled keyword automata per assistant)
+    INTENT_MATCHER_MAX_TENANTS = int(os.environ.get('INTENT_MATCHER_MAX_TENANTS', 1000))
+
+    # Tiered answers (tenant knowledge -> business templates -> LLM); generic templates are opt-in
+    ANSWER_TEMPLATES_ENABLED = os.environ.get('ANSWER_TEMPLATES_ENABLED', 'false').lower() == 'true'
+    ANSWER_TEMPLATE_THRESHOLD = float(os.environ.get('ANSWER_TEMPLATE_THRESHOLD', 0.8))
+    ANSWER_KNOWLEDGE_THRESHOLD = float(os.environ.get('ANSWER_KNOWLEDGE_THRESHOLD', 0.6))
+    ANSWER_SEMANTIC_THRESHOLD = float(os.environ.get('ANSWER_SEMANTIC_THRESHOLD', 0.45))
+
+    # Semantic retrieval over training Q&A (memory-mapped float32 matrix per assistant)
+    SEMANTIC_INDEX_ENABLED = os.environ.get('SEMANTIC_INDEX_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_INDEX_PATH = os.environ.get('SEMANTIC_INDEX_PATH', 'data/semantic')
+    SEMANTIC_INDEX_DIM = int(os.environ.get('SEMANTIC_INDEX_DIM', 1024))
+    SEMANTIC_EMBEDDER = os.environ.get('SEMANTIC_EMBEDDER', 'hashed')
+    SEMANTIC_INDEX_MAX_TENANTS = int(os.environ.get('SEMANTIC_INDEX_MAX_TENANTS', 1000))
+
+    # Training data ingestion (bulk inserts per chunk, rows per upload)
+    TRAINING_INSERT_CHUNK_SIZE = int(os.environ.get('TRAINING_INSERT_CHUNK_SIZE', 500))
+    TRAINING_UPLOAD_MAX_ROWS = int(os.environ.get('TRAINING_UPLOAD_MAX_ROWS', 200000))
+    TRAINING_MAX_REPORTED_ERRORS = int(os.environ.get('TRAINING_MAX_REPORTED_ERRORS', 50))
+    TRAINING_KNOWLEDGE_MAX_PAIRS = int(os.environ.get('TRAINING_KNOWLEDGE_MAX_PAIRS', 5000))
+
+    # Appointment listing (cached exact totals per user and status filter)
+    APPOINTMENT_COUNT_TTL_SECONDS = int(os.environ.get('APPOINTMENT_COUNT_TTL_SECONDS', 60))
+
+    # Bulk appointment import/export
+    APPOINTMENT_IMPORT_CHUNK_SIZE = int(os.environ.get('APPOINTMENT_IMPORT_CHUNK_SIZE', 500))
+    APPOINTMENT_IMPORT_MAX_ROWS = int(os.environ.get('APPOINTMENT_IMPORT_MAX_ROWS', 100000))
+    APPOINTMENT_IMPORT_MAX_ERRORS = int(os.environ.get('APPOINTMENT_IMPORT_MAX_ERRORS', 100))
+    APPOINTMENT_EXPORT_PAGE_SIZE = int(os.environ.get('APPOINTMENT_EXPORT_PAGE_SIZE', 1000))
+
+    # Appointment availability (per-day slot index; business_context['business_hours'] overrides the default)
+    APPOINTMENT_DEFAULT_DURATION_MINUTES = int(os.environ.get('APPOINTMENT_DEFAULT_DURATION_MINUTES', 30))
+    AVAILABILITY_DEFAULT_HOURS = os.environ.get('AVAILABILITY_DEFAULT_HOURS', 'mon-fri=09:00-18:00')
+    AVAILABILITY_HORIZON_DAYS = int(os.environ.get('AVAILABILITY_HORIZON_DAYS', 14))
+    AVAILABILITY_DAY_TTL_SECONDS = int(os.environ.get('AVAILABILITY_DAY_TTL_SECONDS', 60))
+    AVAILABILITY_MAX_DAYS = int(os.environ.get('AVAILABILITY_MAX_DAYS', 20000))
     
     @classmethod
     def validate_config(cls):
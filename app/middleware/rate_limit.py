@@ -1,30 +1,210 @@
-
 from flask import request, jsonify
 from functools import wraps
+import logging
+import math
+import os
+import sqlite3
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryGCRABackend:
+    """In-process GCRA state: one theoretical arrival time (TAT) per key"""
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+        self._updates = 0
+
+    def update(self, key, now, interval, window):
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            new_tat = tat + interval
+            allow_at = new_tat - window
+            if now < allow_at:
+                return False, allow_at - now
+
+            self._tats[key] = new_tat
+            self._tats.move_to_end(key)
+            self._updates += 1
+            if self._updates % self.SWEEP_EVERY == 0:
+                self._sweep(now)
+            # Over capacity: drop the least recently updated keys
+            while len(self._tats) > self.max_keys:
+                self._tats.popitem(last=False)
+            return True, 0.0
+
+    def _sweep(self, now):
+        # A key whose TAT is in the past is indistinguishable from a new key
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+
+    def size(self):
+        with self._lock:
+            return len(self._tats)
+
+
+class SQLiteGCRABackend:
+    """GCRA state in SQLite, shared by all workers on the same host"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._updates = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def update(self, key, now, interval, window):
+        connection = self._connection()
+        # BEGIN IMMEDIATE serializes the read-modify-write across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tat = max(row[0] if row else now, now)
+            new_tat = tat + interval
+            allow_at = new_tat - window
+            if now < allow_at:
+                connection.execute("COMMIT")
+                return False, allow_at - now
+
+            connection.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, new_tat))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self._updates += 1
+            purge = self._updates % self.PURGE_EVERY == 0
+        if purge:
+            connection.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,))
+        return True, 0.0
+
+    def size(self):
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+
+class RedisGCRABackend:
+    """GCRA state in Redis, shared across hosts; the key expires when it goes idle"""
+
+    SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - window
+if now < allow_at then
+    return {0, string.format('%.6f', allow_at - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.6f', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        # Fail at startup (and fall back) rather than on the first request
+        self.client.ping()
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def update(self, key, now, interval, window):
+        allowed, retry_after = self._script(keys=[self.prefix + key], args=[now, interval, window])
+        return bool(allowed), float(retry_after)
+
+    def size(self):
+        return None
+
+
+def create_rate_limit_backend(storage_url, max_keys=100000):
+    """Build the backend from RATELIMIT_STORAGE_URL: memory://, sqlite:///path or redis://
+
+    A backend that cannot be built (missing redis package, unreachable server, bad
+    path) falls back to the in-memory backend so the app still boots.
+    """
+    try:
+        if storage_url.startswith('sqlite:///'):
+            return SQLiteGCRABackend(storage_url[len('sqlite:///'):])
+        if storage_url.startswith(('redis://', 'rediss://')):
+            return RedisGCRABackend(storage_url)
+    except Exception as e:
+        logger.error(f"Rate limit backend {storage_url} unavailable, using in-memory limits: {e}")
+    return MemoryGCRABackend(max_keys)
+
 
 class RateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(deque)
-    
+    """GCRA (token bucket equivalent) limiter: `limit` requests per `window` seconds, bursts up to `limit`"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryGCRABackend()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def check(self, key, limit, window):
+        """Return (allowed, retry_after_seconds) for the key"""
+        try:
+            allowed, retry_after = self.backend.update(key, time.time(), window / limit, window)
+        except Exception as e:
+            # Fail open: a broken backend must not take the API down
+            logger.error(f"Rate limit backend error: {e}")
+            with self._lock:
+                self.errors += 1
+            return True, 0.0
+
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        return allowed, retry_after
+
     def is_allowed(self, key, limit, window):
         """Check if request is allowed based on rate limit"""
-        now = time.time()
-        
-        # Remove old requests outside the window
-        while self.requests[key] and self.requests[key][0] <= now - window:
-            self.requests[key].popleft()
-        
-        # Check if limit exceeded
-        if len(self.requests[key]) >= limit:
-            return False
-        
-        # Add current request
-        self.requests[key].append(now)
-        return True
-
-rate_limiter = RateLimiter()
+        return self.check(key, limit, window)[0]
+
+    def get_stats(self):
+        try:
+            tracked = self.backend.size()
+        except Exception:
+            tracked = None
+        return {
+            "backend": type(self.backend).__name__,
+            "tracked_keys": tracked,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "errors": self.errors
+        }
+
+
+rate_limiter = RateLimiter(create_rate_limit_backend(Config.RATELIMIT_STORAGE_URL, Config.RATELIMIT_MAX_KEYS))
 
 def rate_limit(limit=100, window=3600, per='ip'):
     """Rate limiting decorator"""
@@ -37,14 +217,19 @@ def rate_limit(limit=100, window=3600, per='ip'):
                 key = getattr(request, 'current_user', {}).get('user_id', request.remote_addr)
             else:
                 key = request.remote_addr
-            
-            if not rate_limiter.is_allowed(key, limit, window):
-                return jsonify({
+
+            # Each endpoint gets its own bucket
+            allowed, retry_after = rate_limiter.check(f"{f.__module__}.{f.__name__}:{per}:{key}", limit, window)
+            if not allowed:
+                response = jsonify({
                     'error': 'Rate limit exceeded',
                     'limit': limit,
-                    'window': window
-                }), 429
-            
+                    'window': window,
+                    'retry_after': math.ceil(retry_after)
+                })
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response, 429
+
             return f(*args, **kwargs)
         return decorated_function
     return decorator
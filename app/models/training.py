@@ -50,6 +50,7 @@ class BulkTrainingUpload(BaseModel):
     user_id: str
     training_data: List[Dict]
     auto_categorize: bool = True
+    assistant_id: Optional[str] = None
 
 # Plantillas de entrenamiento por nicho
 TRAINING_TEMPLATES = {
@@ -208,4 +209,28 @@ TRAINING_TEMPLATES = {
             }
         ]
     }
-}
\ No newline at end of file
+}
+
+# Respuestas predefinidas por tipo de negocio y tipo de consulta
+BUSINESS_TEMPLATES = {
+    "clinic": {
+        "appointment": "Para agendar una cita médica, necesito algunos datos: ¿Para qué especialidad necesitas la cita? ¿Tienes alguna preferencia de fecha y horario? 📅",
+        "services": "Ofrecemos servicios de medicina general y especialidades médicas. ¿Te interesa alguna especialidad en particular? 🏥",
+        "pricing": "Los costos varían según el tipo de consulta y especialidad. ¿Podrías decirme qué tipo de consulta necesitas para darte información más específica? 💰"
+    },
+    "management": {
+        "appointment": "Para programar una consulta, ¿sobre qué tipo de trámite o gestión necesitas asesoría? ¿Tienes disponibilidad esta semana? 📋",
+        "services": "Gestionamos trámites fiscales, laborales y administrativos. ¿En qué área específica necesitas ayuda? 📊",
+        "pricing": "Nuestros honorarios varían según la complejidad del trámite. ¿Podrías contarme más sobre lo que necesitas gestionar? 💼"
+    },
+    "property_admin": {
+        "appointment": "¿Necesitas una visita para ver una propiedad o es para gestiones administrativas? ¿Qué día te viene mejor? 🏢",
+        "services": "Administramos propiedades, gestionamos inquilinos y mantenimiento. ¿Con qué tema específico necesitas ayuda? 🏠",
+        "pricing": "Las tarifas dependen del tipo de propiedad y servicios. ¿Podrías contarme más sobre tu propiedad? 🏘️"
+    },
+    "ecommerce": {
+        "product_info": "¿Qué producto te interesa? Puedo ayudarte con información detallada, disponibilidad y precios 🛍️",
+        "shipping": "Tenemos diferentes opciones de envío. ¿A qué ciudad necesitas el envío para darte los costos exactos? 📦",
+        "support": "¿Con qué puedo ayudarte hoy? ¿Es sobre un pedido existente o estás buscando un producto específico? 🛒"
+    }
+}
@@ -1,8 +1,14 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models.appointment import AppointmentCreate, AppointmentUpdate
 from app.utils.database import db
+from app.utils.pagination import encode_cursor, decode_cursor, parse_fields
+from app.services.count_cache import appointment_counts
+from app.services.appointment_bulk import appointment_bulk
+from app.services.availability import SLOT_TAKEN, UNIQUE_VIOLATION, availability
+from app.services.reminder_scheduler import ACTIVE_STATUSES
+from app.utils.bulk_io import CSV_MIMETYPES, NDJSON_MIMETYPES, csv_chunk, iter_csv, iter_ndjson, ndjson_chunk
 import logging
 from pydantic import ValidationError
 from datetime import datetime
@@ -10,6 +16,43 @@ from datetime import datetime
 appointments_bp = Blueprint('appointments', __name__, url_prefix='/api/appointments')
 logger = logging.getLogger(__name__)
 
+# Columnas de las vistas de lista; ?fields= elige un subconjunto de APPOINTMENT_FIELDS
+APPOINTMENT_LIST_FIELDS = (
+    'id', 'customer_name', 'customer_phone', 'customer_email', 'appointment_date',
+    'appointment_time', 'service', 'status', 'appointment_type'
+)
+APPOINTMENT_FIELDS = APPOINTMENT_LIST_FIELDS + ('assistant_id', 'notes', 'created_at', 'updated_at')
+MAX_PAGE_SIZE = 100
+
+# ?total= -> modo de conteo de PostgREST (exact se cachea por usuario y estado)
+TOTAL_MODES = {'exact': 'exact', 'estimated': 'planned', 'none': None}
+
+# Huecos libres sugeridos cuando la hora pedida no está disponible
+SUGGESTED_SLOTS = 3
+MAX_SLOTS = 50
+
+UNAVAILABLE_MESSAGES = {
+    'slot_taken': "La hora solicitada ya está ocupada",
+    'outside_business_hours': "La hora solicitada está fuera del horario de atención",
+    'off_slot_grid': "La hora solicitada no coincide con el inicio de ningún hueco"
+}
+
+def unavailable_response(user_id, reason, appointment_date):
+    """409 con el motivo y los próximos huecos libres desde el día pedido"""
+    after = max(datetime.combine(appointment_date, datetime.min.time()), datetime.now())
+    return jsonify({
+        "error": UNAVAILABLE_MESSAGES[reason],
+        "reason": reason,
+        "next_slots": availability.next_slots(user_id, after, SUGGESTED_SLOTS)
+    }), 409
+
+def is_slot_conflict(error):
+    """La base de datos rechazó la cita porque la hora ya está reservada"""
+    code = getattr(error, 'code', None)
+    if code is None and error.args and isinstance(error.args[0], dict):
+        code = error.args[0].get('code')
+    return str(code) == UNIQUE_VIOLATION
+
 @appointments_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_appointments():
@@ -17,27 +60,74 @@ def get_appointments():
         user_id = get_jwt_identity()
         
         # Parámetros de consulta
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 10))
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_PAGE_SIZE)
         status = request.args.get('status')
+        cursor = request.args.get('cursor')
+        total_mode = request.args.get('total', 'exact')
+        
+        if total_mode not in TOTAL_MODES:
+            return jsonify({"error": "total debe ser exact, estimated o none"}), 400
+        
+        # El cursor necesita appointment_date e id de la última fila
+        fields = parse_fields(request.args.get('fields'), APPOINTMENT_FIELDS, APPOINTMENT_LIST_FIELDS,
+                              required=('id', 'appointment_date'))
+        if fields is None:
+            return jsonify({"error": "Campos no válidos", "allowed_fields": list(APPOINTMENT_FIELDS)}), 400
         
-        query = db.get_client().table("appointments").select("*").eq("user_id", user_id)
+        # El total exacto solo se pide a la base de datos si no está en caché
+        count_key = (user_id, status or '')
+        total = appointment_counts.get(count_key) if total_mode == 'exact' else None
+        count = TOTAL_MODES[total_mode] if total is None else None
+        
+        query = db.get_client().table("appointments").select(','.join(fields), count=count).eq("user_id", user_id)
         
         if status:
             query = query.eq("status", status)
         
-        # Paginación
-        start = (page - 1) * limit
-        end = start + limit - 1
+        page = None
+        if cursor:
+            # Keyset sobre (appointment_date, id) descendente: coste constante en cualquier página
+            try:
+                position = decode_cursor(cursor)
+                if position.get('s') != status:
+                    raise ValueError("El cursor corresponde a otro filtro")
+                after_date, after_id = position['d'], position['i']
+            except (ValueError, KeyError) as e:
+                return jsonify({"error": str(e) if isinstance(e, ValueError) else "Cursor inválido"}), 400
+            query = query.or_(f"appointment_date.lt.{after_date},and(appointment_date.eq.{after_date},id.lt.{after_id})")
+        elif 'page' in request.args:
+            # Paginación por desplazamiento (compatibilidad); se pide una fila extra para has_more
+            page = max(request.args.get('page', 1, type=int), 1)
+            start = (page - 1) * limit
+            query = query.range(start, start + limit)
         
-        result = query.range(start, end).order("appointment_date", desc=True).execute()
+        query = query.order("appointment_date", desc=True).order("id", desc=True)
+        if page is None:
+            query = query.limit(limit + 1)
+        result = query.execute()
         
-        return jsonify({
-            "appointments": result.data,
-            "total": len(result.data),
-            "page": page,
-            "limit": limit
-        }), 200
+        rows = result.data or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        if count == 'exact' and result.count is not None:
+            total = result.count
+            appointment_counts.set(count_key, total)
+        elif count == 'planned':
+            total = result.count
+        
+        response = {
+            "appointments": rows,
+            "total": total,
+            "total_estimated": total_mode == 'estimated',
+            "limit": limit,
+            "has_more": has_more,
+            "next_cursor": encode_cursor({'d': rows[-1]['appointment_date'], 'i': rows[-1]['id'], 's': status}) if has_more else None
+        }
+        if page is not None:
+            response["page"] = page
+        
+        return jsonify(response), 200
         
     except Exception as e:
         logger.error(f"Get appointments error: {e}")
@@ -52,6 +142,11 @@ def create_appointment():
         
         appointment_data = AppointmentCreate(**data)
         
+        # Comprobar horario y solapamientos antes de insertar
+        reason = availability.check(user_id, appointment_data.appointment_date, appointment_data.appointment_time)
+        if reason:
+            return unavailable_response(user_id, reason, appointment_data.appointment_date)
+        
         # Crear registro de cita
         appointment_record = {
             "user_id": user_id,
@@ -65,9 +160,18 @@ def create_appointment():
             "notes": appointment_data.notes
         }
         
-        result = db.get_client().table("appointments").insert(appointment_record).execute()
+        try:
+            result = db.get_client().table("appointments").insert(appointment_record).execute()
+        except Exception as e:
+            if not is_slot_conflict(e):
+                raise
+            # La caché de huecos de este worker no había visto la reserva concurrente
+            availability.invalidate(user_id)
+            return unavailable_response(user_id, SLOT_TAKEN, appointment_data.appointment_date)
+        appointment_counts.invalidate(user_id)
         
         if result.data:
+            availability.add(user_id, result.data[0])
             return jsonify({
                 "message": "Cita creada exitosamente",
                 "appointment": result.data[0]
@@ -91,7 +195,8 @@ def update_appointment(appointment_id):
         update_data = AppointmentUpdate(**data)
         
         # Verificar que la cita pertenece al usuario
-        existing = db.get_client().table("appointments").select("id").eq("id", appointment_id).eq("user_id", user_id).execute()
+        existing = db.get_client().table("appointments").select("id,appointment_date,appointment_time,status") \
+            .eq("id", appointment_id).eq("user_id", user_id).execute()
         
         if not existing.data:
             return jsonify({"error": "Cita no encontrada"}), 404
@@ -105,9 +210,31 @@ def update_appointment(appointment_id):
                 update_record[field] = value
         
         if update_record:
+            # Revalidar el hueco si la cita cambia de fecha u hora o vuelve a estar activa
+            current = {**existing.data[0], **{key: value for key, value in update_record.items() if value}}
+            moved = any(current[field] != existing.data[0][field] for field in ('appointment_date', 'appointment_time', 'status'))
+            if moved and current['status'] in ACTIVE_STATUSES:
+                appointment_date = datetime.strptime(str(current['appointment_date']), '%Y-%m-%d').date()
+                reason = availability.check(user_id, appointment_date, str(current['appointment_time']),
+                                            exclude_id=appointment_id)
+                if reason:
+                    return unavailable_response(user_id, reason, appointment_date)
+            
             update_record['updated_at'] = datetime.utcnow().isoformat()
             
-            result = db.get_client().table("appointments").update(update_record).eq("id", appointment_id).execute()
+            try:
+                result = db.get_client().table("appointments").update(update_record).eq("id", appointment_id).execute()
+            except Exception as e:
+                if not is_slot_conflict(e):
+                    raise
+                availability.invalidate(user_id)
+                return unavailable_response(
+                    user_id, SLOT_TAKEN, datetime.strptime(str(current['appointment_date']), '%Y-%m-%d').date()
+                )
+            if 'status' in update_record:
+                appointment_counts.invalidate(user_id)
+            if moved:
+                availability.update(user_id, result.data[0] if result.data else current)
             
             return jsonify({
                 "message": "Cita actualizada exitosamente",
@@ -132,6 +259,8 @@ def delete_appointment(appointment_id):
         result = db.get_client().table("appointments").delete().eq("id", appointment_id).eq("user_id", user_id).execute()
         
         if result.data:
+            appointment_counts.invalidate(user_id)
+            availability.remove(appointment_id)
             return jsonify({"message": "Cita eliminada exitosamente"}), 200
         
         return jsonify({"error": "Cita no encontrada"}), 404
@@ -139,3 +268,102 @@ def delete_appointment(appointment_id):
     except Exception as e:
         logger.error(f"Delete appointment error: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
+
+@appointments_bp.route('/availability', methods=['GET'])
+@jwt_required()
+def get_availability():
+    """Próximos huecos libres; con date y time indica además si esa hora está disponible"""
+    try:
+        user_id = get_jwt_identity()
+        count = min(max(request.args.get('count', 5, type=int), 1), MAX_SLOTS)
+        
+        try:
+            day = request.args.get('date') or request.args.get('from')
+            day = datetime.strptime(day, '%Y-%m-%d').date() if day else None
+            slot_time = datetime.strptime(request.args['time'], '%H:%M').time() if request.args.get('time') else None
+        except ValueError:
+            return jsonify({"error": "date debe ser YYYY-MM-DD y time HH:MM"}), 400
+        
+        after = max(datetime.combine(day, slot_time or datetime.min.time()), datetime.now()) if day else datetime.now()
+        response = {
+            "slots": availability.next_slots(user_id, after, count),
+            "duration_minutes": availability.duration_for(user_id)
+        }
+        if day and slot_time:
+            reason = availability.check(user_id, day, slot_time)
+            response.update({"available": reason is None, "reason": reason})
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        logger.error(f"Get availability error: {e}")
+        return jsonify({"error": "Error obteniendo disponibilidad"}), 500
+
+@appointments_bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_appointments():
+    """Importación masiva de citas desde CSV o NDJSON leído en streaming"""
+    try:
+        user_id = get_jwt_identity()
+        import_format = request.args.get('format') or (
+            'csv' if request.mimetype in CSV_MIMETYPES else 'ndjson' if request.mimetype in NDJSON_MIMETYPES else None
+        )
+        
+        if import_format == 'csv':
+            rows = iter_csv(request.stream)
+        elif import_format == 'ndjson':
+            rows = iter_ndjson(request.stream)
+        else:
+            return jsonify({"error": "Formato no soportado: envía text/csv o application/x-ndjson"}), 415
+        
+        report = appointment_bulk.import_rows(user_id, rows, dry_run=request.args.get('dry_run', 'false').lower() == 'true')
+        
+        return jsonify({
+            "message": "Importación completada",
+            "created_count": report["inserted"],
+            "report": report
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Import appointments error: {e}")
+        return jsonify({"error": "Error importando citas"}), 500
+
+@appointments_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_appointments():
+    """Exportar las citas en CSV o NDJSON; las filas se envían según se leen"""
+    user_id = get_jwt_identity()
+    export_format = request.args.get('format', 'csv')
+    
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format debe ser csv o ndjson"}), 400
+    
+    fields = parse_fields(request.args.get('fields'), APPOINTMENT_FIELDS, APPOINTMENT_FIELDS)
+    if fields is None:
+        return jsonify({"error": "Campos no válidos", "allowed_fields": list(APPOINTMENT_FIELDS)}), 400
+    
+    pages = appointment_bulk.export_pages(
+        user_id, fields,
+        status=request.args.get('status'),
+        date_from=request.args.get('from'),
+        date_to=request.args.get('to')
+    )
+    
+    def generate():
+        try:
+            if export_format == 'csv':
+                yield csv_chunk([], fields, header=True)
+            for rows in pages:
+                yield csv_chunk(rows, fields) if export_format == 'csv' else ndjson_chunk(
+                    {field: row.get(field) for field in fields} for row in rows
+                )
+        except Exception as e:
+            # Las cabeceras ya se enviaron: se corta el stream y queda registrado
+            logger.error(f"Export appointments error: {e}")
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=appointments.{export_format}"}
+    )
@@ -1,13 +1,24 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models.assistant import (
     AssistantCreate, AssistantResponse, AssistantUpdate, 
     DEFAULT_BUSINESS_CONTEXTS, AssistantStatus
 )
 from app.utils.database import db
-from app.services.openai_service import OpenAIService
+from app.services.openai_service import OpenAIService, StreamInterrupted
+from app.services.knowledge_index import knowledge_index_registry
+from app.services.response_cache import response_cache
+from app.services.tenant_resolver import tenant_resolver
+from app.services.intent_matcher import intent_matcher
+from app.services.answer_engine import answer_engine
+from app.services.availability import availability
+from app.services.conversation_log import CONVERSATION_LOG_TABLE, conversation_logger
+from app.services.channel_stats import channel_stats
+import json
 import logging
+import time
+from datetime import datetime
 from pydantic import ValidationError
 import uuid
 
@@ -74,6 +85,8 @@ def create_assistant():
         result = db.get_client().table("assistants").insert(assistant_record).execute()
         
         if result.data:
+            # Los números del nuevo asistente pueden estar en la caché negativa
+            tenant_resolver.invalidate()
             return jsonify({
                 "message": "Asistente creado exitosamente",
                 "assistant": result.data[0]
@@ -109,8 +122,20 @@ def update_assistant(assistant_id):
             if value is not None:
                 update_fields[field] = value
         
+        if isinstance(update_fields.get('business_context'), dict):
+            # Versión del conocimiento: los índices en disco no vuelven a una copia anterior
+            update_fields['business_context']['knowledge_version'] = time.time()
+
         if update_fields:
             result = db.get_client().table("assistants").update(update_fields).eq("id", assistant_id).execute()
+            tenant_resolver.invalidate(assistant_id)
+            
+            if 'business_context' in update_fields:
+                knowledge_index_registry.invalidate(assistant_id)
+                response_cache.invalidate(assistant_id)
+                intent_matcher.invalidate(assistant_id)
+                answer_engine.invalidate(assistant_id)
+                availability.invalidate(user_id)
             
             if result.data:
                 return jsonify({
@@ -141,6 +166,11 @@ def delete_assistant(assistant_id):
         
         # Eliminar asistente
         db.get_client().table("assistants").delete().eq("id", assistant_id).execute()
+        knowledge_index_registry.invalidate(assistant_id)
+        response_cache.invalidate(assistant_id)
+        tenant_resolver.invalidate(assistant_id)
+        intent_matcher.invalidate(assistant_id)
+        answer_engine.invalidate(assistant_id, deleted=True)
         
         return jsonify({"message": "Asistente eliminado exitosamente"}), 200
         
@@ -167,24 +197,106 @@ def chat_with_assistant(assistant_id):
             return jsonify({"error": "Asistente no encontrado"}), 404
         
         assistant = assistant_result.data[0]
+        started_at = time.monotonic()
         
         # Generar respuesta usando OpenAI
-        response = openai_service.generate_response(
+        response, tier = openai_service.generate_answer(
             message, 
             assistant['business_context'],
-            assistant['personality']
+            assistant['personality'],
+            assistant_id=assistant_id
         )
         
         # Incrementar contador de conversaciones
         db.get_client().table("assistants").update({
             "total_conversations": assistant['total_conversations'] + 1
         }).eq("id", assistant_id).execute()
+        log_chat(assistant_id, user_id, message, response, tier)
+        channel_stats.record(user_id, 'web', (time.monotonic() - started_at) * 1000,
+                             responded=response != openai_service.ERROR_RESPONSE)
         
         return jsonify({
             "response": response,
-            "assistant_name": assistant['name']
+            "assistant_name": assistant['name'],
+            "tier": tier
         }), 200
         
     except Exception as e:
         logger.error(f"Chat with assistant error: {e}")
         return jsonify({"error": "Error procesando mensaje"}), 500
+
+@assistants_bp.route('/<assistant_id>/chat/stream', methods=['POST'])
+@jwt_required()
+def chat_with_assistant_stream(assistant_id):
+    """Chatear con el asistente recibiendo la respuesta por Server-Sent Events"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        message = data.get('message', '')
+        
+        if not message:
+            return jsonify({"error": "Mensaje requerido"}), 400
+        
+        assistant_result = db.get_client().table("assistants").select("*").eq("id", assistant_id).eq("user_id", user_id).execute()
+        
+        if not assistant_result.data:
+            return jsonify({"error": "Asistente no encontrado"}), 404
+        
+        assistant = assistant_result.data[0]
+        
+    except Exception as e:
+        logger.error(f"Chat stream with assistant error: {e}")
+        return jsonify({"error": "Error procesando mensaje"}), 500
+    
+    def generate():
+        chunks = []
+        started_at = time.monotonic()
+        first_chunk_ms = None
+        tier = None
+        try:
+            for chunk, tier in openai_service.generate_response_stream(
+                message,
+                assistant['business_context'],
+                assistant['personality'],
+                assistant_id=assistant_id
+            ):
+                if first_chunk_ms is None:
+                    first_chunk_ms = (time.monotonic() - started_at) * 1000
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            
+            response = ''.join(chunks)
+            yield f"event: done\ndata: {json.dumps({'response': response, 'assistant_name': assistant['name'], 'tier': tier}, ensure_ascii=False)}\n\n"
+        except StreamInterrupted:
+            # La respuesta quedó a medias: el cliente no debe tomarla como completa
+            tier = 'error'
+            yield f"event: error\ndata: {json.dumps({'error': 'Respuesta interrumpida', 'partial_response': ''.join(chunks)}, ensure_ascii=False)}\n\n"
+        finally:
+            # Al terminar (o cortarse) el stream: registrar el texto completo y contar la conversación
+            log_chat(assistant_id, user_id, message, ''.join(chunks), tier)
+            # En streaming el tiempo de respuesta es el del primer fragmento
+            channel_stats.record(user_id, 'web', first_chunk_ms, responded=bool(chunks) and tier != 'error')
+            try:
+                db.get_client().table("assistants").update({
+                    "total_conversations": assistant['total_conversations'] + 1
+                }).eq("id", assistant_id).execute()
+            except Exception as e:
+                logger.error(f"Error updating conversation counter: {e}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def log_chat(assistant_id, user_id, message, response, tier=None):
+    """Registrar el intercambio del chat web (inserción diferida en bloque)"""
+    conversation_logger.log(CONVERSATION_LOG_TABLE, {
+        "assistant_id": assistant_id,
+        "user_id": user_id,
+        "channel": "web",
+        "user_message": message,
+        "bot_response": response,
+        "answer_tier": tier,
+        "created_at": datetime.utcnow().isoformat()
+    })
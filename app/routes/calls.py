@@ -1,10 +1,13 @@
-from flask import Blueprint, request, Response, jsonify
+from flask import Blueprint, request, jsonify
 from app.services.call_service import CallService
 from app.services.openai_service import OpenAIService
+from app.services.call_analytics import call_analytics
+from app.services.intent_matcher import intent_matcher
+from app.services.tenant_resolver import tenant_resolver
 from app.utils.database import db
+from app.utils.twiml import TwiML, twiml_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import logging
-from datetime import datetime, timedelta
 from urllib.parse import unquote
 
 calls_bp = Blueprint('calls', __name__, url_prefix='/api/calls')
@@ -15,70 +18,25 @@ openai_service = OpenAIService()
 
 @calls_bp.route('/stats', methods=['GET'])
 @jwt_required()
-def get_call_stats():
-    """Obtener estadísticas de llamadas del usuario"""
+def get_calls_stats():
+    """Obtener estadísticas de llamadas desde los agregados diarios"""
     try:
         user_id = get_jwt_identity()
+        days = min(max(request.args.get('days', 7, type=int), 1), 90)
 
-        # Obtener estadísticas de llamadas desde la base de datos
-        # Por ahora simulamos los datos, luego se conectará con la tabla de analytics
-        today = datetime.now().date()
-        week_ago = today - timedelta(days=7)
-
-        # Simular datos de llamadas (en producción vendría de la BD)
-        call_stats = {
-            "total_calls": 15,  # Total de llamadas atendidas
-            "answered_calls": 12,  # Llamadas respondidas exitosamente
-            "missed_calls": 3,   # Llamadas perdidas
-            "avg_duration": "2:45",  # Duración promedio
-            "success_rate": 80,  # Porcentaje de éxito
-            "today_calls": 5,    # Llamadas de hoy
-            "week_calls": 15,    # Llamadas de la semana
-            "peak_hours": "10:00-12:00",  # Horario pico
-        }
+        call_stats = call_analytics.get_stats(user_id, days)
 
         return jsonify({
-            "conversations": call_stats["total_calls"],
-            "responses": call_stats["answered_calls"],
-            "success_rate": call_stats["success_rate"],
-            "avg_duration": call_stats["avg_duration"],
-            "today_calls": call_stats["today_calls"],
-            "details": call_stats
-        }), 200
-
-    except Exception as e:
-        logger.error(f"Error getting call stats: {e}")
-        return jsonify({"error": "Error obteniendo estadísticas"}), 500
-
-
-
-from flask import Blueprint, request, Response, jsonify
-from app.services.call_service import CallService
-from app.services.openai_service import OpenAIService
-from app.utils.database import db
-import logging
-from datetime import datetime
-from urllib.parse import unquote
-
-calls_bp = Blueprint('calls', __name__, url_prefix='/api/calls')
-logger = logging.getLogger(__name__)
-
-call_service = CallService()
-openai_service = OpenAIService()
-
-@calls_bp.route('/stats', methods=['GET'])
-def get_calls_stats():
-    """Obtener estadísticas de llamadas"""
-    try:
-        # Por ahora devolvemos datos simulados
-        return jsonify({
-            'conversations': 5,
-            'responses': 4,
-            'avg_response_time': '3.5 min',
-            'status': 'active'
+            'conversations': call_stats['total_calls'],
+            'responses': call_stats['answered_calls'],
+            'success_rate': call_stats['success_rate'],
+            'avg_duration': call_stats['avg_duration'],
+            'today_calls': call_stats['today_calls'],
+            'status': 'active',
+            'details': call_stats
         })
     except Exception as e:
-        print(f"Error getting calls stats: {e}")
+        logger.error(f"Error getting calls stats: {e}")
         return jsonify({
             'conversations': 0,
             'responses': 0,
@@ -122,6 +80,43 @@ def make_call():
         logger.error(f"Error in make_call endpoint: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+# Respuestas estáticas precompiladas al importar el módulo
+LOW_CONFIDENCE_TWIML = TwiML() \
+    .say("Disculpe, no pude entender bien. ¿Podría repetir su pregunta?") \
+    .gather("/api/calls/process-speech", "Escucho atentamente.") \
+    .redirect("/api/calls/twiml/menu") \
+    .to_bytes()
+
+APPOINTMENT_RESPONSE_TWIML = {
+    '1': TwiML().say("Perfecto, hemos confirmado su asistencia. Le esperamos puntualmente. Gracias.").to_bytes(),
+    '2': TwiML().say("Entendido. Un miembro de nuestro equipo le contactará pronto para reprogramar. Gracias.").to_bytes()
+}
+APPOINTMENT_INVALID_TWIML = TwiML() \
+    .say("Opción no válida. Le enviaremos un mensaje para confirmar su cita. Gracias.") \
+    .to_bytes()
+
+MENU_TWIML = TwiML() \
+    .gather("/api/calls/menu-option",
+            "Para agendar una cita, presione 1. Para información sobre servicios, presione 2. "
+            "Para horarios de atención, presione 3. Para hablar con un representante, presione 0.",
+            input='dtmf', num_digits=1, timeout=10) \
+    .say("Gracias por llamar. Que tenga un buen día.") \
+    .to_bytes()
+
+MENU_OPTION_TWIML = {
+    '1': TwiML().say("Para agendar una cita, le recomendamos usar nuestro WhatsApp o sitio web. "
+                     "Un representante le contactará pronto. Gracias.").to_bytes(),
+    '2': TwiML().say("Ofrecemos servicios de consultoría, asesoría y gestión. "
+                     "Para información detallada, visite nuestro sitio web o envíenos un WhatsApp.").to_bytes(),
+    '3': TwiML().say("Nuestro horario de atención es de lunes a viernes de 9:00 a 18:00 horas.").to_bytes(),
+    '0': TwiML()
+        .say("Le transferimos con un representante. Por favor espere en línea.")
+        .dial("+1234567890", timeout=30, caller_id="+1234567890")
+        .say("Lo sentimos, no hay representantes disponibles. Intente más tarde.")
+        .to_bytes()
+}
+MENU_REDIRECT_TWIML = TwiML().redirect("/api/calls/twiml/menu").to_bytes()
+
 @calls_bp.route('/twiml/appointment-reminder', methods=['GET', 'POST'])
 def appointment_reminder_twiml():
     """Generar TwiML para recordatorio de citas"""
@@ -138,31 +133,19 @@ def appointment_reminder_twiml():
         service = unquote(service)
         business = unquote(business)
 
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Hola {name}. Le llamamos de {business} para recordarle su cita.
-    </Say>
-    <Pause length="1"/>
-    <Say voice="alice" language="es">
-        Su cita para {service} está programada para el {date} a las {time}.
-    </Say>
-    <Pause length="1"/>
-    <Gather input="dtmf" numDigits="1" timeout="10" action="/api/calls/appointment-response" method="POST">
-        <Say voice="alice" language="es">
-            Si puede asistir, presione 1. Si necesita cancelar o reprogramar, presione 2.
-        </Say>
-    </Gather>
-    <Say voice="alice" language="es">
-        No recibimos respuesta. Le enviaremos un mensaje de confirmación. Gracias.
-    </Say>
-</Response>"""
-
-        return Response(twiml, mimetype='application/xml')
+        return twiml_response(TwiML()
+                              .say(f"Hola {name}. Le llamamos de {business} para recordarle su cita.")
+                              .pause(1)
+                              .say(f"Su cita para {service} está programada para el {date} a las {time}.")
+                              .pause(1)
+                              .gather("/api/calls/appointment-response",
+                                      "Si puede asistir, presione 1. Si necesita cancelar o reprogramar, presione 2.",
+                                      input='dtmf', num_digits=1, timeout=10)
+                              .say("No recibimos respuesta. Le enviaremos un mensaje de confirmación. Gracias."))
 
     except Exception as e:
         logger.error(f"Error generating appointment reminder TwiML: {e}")
-        return Response(call_service._get_fallback_twiml(), mimetype='application/xml')
+        return twiml_response(call_service._get_fallback_twiml())
 
 @calls_bp.route('/twiml/interactive', methods=['GET', 'POST'])
 def interactive_twiml():
@@ -180,25 +163,15 @@ def interactive_twiml():
             'hours': unquote(hours)
         }
 
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Hola, gracias por llamar a {business_context['business_name']}. 
-        Soy su asistente virtual y estoy aquí para ayudarle.
-    </Say>
-    <Gather input="speech" timeout="5" action="/api/calls/process-speech" method="POST">
-        <Say voice="alice" language="es">
-            ¿En qué puedo ayudarle hoy?
-        </Say>
-    </Gather>
-    <Redirect>/api/calls/twiml/menu</Redirect>
-</Response>"""
-
-        return Response(twiml, mimetype='application/xml')
+        return twiml_response(TwiML()
+                              .say(f"Hola, gracias por llamar a {business_context['business_name']}. "
+                                   "Soy su asistente virtual y estoy aquí para ayudarle.")
+                              .gather("/api/calls/process-speech", "¿En qué puedo ayudarle hoy?")
+                              .redirect("/api/calls/twiml/menu"))
 
     except Exception as e:
         logger.error(f"Error generating interactive TwiML: {e}")
-        return Response(call_service._get_fallback_twiml(), mimetype='application/xml')
+        return twiml_response(call_service._get_fallback_twiml())
 
 @calls_bp.route('/process-speech', methods=['POST'])
 def process_speech():
@@ -208,144 +181,50 @@ def process_speech():
         confidence = float(request.form.get('Confidence', 0))
 
         if confidence < 0.5:
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Disculpe, no pude entender bien. ¿Podría repetir su pregunta?
-    </Say>
-    <Gather input="speech" timeout="5" action="/api/calls/process-speech" method="POST">
-        <Say voice="alice" language="es">
-            Escucho atentamente.
-        </Say>
-    </Gather>
-    <Redirect>/api/calls/twiml/menu</Redirect>
-</Response>"""
-            return Response(twiml, mimetype='application/xml')
-
-        # Obtener contexto del negocio (esto debería venir de la sesión o parámetros)
-        business_context = {
+            return twiml_response(LOW_CONFIDENCE_TWIML)
+
+        # Contexto del asistente asociado al número llamado; genérico si no hay ninguno
+        business_context = tenant_resolver.resolve('voice', request.form.get('To')) or {
             'business_name': 'Nuestro negocio',
             'business_type': 'general',
             'services': ['Consultoría', 'Asesoría'],
             'hours': 'Lunes a Viernes 9:00-18:00'
         }
 
+        # Solo una petición explícita ("hablar con una persona") se transfiere sin pasar por el
+        # modelo, y solo si el negocio tiene un teléfono de atención configurado
+        support_phone = business_context.get('support_phone')
+        if support_phone and intent_matcher.explicit_request(speech_result, 'transfer', business_context):
+            return twiml_response(TwiML()
+                                  .say("Le transferimos con un representante. Por favor espere en línea.")
+                                  .dial(support_phone, timeout=30)
+                                  .say("Lo sentimos, no hay representantes disponibles. Intente más tarde."))
+
         # Generar respuesta con OpenAI
         response_twiml = call_service.generate_twiml_response(speech_result, business_context)
 
-        return Response(response_twiml, mimetype='application/xml')
+        return twiml_response(response_twiml)
 
     except Exception as e:
         logger.error(f"Error processing speech: {e}")
-        return Response(call_service._get_fallback_twiml(), mimetype='application/xml')
+        return twiml_response(call_service._get_fallback_twiml())
 
 @calls_bp.route('/appointment-response', methods=['POST'])
 def appointment_response():
     """Procesar respuesta del recordatorio de cita"""
-    try:
-        digits = request.form.get('Digits', '')
-
-        if digits == '1':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Perfecto, hemos confirmado su asistencia. Le esperamos puntualmente. Gracias.
-    </Say>
-</Response>"""
-        elif digits == '2':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Entendido. Un miembro de nuestro equipo le contactará pronto para reprogramar. Gracias.
-    </Say>
-</Response>"""
-        else:
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Opción no válida. Le enviaremos un mensaje para confirmar su cita. Gracias.
-    </Say>
-</Response>"""
-
-        return Response(twiml, mimetype='application/xml')
-
-    except Exception as e:
-        logger.error(f"Error processing appointment response: {e}")
-        return Response(call_service._get_fallback_twiml(), mimetype='application/xml')
+    digits = request.form.get('Digits', '')
+    return twiml_response(APPOINTMENT_RESPONSE_TWIML.get(digits, APPOINTMENT_INVALID_TWIML))
 
 @calls_bp.route('/twiml/menu', methods=['GET', 'POST'])
 def menu_twiml():
     """Menú principal de opciones"""
-    twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Gather input="dtmf" numDigits="1" timeout="10" action="/api/calls/menu-option" method="POST">
-        <Say voice="alice" language="es">
-            Para agendar una cita, presione 1.
-            Para información sobre servicios, presione 2.
-            Para horarios de atención, presione 3.
-            Para hablar con un representante, presione 0.
-        </Say>
-    </Gather>
-    <Say voice="alice" language="es">
-        Gracias por llamar. Que tenga un buen día.
-    </Say>
-</Response>"""
-
-    return Response(twiml, mimetype='application/xml')
+    return twiml_response(MENU_TWIML)
 
 @calls_bp.route('/menu-option', methods=['POST'])
 def menu_option():
     """Procesar selección del menú"""
-    try:
-        digits = request.form.get('Digits', '')
-
-        if digits == '1':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Para agendar una cita, le recomendamos usar nuestro WhatsApp o sitio web. 
-        Un representante le contactará pronto. Gracias.
-    </Say>
-</Response>"""
-        elif digits == '2':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Ofrecemos servicios de consultoría, asesoría y gestión. 
-        Para información detallada, visite nuestro sitio web o envíenos un WhatsApp.
-    </Say>
-</Response>"""
-        elif digits == '3':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Nuestro horario de atención es de lunes a viernes de 9:00 a 18:00 horas.
-    </Say>
-</Response>"""
-        elif digits == '0':
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Le transferimos con un representante. Por favor espere en línea.
-    </Say>
-    <Dial timeout="30" callerId="+1234567890">
-        <Number>+1234567890</Number>
-    </Dial>
-    <Say voice="alice" language="es">
-        Lo sentimos, no hay representantes disponibles. Intente más tarde.
-    </Say>
-</Response>"""
-        else:
-            return Response("""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Redirect>/api/calls/twiml/menu</Redirect>
-</Response>""", mimetype='application/xml')
-
-        return Response(twiml, mimetype='application/xml')
-
-    except Exception as e:
-        logger.error(f"Error processing menu option: {e}")
-        return Response(call_service._get_fallback_twiml(), mimetype='application/xml')
+    digits = request.form.get('Digits', '')
+    return twiml_response(MENU_OPTION_TWIML.get(digits, MENU_REDIRECT_TWIML))
 
 @calls_bp.route('/status', methods=['POST'])
 def call_status():
@@ -358,7 +237,8 @@ def call_status():
         # Registrar el estado de la llamada
         logger.info(f"Call {call_sid} status: {call_status}, duration: {duration}s")
 
-        # Aquí podrías guardar en base de datos el estado de la llamada
+        # Guardar el evento y actualizar los agregados del cliente
+        call_analytics.record_status_callback(request.form)
 
         return jsonify({"status": "received"})
 
@@ -0,0 +1,66 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.config import Config
+from app.services.knowledge_index import knowledge_index_registry
+from app.services.response_cache import response_cache
+from app.services.dedup_store import webhook_deduplicator
+from app.services.http_client import http_client
+from app.services.reminder_scheduler import reminder_scheduler
+from app.services.tenant_resolver import tenant_resolver
+from app.middleware.rate_limit import rate_limiter
+from app.services.conversation_memory import conversation_memory
+from app.services.conversation_log import conversation_logger
+from app.services.call_analytics import call_analytics
+from app.services.channel_stats import channel_stats
+from app.services.voice_turns import voice_turns
+from app.services.intent_matcher import intent_matcher
+from app.services.answer_engine import answer_engine
+from app.services.training_pipeline import training_pipeline
+from app.services.database import db_manager
+from app.services.count_cache import appointment_counts
+from app.services.appointment_bulk import appointment_bulk
+from app.services.availability import availability
+from app.routes.whatsapp import ingestion_pool
+import logging
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+logger = logging.getLogger(__name__)
+
+def metrics_admins():
+    return {user_id.strip() for user_id in Config.METRICS_ADMIN_USER_IDS.split(',') if user_id.strip()}
+
+@metrics_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_metrics():
+    """Obtener métricas internas de rendimiento (solo administradores)"""
+    # Las métricas son de toda la plataforma: sin administradores configurados nadie las ve
+    if str(get_jwt_identity()) not in metrics_admins():
+        return jsonify({"error": "No autorizado"}), 403
+    
+    try:
+        return jsonify({
+            "response_cache": response_cache.get_stats(),
+            "knowledge_index": knowledge_index_registry.get_stats(),
+            "whatsapp_ingestion": ingestion_pool.get_stats(),
+            "webhook_dedup": webhook_deduplicator.get_stats(),
+            "outbound_http": http_client.get_stats(),
+            "reminder_scheduler": reminder_scheduler.get_stats(),
+            "tenant_resolver": tenant_resolver.get_stats(),
+            "rate_limit": rate_limiter.get_stats(),
+            "conversation_memory": conversation_memory.get_stats(),
+            "conversation_log": conversation_logger.get_stats(),
+            "call_events": call_analytics.get_ingestion_stats(),
+            "channel_stats": channel_stats.get_stats(),
+            "voice_turns": voice_turns.get_stats(),
+            "intent_matcher": intent_matcher.get_stats(),
+            "answer_tiers": answer_engine.get_stats(),
+            "training_ingest": training_pipeline.get_stats(),
+            "database_pool": db_manager.get_stats(),
+            "appointment_counts": appointment_counts.get_stats(),
+            "appointment_bulk": appointment_bulk.get_stats(),
+            "availability": availability.get_stats()
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Get metrics error: {e}")
+        return jsonify({"error": "Error obteniendo métricas"}), 500
@@ -2,7 +2,17 @@ from flask import Blueprint, request, jsonify
 from app.services.openai_service import OpenAIService
 from app.services.telegram_service import TelegramService
 from app.services.email_service import EmailService
+from app.services.dedup_store import webhook_deduplicator
+from app.services.tenant_resolver import tenant_resolver
+from app.services.conversation_memory import conversation_memory
+from app.services.conversation_log import CONVERSATION_LOG_TABLE, conversation_logger
+from app.services.channel_stats import channel_stats, parse_time_range
+from app.services.intent_matcher import intent_matcher
+from app.services.availability import availability
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.config import Config
 import logging
+import time
 from datetime import datetime
 
 telegram_bp = Blueprint('telegram', __name__, url_prefix='/api/telegram')
@@ -17,6 +27,10 @@ def telegram_webhook():
     try:
         data = request.get_json()
 
+        # Telegram reenvía el update si no respondemos a tiempo
+        if webhook_deduplicator.is_duplicate('telegram', data.get('update_id')):
+            return jsonify({"status": "ok"}), 200
+
         if 'message' in data:
             process_message(data['message'])
         elif 'callback_query' in data:
@@ -36,24 +50,43 @@ def process_message(message):
             text = message['text']
 
             # Comandos especiales
-            if text.startswith('/start'):
+            command = intent_matcher.command(text)
+            if command == 'start':
                 send_welcome_message(chat_id, message['from'])
                 return
-            elif text.startswith('/help'):
+            elif command == 'help':
                 send_help_message(chat_id)
                 return
-            elif text.startswith('/agendar'):
+            elif command == 'appointment':
                 send_appointment_options(chat_id)
                 return
 
             # Procesar mensaje con OpenAI
+            started_at = time.monotonic()
             business_context = get_business_context_telegram(chat_id)
-            response = openai_service.generate_response(text, business_context)
-
-            telegram_service.send_message(chat_id, response)
+            assistant_id = business_context.get('assistant_id')
+            history = conversation_memory.get_history(assistant_id, 'telegram', chat_id) \
+                if Config.CONVERSATION_MEMORY_ENABLED else None
+
+            response, tier = openai_service.generate_answer(
+                text,
+                business_context,
+                business_context.get('personality') or "profesional y amigable",
+                assistant_id=assistant_id,
+                history=history
+            )
+            if Config.CONVERSATION_MEMORY_ENABLED and response != openai_service.ERROR_RESPONSE:
+                conversation_memory.record_turn(assistant_id, 'telegram', chat_id, text, response)
+
+            sent = telegram_service.send_message(chat_id, response)
+            channel_stats.record(
+                business_context.get('user_id'), 'telegram',
+                (time.monotonic() - started_at) * 1000,
+                responded=bool(sent) and response != openai_service.ERROR_RESPONSE
+            )
 
             # Registrar conversación
-            log_telegram_conversation(chat_id, text, response)
+            log_telegram_conversation(chat_id, text, response, tier, business_context)
 
     except Exception as e:
         logger.error(f"Process Telegram message error: {e}")
@@ -179,10 +212,29 @@ Por favor, escríbeme esta información y procesaré tu solicitud inmediatamente
 "Juan Pérez, 123456789, juan@email.com, 15 de enero, 10:00 AM, consulta general"
     """
 
+    # Sugerir los próximos huecos libres del negocio
+    business_context = get_business_context_telegram(chat_id)
+    if business_context.get('user_id'):
+        try:
+            slots = availability.next_slots(business_context['user_id'], datetime.now(), 3, business_context)
+            if slots:
+                text += "\n<b>Próximos huecos disponibles:</b>\n" + "\n".join(
+                    f"🕐 {slot['date']} a las {slot['time']}" for slot in slots
+                )
+        except Exception as e:
+            logger.error(f"Error getting free slots for Telegram: {e}")
+
     telegram_service.send_message(chat_id, text)
 
 def get_business_context_telegram(chat_id):
     """Obtener contexto del negocio para Telegram"""
+    try:
+        business_context = tenant_resolver.resolve('telegram', chat_id)
+        if business_context:
+            return business_context
+    except Exception as e:
+        logger.error(f"Error getting Telegram business context: {e}")
+
     return {
         "business_name": "AIAsistentPro",
         "services": "Consultas médicas, Consultoría empresarial, Gestoría, Administración de fincas",
@@ -192,11 +244,20 @@ def get_business_context_telegram(chat_id):
         "platform": "Telegram"
     }
 
-def log_telegram_conversation(chat_id, message, response):
+def log_telegram_conversation(chat_id, message, response, tier=None, business_context=None):
     """Registrar conversación de Telegram"""
     try:
-        # Aquí implementarías el guardado en base de datos
-        logger.info(f"Telegram conversation - Chat: {chat_id}, Message: {message}, Response: {response}")
+        business_context = business_context or {}
+        conversation_logger.log(CONVERSATION_LOG_TABLE, {
+            "user_id": business_context.get('user_id'),
+            "assistant_id": business_context.get('assistant_id'),
+            "channel": "telegram",
+            "customer_id": str(chat_id),
+            "user_message": message,
+            "bot_response": response,
+            "answer_tier": tier,
+            "created_at": datetime.utcnow().isoformat()
+        })
     except Exception as e:
         logger.error(f"Error logging Telegram conversation: {e}")
 
@@ -217,18 +278,16 @@ Tu cita ha sido confirmada exitosamente.
     telegram_service.send_message(chat_id, text)
 
 @telegram_bp.route('/stats', methods=['GET'])
+@jwt_required()
 def get_telegram_stats():
-    """Obtener estadísticas de Telegram"""
+    """Obtener estadísticas de Telegram (?hours= o ?from=&to=)"""
     try:
-        # Por ahora devolvemos datos simulados
-        return jsonify({
-            'conversations': 12,
-            'responses': 10,
-            'avg_response_time': '2.1 min',
-            'status': 'active'
-        })
+        start, end = parse_time_range(request.args)
+        stats = channel_stats.query(get_jwt_identity(), 'telegram', start, end)
+        stats['status'] = 'active'
+        return jsonify(stats)
     except Exception as e:
-        print(f"Error getting Telegram stats: {e}")
+        logger.error(f"Error getting Telegram stats: {e}")
         return jsonify({
             'conversations': 0,
             'responses': 0,
@@ -1,12 +1,25 @@
 
 from flask import Blueprint, request, jsonify
 import logging
-from app.models.training import TRAINING_TEMPLATES
+from pydantic import ValidationError
+from app.middleware.auth import require_auth
+from app.models.training import TRAINING_TEMPLATES, BulkTrainingUpload
+from app.services.training_pipeline import TRAINING_TABLE, training_pipeline
+from app.utils.bulk_io import NDJSON_MIMETYPES, iter_ndjson
+from app.utils.database import db
 
 logger = logging.getLogger(__name__)
 
 training_bp = Blueprint('training', __name__, url_prefix='/api/training')
 
+def get_target_assistants(user_id, assistant_id=None):
+    """Asistentes cuyo conocimiento se reindexa: el indicado (si es del usuario) o todos los del usuario"""
+    query = db.get_client().table("assistants").select("id").eq("user_id", user_id)
+    if assistant_id:
+        query = query.eq("id", assistant_id)
+    result = query.execute()
+    return [row['id'] for row in result.data or []]
+
 @training_bp.route('/upload', methods=['POST'])
 def upload_training_data():
     """Subir datos de entrenamiento"""
@@ -47,12 +60,20 @@ def get_training_templates(business_type):
         return jsonify({"error": str(e)}), 500
 
 @training_bp.route('/auto-train/<business_type>', methods=['POST'])
+@require_auth
 def auto_train_assistant(business_type):
     """Entrenar asistente automáticamente con plantillas predefinidas"""
     try:
+        user_id = request.current_user['user_id']
+        data = request.get_json(silent=True) or {}
+        
         if business_type not in TRAINING_TEMPLATES:
             return jsonify({"error": "Tipo de negocio no válido"}), 400
         
+        assistant_ids = get_target_assistants(user_id, data.get('assistant_id'))
+        if data.get('assistant_id') and not assistant_ids:
+            return jsonify({"error": "Asistente no encontrado"}), 404
+        
         templates = TRAINING_TEMPLATES[business_type]
         training_data = []
         
@@ -67,13 +88,13 @@ def auto_train_assistant(business_type):
             }
             training_data.append(training_item)
         
-        # Simular guardado en base de datos
-        logger.info(f"Auto-training assistant with {len(training_data)} items for {business_type}")
+        report = training_pipeline.ingest(user_id, enumerate(training_data, 1), assistant_ids)
         
         return jsonify({
             "message": f"Asistente entrenado exitosamente para {business_type}",
-            "training_items_added": len(training_data),
-            "categories": templates["categories"]
+            "training_items_added": report["inserted"],
+            "categories": templates["categories"],
+            "report": report
         }), 200
         
     except Exception as e:
@@ -81,17 +102,28 @@ def auto_train_assistant(business_type):
         return jsonify({"error": str(e)}), 500
 
 @training_bp.route('/data', methods=['POST'])
+@require_auth
 def add_training_data():
     """Agregar datos de entrenamiento manualmente"""
     try:
+        user_id = request.current_user['user_id']
         data = request.get_json()
         
-        # Simular guardado en base de datos
-        logger.info(f"Adding training data: {data}")
+        assistant_ids = get_target_assistants(user_id, data.get('assistant_id'))
+        if data.get('assistant_id') and not assistant_ids:
+            return jsonify({"error": "Asistente no encontrado"}), 404
+        
+        row = {key: value for key, value in data.items() if key != 'assistant_id'}
+        report = training_pipeline.ingest(user_id, [(1, row)], assistant_ids)
+        
+        if report["rejected"]:
+            return jsonify({"error": "Datos inválidos", "details": report["errors"]}), 400
+        if report["failed"]:
+            return jsonify({"error": "Error guardando entrenamiento"}), 500
         
         return jsonify({
-            "message": "Entrenamiento agregado exitosamente",
-            "id": "training_" + str(hash(data.get('question', '')))
+            "message": "Entrenamiento agregado exitosamente" if report["inserted"] else "La pregunta ya existía",
+            "created": bool(report["inserted"])
         }), 200
         
     except Exception as e:
@@ -99,15 +131,21 @@ def add_training_data():
         return jsonify({"error": str(e)}), 500
 
 @training_bp.route('/data', methods=['GET'])
+@require_auth
 def get_training_data():
     """Obtener datos de entrenamiento del usuario"""
     try:
-        # Por ahora retornar datos de ejemplo
-        training_data = []
+        user_id = request.current_user['user_id']
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        
+        result = db.get_client().table(TRAINING_TABLE) \
+            .select("id,training_type,question,answer,category,keywords,status,created_at", count="exact") \
+            .eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
+        training_data = result.data or []
         
         return jsonify({
             "training_data": training_data,
-            "total": len(training_data)
+            "total": result.count if result.count is not None else len(training_data)
         }), 200
         
     except Exception as e:
@@ -115,20 +153,37 @@ def get_training_data():
         return jsonify({"error": str(e)}), 500
 
 @training_bp.route('/bulk-upload', methods=['POST'])
+@require_auth
 def bulk_upload_training():
-    """Carga masiva de datos de entrenamiento"""
+    """Carga masiva de datos de entrenamiento (JSON o NDJSON en streaming)"""
     try:
-        data = request.get_json()
-        training_data = data.get('training_data', [])
+        user_id = request.current_user['user_id']
+        
+        if request.mimetype in NDJSON_MIMETYPES:
+            # Una fila por línea leída directamente del cuerpo: la carga nunca se materializa entera
+            assistant_id = request.args.get('assistant_id')
+            auto_categorize = request.args.get('auto_categorize', 'true').lower() == 'true'
+            rows = iter_ndjson(request.stream)
+        else:
+            upload = BulkTrainingUpload(**{**(request.get_json() or {}), 'user_id': user_id})
+            assistant_id = upload.assistant_id
+            auto_categorize = upload.auto_categorize
+            rows = enumerate(upload.training_data, 1)
+        
+        assistant_ids = get_target_assistants(user_id, assistant_id)
+        if assistant_id and not assistant_ids:
+            return jsonify({"error": "Asistente no encontrado"}), 404
         
-        # Simular procesamiento masivo
-        logger.info(f"Bulk uploading {len(training_data)} training items")
+        report = training_pipeline.ingest(user_id, rows, assistant_ids, auto_categorize)
         
         return jsonify({
             "message": "Carga masiva completada",
-            "created_count": len(training_data)
+            "created_count": report["inserted"],
+            "report": report
         }), 200
         
+    except ValidationError as e:
+        return jsonify({"error": "Datos inválidos", "details": e.errors()}), 400
     except Exception as e:
         logger.error(f"Error in bulk upload: {e}")
         return jsonify({"error": str(e)}), 500
@@ -214,6 +214,7 @@ from flask import Blueprint, request, Response, jsonify
 from app.services.voice_service import VoiceService
 from app.services.openai_service import OpenAIService
 from app.utils.database import db
+from app.utils.twiml import TwiML, twiml_response
 import logging
 from datetime import datetime
 
@@ -235,13 +236,13 @@ def handle_incoming_call():
         }
         
         # Generar TwiML para la llamada entrante
-        twiml_response = voice_service.handle_incoming_call(call_data)
+        twiml = voice_service.handle_incoming_call(call_data)
         
-        return Response(twiml_response, mimetype='application/xml')
+        return twiml_response(twiml)
         
     except Exception as e:
         logger.error(f"Error handling incoming call: {e}")
-        return Response(voice_service._generate_error_twiml(), mimetype='application/xml')
+        return twiml_response(voice_service._generate_error_twiml())
 
 @voice_bp.route('/process_speech', methods=['POST'])
 def process_speech():
@@ -256,64 +257,43 @@ def process_speech():
         }
         
         # Procesar el texto reconocido
-        twiml_response = voice_service.process_speech(speech_data)
+        twiml = voice_service.process_speech(speech_data)
         
-        return Response(twiml_response, mimetype='application/xml')
+        return twiml_response(twiml)
         
     except Exception as e:
         logger.error(f"Error processing speech: {e}")
-        return Response(voice_service._generate_error_twiml(), mimetype='application/xml')
+        return twiml_response(voice_service._generate_error_twiml())
+
+@voice_bp.route('/process_speech/poll', methods=['POST'])
+def poll_speech():
+    """Respuesta pendiente tras el relleno (Twilio llega aquí por <Redirect>)"""
+    return twiml_response(voice_service.poll_speech(request.args.get('turn')))
+
+# Opciones estáticas del menú de citas, precompiladas al importar el módulo
+APPOINTMENT_MENU_TWIML = {
+    # Nueva cita
+    '1': TwiML()
+        .say("Para agendar una nueva cita, necesito algunos datos. Le voy a transferir con nuestro sistema de reservas.")
+        .gather("/api/voice/collect_appointment_data", "Por favor, dígame su nombre completo.", timeout=10)
+        .to_bytes(),
+    # Modificar cita
+    '2': TwiML()
+        .say("Para modificar su cita, le voy a transferir con un representante.")
+        .dial("+1234567890", timeout=30)
+        .to_bytes(),
+    # Hablar con representante
+    '3': TwiML()
+        .say("Le transfiero con un representante. Un momento por favor.")
+        .dial("+1234567890", timeout=30)
+        .to_bytes()
+}
 
 @voice_bp.route('/appointment_menu', methods=['POST'])
 def appointment_menu():
     """Menú para gestión de citas por voz"""
-    try:
-        digits = request.form.get('Digits', '')
-        
-        if digits == '1':
-            # Nueva cita
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Para agendar una nueva cita, necesito algunos datos. 
-        Le voy a transferir con nuestro sistema de reservas.
-    </Say>
-    <Gather input="speech" timeout="10" action="/api/voice/collect_appointment_data" method="POST">
-        <Say voice="alice" language="es">
-            Por favor, dígame su nombre completo.
-        </Say>
-    </Gather>
-</Response>"""
-        elif digits == '2':
-            # Modificar cita
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Para modificar su cita, le voy a transferir con un representante.
-    </Say>
-    <Dial timeout="30">
-        <Number>+1234567890</Number>
-    </Dial>
-</Response>"""
-        elif digits == '3':
-            # Hablar con representante
-            twiml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Le transfiero con un representante. Un momento por favor.
-    </Say>
-    <Dial timeout="30">
-        <Number>+1234567890</Number>
-    </Dial>
-</Response>"""
-        else:
-            twiml = voice_service._generate_fallback_twiml()
-        
-        return Response(twiml, mimetype='application/xml')
-        
-    except Exception as e:
-        logger.error(f"Error in appointment menu: {e}")
-        return Response(voice_service._generate_error_twiml(), mimetype='application/xml')
+    digits = request.form.get('Digits', '')
+    return twiml_response(APPOINTMENT_MENU_TWIML.get(digits) or voice_service._generate_fallback_twiml())
 
 @voice_bp.route('/outbound_twiml', methods=['GET', 'POST'])
 def outbound_twiml():
@@ -321,15 +301,11 @@ def outbound_twiml():
     try:
         message = request.args.get('message', 'Hola, este es un mensaje automático.')
         
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{message}</Say>
-    <Pause length="1"/>
-    <Say voice="alice" language="es">Gracias. Que tenga un buen día.</Say>
-</Response>"""
-        
-        return Response(twiml, mimetype='application/xml')
+        return twiml_response(TwiML()
+                              .say(message)
+                              .pause(1)
+                              .say("Gracias. Que tenga un buen día."))
         
     except Exception as e:
         logger.error(f"Error generating outbound TwiML: {e}")
-        return Response(voice_service._generate_error_twiml(), mimetype='application/xml')
+        return twiml_response(voice_service._generate_error_twiml())
@@ -1,8 +1,16 @@
 from flask import Blueprint, request, jsonify
 from app.services.openai_service import OpenAIService
 from app.services.whatsapp_service import WhatsAppService
-from app.utils.database import db
+from app.services.worker_pool import BackgroundWorkerPool
+from app.services.dedup_store import webhook_deduplicator
+from app.services.tenant_resolver import tenant_resolver
+from app.services.conversation_memory import conversation_memory
+from app.services.conversation_log import CONVERSATION_LOG_TABLE, conversation_logger
+from app.services.channel_stats import channel_stats, parse_time_range
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.config import Config
 import logging
+import time
 from datetime import datetime
 
 whatsapp_bp = Blueprint('whatsapp', __name__, url_prefix='/api/whatsapp')
@@ -10,6 +18,11 @@ logger = logging.getLogger(__name__)
 
 openai_service = OpenAIService()
 whatsapp_service = WhatsAppService()
+ingestion_pool = BackgroundWorkerPool(
+    'whatsapp-ingestion',
+    workers=Config.WHATSAPP_INGESTION_WORKERS,
+    max_queue_depth=Config.WHATSAPP_INGESTION_QUEUE_SIZE
+)
 
 @whatsapp_bp.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -32,11 +45,16 @@ def handle_webhook():
         if not data or 'entry' not in data:
             return jsonify({"status": "error", "message": "Invalid webhook data"}), 400
 
+        queued = True
         for entry in data['entry']:
             if 'changes' in entry:
                 for change in entry['changes']:
                     if change.get('field') == 'messages':
-                        process_message(change['value'])
+                        queued = enqueue_message(change['value']) and queued
+
+        if not queued:
+            # Meta reintenta el webhook; los mensajes ya encolados se descartan por deduplicación
+            return jsonify({"status": "error", "message": "Ingestion queue full"}), 503
 
         return jsonify({"status": "success"}), 200
 
@@ -44,73 +62,113 @@ def handle_webhook():
         logger.error(f"Webhook error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def enqueue_message(message_data) -> bool:
+    """Encolar el mensaje para los workers o procesarlo en línea; False si la cola está llena"""
+    if not Config.WHATSAPP_ASYNC_INGESTION:
+        process_message(message_data)
+        return True
+
+    # Con la cola llena no se procesa en línea: bloquearía el hilo del webhook
+    if not ingestion_pool.submit(process_message, message_data):
+        logger.warning("WhatsApp ingestion queue full, asking Meta to retry the webhook")
+        return False
+    return True
+
 def process_message(message_data):
     try:
         if 'messages' not in message_data:
             return
 
+        # El phone_number_id identifica el número del negocio que recibió el mensaje
+        phone_number_id = message_data.get('metadata', {}).get('phone_number_id')
+
         for message in message_data['messages']:
+            # Meta reintenta el webhook si tardamos: ignorar mensajes ya procesados
+            if webhook_deduplicator.is_duplicate('whatsapp', message.get('id')):
+                continue
+
             if message.get('type') == 'text':
                 phone_number = message['from']
                 text_message = message['text']['body']
+                started_at = time.monotonic()
 
                 # Obtener contexto del negocio (opcional)
-                business_context = get_business_context(phone_number)
+                business_context = get_business_context(phone_number_id)
+                assistant_id = business_context.get('assistant_id')
+                history = conversation_memory.get_history(assistant_id, 'whatsapp', phone_number) \
+                    if Config.CONVERSATION_MEMORY_ENABLED else None
 
                 # Generar respuesta con OpenAI
-                response = openai_service.generate_response(text_message, business_context)
+                response, tier = openai_service.generate_answer(
+                    text_message,
+                    business_context,
+                    business_context.get('personality') or "profesional y amigable",
+                    assistant_id=assistant_id,
+                    history=history
+                )
+                if Config.CONVERSATION_MEMORY_ENABLED and response != openai_service.ERROR_RESPONSE:
+                    conversation_memory.record_turn(assistant_id, 'whatsapp', phone_number, text_message, response)
 
                 # Enviar respuesta
-                whatsapp_service.send_message(phone_number, response)
+                sent = whatsapp_service.send_message(phone_number, response)
+                channel_stats.record(
+                    business_context.get('user_id'), 'whatsapp',
+                    (time.monotonic() - started_at) * 1000,
+                    responded=bool(sent) and response != openai_service.ERROR_RESPONSE
+                )
 
                 # Registrar conversación (opcional)
-                log_conversation(phone_number, text_message, response)
+                log_conversation(phone_number, text_message, response, tier, business_context)
 
     except Exception as e:
         logger.error(f"Process message error: {e}")
 
-def get_business_context(phone_number):
-    """Obtener contexto del negocio basado en el número de teléfono"""
+def get_business_context(phone_number_id):
+    """Obtener contexto del negocio basado en el phone_number_id de WhatsApp"""
     try:
-        # Implementar lógica para obtener contexto del negocio
-        # Por ejemplo, buscar en base de datos según el número
-        return {
-            "business_name": "Mi Negocio",
-            "services": "Consultoría, Asesoría",
-            "hours": "Lunes a Viernes 9:00-18:00"
-        }
+        business_context = tenant_resolver.resolve('whatsapp', phone_number_id)
+        if business_context:
+            return business_context
     except Exception as e:
         logger.error(f"Error getting business context: {e}")
-        return None
 
-def log_conversation(phone_number, message, response):
-    """Registrar conversación en base de datos"""
+    return {
+        "business_name": "Mi Negocio",
+        "services": "Consultoría, Asesoría",
+        "hours": "Lunes a Viernes 9:00-18:00"
+    }
+
+def log_conversation(phone_number, message, response, tier=None, business_context=None):
+    """Registrar conversación en base de datos (inserción diferida en bloque)"""
     try:
+        business_context = business_context or {}
         conversation_record = {
-            "phone_number": phone_number,
+            "user_id": business_context.get('user_id'),
+            "assistant_id": business_context.get('assistant_id'),
+            "channel": "whatsapp",
+            "customer_id": phone_number,
             "user_message": message,
             "bot_response": response,
-            "timestamp": datetime.utcnow().isoformat()
+            "answer_tier": tier,
+            "created_at": datetime.utcnow().isoformat()
         }
 
-        db.get_client().table("conversations").insert(conversation_record).execute()
+        conversation_logger.log(CONVERSATION_LOG_TABLE, conversation_record)
 
     except Exception as e:
         logger.error(f"Error logging conversation: {e}")
 
 @whatsapp_bp.route('/stats', methods=['GET'])
+@jwt_required()
 def get_whatsapp_stats():
-    """Obtener estadísticas de WhatsApp"""
+    """Obtener estadísticas de WhatsApp (?hours= o ?from=&to=)"""
     try:
-        # Por ahora devolvemos datos simulados
-        return jsonify({
-            'conversations': 24,
-            'responses': 18,
-            'avg_response_time': '1.8 min',
-            'status': 'active'
-        })
+        start, end = parse_time_range(request.args)
+        stats = channel_stats.query(get_jwt_identity(), 'whatsapp', start, end)
+        stats['status'] = 'active'
+        return jsonify(stats)
     except Exception as e:
-        print(f"Error getting WhatsApp stats: {e}")
+        logger.error(f"Error getting WhatsApp stats: {e}")
         return jsonify({
             'conversations': 0,
             'responses': 0,
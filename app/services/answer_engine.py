@@ -0,0 +1,246 @@
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.config import Config
+from app.models.training import BUSINESS_TEMPLATES
+from app.services.http_client import LatencyHistogram
+from app.services.knowledge_index import knowledge_index_registry
+from app.services.response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('knowledge', 'semantic', 'template', 'cache', 'llm')
+
+# Intenciones de BUSINESS_TEMPLATES: palabras que la identifican (evidence) y palabras que
+# pueden acompañarla (context). Se compara por palabras completas, ya normalizadas.
+TEMPLATE_INTENTS = {
+    'appointment': (
+        {'cita', 'citas', 'agendar', 'reservar', 'reserva', 'programar', 'turno'},
+        {'pedir', 'solicitar', 'sacar', 'hacer', 'nueva', 'medica', 'consulta', 'visita'}
+    ),
+    'services': (
+        {'servicios', 'servicio', 'ofrecen', 'ofrece', 'ofreces'},
+        {'tipo', 'tipos', 'hacen', 'brindan', 'prestan', 'lista'}
+    ),
+    'pricing': (
+        {'precio', 'precios', 'cuesta', 'cuestan', 'costo', 'costos', 'tarifa', 'tarifas', 'honorarios', 'cobran'},
+        {'consulta', 'servicio', 'servicios', 'tramite', 'visita', 'cita'}
+    ),
+    'product_info': (
+        {'producto', 'productos', 'articulo', 'articulos', 'catalogo'},
+        {'detalles', 'ver', 'venden'}
+    ),
+    'shipping': (
+        {'envio', 'envios', 'enviar', 'envian', 'entrega', 'entregas'},
+        {'opciones', 'formas', 'tipos', 'hacen', 'domicilio'}
+    ),
+    'support': (
+        {'soporte', 'ayuda', 'ayudar', 'ayudame', 'asistencia'},
+        {'compra', 'pedido'}
+    )
+}
+
+# Palabras que no cuentan al puntuar (artículos, preposiciones, fórmulas de cortesía)
+TEMPLATE_STOPWORDS = frozenset("""
+    a al con de del el en la las lo los le les me mi mis o para por se su sus te tu tus un una unos unas y
+    que como cual cuales cuanto cuanta cuantos donde cuando es son hay tienen tiene
+    quiero queria quisiera necesito necesitaria gustaria podria puedo puede pueden saber
+    hola buenas buenos dias tardes noches favor gracias informacion info sobre
+""".split())
+
+# Tipos de negocio de business_context con otro nombre en las plantillas
+BUSINESS_TYPE_ALIASES = {
+    'gestoria': 'management',
+    'property_management': 'property_admin'
+}
+
+# Marcadores de las plantillas -> claves de business_context que los rellenan
+PLACEHOLDERS = {
+    '[TELÉFONO]': ('phone', 'support_phone', 'voice_phone'),
+    '[NÚMERO]': ('whatsapp_number', 'phone'),
+    '[CIUDAD]': ('city',)
+}
+_PLACEHOLDER = re.compile(r"\[[^\]]*\]")
+
+
+def match_template(message: str, query_types) -> Tuple[Optional[str], float]:
+    """Intención de plantilla del mensaje: (tipo de consulta, cobertura) o (None, 0.0)
+
+    Todas las palabras con contenido del mensaje deben pertenecer al vocabulario de la
+    intención (la cobertura es la fracción que lo hace) y al menos una debe ser propia
+    de ella; "quiero cancelar una cita" o "cuánto cuesta el parking" no encajan.
+    """
+    words = [word for word in normalize_message(message).split() if word not in TEMPLATE_STOPWORDS]
+    if not words:
+        return None, 0.0
+
+    best, best_score, tied = None, 0.0, False
+    for query_type in query_types:
+        evidence, context = TEMPLATE_INTENTS[query_type]
+        if not evidence.intersection(words):
+            continue
+        score = sum(1 for word in words if word in evidence or word in context) / len(words)
+        if score > best_score:
+            best, best_score, tied = query_type, score, False
+        elif score == best_score:
+            tied = True
+    # Dos intenciones igual de probables: mejor que responda el LLM
+    return (None, 0.0) if best is None or tied else (best, best_score)
+
+
+def fill_placeholders(answer: str, business_context: Dict) -> Optional[str]:
+    """Rellenar los marcadores con datos del negocio; None si falta alguno"""
+    for placeholder, keys in PLACEHOLDERS.items():
+        if placeholder in answer:
+            value = next((business_context.get(key) for key in keys if business_context.get(key)), None)
+            if value is None:
+                return None
+            answer = answer.replace(placeholder, str(value))
+    return None if _PLACEHOLDER.search(answer) else answer
+
+
+class AnswerEngine:
+    """Respuesta por niveles: conocimiento del cliente -> índice semántico -> plantillas del sector -> LLM
+
+    Los niveles locales se resuelven en memoria; cada nivel tiene su umbral de
+    confianza y se contabiliza qué nivel sirvió cada respuesta.
+    """
+
+    def __init__(self, template_threshold: float = 0.8, knowledge_threshold: float = 0.6,
+                 templates_enabled: bool = False, semantic_enabled: bool = False, semantic_threshold: float = 0.45):
+        self.template_threshold = template_threshold
+        self.knowledge_threshold = knowledge_threshold
+        self.templates_enabled = templates_enabled
+        self.semantic_enabled = semantic_enabled
+        self.semantic_threshold = semantic_threshold
+        self._semantic_registry = None
+
+        self._lock = threading.Lock()
+        self.counts = {tier: 0 for tier in TIERS}
+        self.latency = {tier: LatencyHistogram() for tier in TIERS}
+
+    def lookup(self, message: str, business_context: Optional[Dict] = None,
+               assistant_id: Optional[str] = None) -> Tuple[Optional[str], Optional[str], float]:
+        """Buscar respuesta sin LLM: (respuesta, nivel, confianza) o (None, None, 0.0)"""
+        if not message:
+            return None, None, 0.0
+
+        started_at = time.monotonic()
+        business_context = business_context or {}
+
+        # Los datos propios del cliente prevalecen sobre las plantillas genéricas del sector
+        answer, score = self._knowledge_answer(message, business_context, assistant_id)
+        if answer is not None:
+            self.record('knowledge', started_at)
+            return answer, 'knowledge', score
+
+        answer, score = self._semantic_answer(message, business_context, assistant_id)
+        if answer is not None:
+            self.record('semantic', started_at)
+            return answer, 'semantic', score
+
+        answer, score = self._template_answer(message, business_context)
+        if answer is not None:
+            self.record('template', started_at)
+            return answer, 'template', score
+
+        return None, None, 0.0
+
+    def record(self, tier: str, started_at: float):
+        """Contabilizar el nivel que sirvió una respuesta y su latencia"""
+        with self._lock:
+            self.counts[tier] += 1
+            self.latency[tier].record((time.monotonic() - started_at) * 1000)
+
+    def invalidate(self, assistant_id: str, deleted: bool = False):
+        """Resincronizar (o borrar) el índice semántico del asistente"""
+        registry = self._semantic()
+        if registry is None:
+            return
+        if deleted:
+            registry.delete(assistant_id)
+        else:
+            registry.invalidate(assistant_id)
+
+    def get_stats(self) -> Dict:
+        semantic_stats = self._semantic_registry.get_stats() if self._semantic_registry is not None else None
+        with self._lock:
+            total = sum(self.counts.values())
+            local = self.counts['knowledge'] + self.counts['semantic'] + self.counts['template']
+            return {
+                "answers": total,
+                "local_share": round(local / total, 4) if total else 0.0,
+                "template_threshold": self.template_threshold,
+                "knowledge_threshold": self.knowledge_threshold,
+                "semantic_threshold": self.semantic_threshold,
+                "semantic_index": semantic_stats,
+                "tiers": {
+                    tier: {
+                        "count": self.counts[tier],
+                        "share": round(self.counts[tier] / total, 4) if total else 0.0,
+                        "latency": self.latency[tier].to_dict()
+                    }
+                    for tier in TIERS
+                }
+            }
+
+    def _template_answer(self, message: str, business_context: Dict) -> Tuple[Optional[str], float]:
+        # El cliente puede desactivar las plantillas genéricas con template_answers: false
+        if not self.templates_enabled or business_context.get('template_answers') is False:
+            return None, 0.0
+
+        business_type = business_context.get('business_type')
+        answers = BUSINESS_TEMPLATES.get(BUSINESS_TYPE_ALIASES.get(business_type, business_type))
+        if not answers:
+            return None, 0.0
+
+        query_type, score = match_template(message, [query_type for query_type in answers if query_type in TEMPLATE_INTENTS])
+        if query_type is None or score <= self.template_threshold:
+            return None, score
+        return fill_placeholders(answers[query_type], business_context), score
+
+    def _semantic(self):
+        if self.semantic_enabled and self._semantic_registry is None:
+            # numpy solo se carga si el índice semántico está activado
+            from app.services.semantic_index import semantic_index_registry
+            self._semantic_registry = semantic_index_registry
+        return self._semantic_registry
+
+    def _semantic_answer(self, message: str, business_context: Dict,
+                         assistant_id: Optional[str]) -> Tuple[Optional[str], float]:
+        if not self.semantic_enabled or not assistant_id or not business_context.get('custom_knowledge'):
+            return None, 0.0
+
+        try:
+            results = self._semantic().search(assistant_id, business_context['custom_knowledge'], message, k=1,
+                                              version=business_context.get('knowledge_version'))
+        except Exception as e:
+            logger.error(f"Semantic index error for assistant {assistant_id}: {e}")
+            return None, 0.0
+
+        if not results or results[0][1] <= self.semantic_threshold:
+            return None, results[0][1] if results else 0.0
+        return results[0][0], results[0][1]
+
+    def _knowledge_answer(self, message: str, business_context: Dict,
+                          assistant_id: Optional[str]) -> Tuple[Optional[str], float]:
+        if 'custom_knowledge' not in business_context:
+            return None, 0.0
+
+        # El índice invertido se construye una vez por versión de custom_knowledge
+        index = knowledge_index_registry.get_index(business_context['custom_knowledge'], assistant_id,
+                                                   business_context.get('knowledge_version'))
+        return index.search(message, self.knowledge_threshold)
+
+
+# Global answer engine
+answer_engine = AnswerEngine(
+    template_threshold=Config.ANSWER_TEMPLATE_THRESHOLD,
+    knowledge_threshold=Config.ANSWER_KNOWLEDGE_THRESHOLD,
+    templates_enabled=Config.ANSWER_TEMPLATES_ENABLED,
+    semantic_enabled=Config.SEMANTIC_INDEX_ENABLED,
+    semantic_threshold=Config.ANSWER_SEMANTIC_THRESHOLD
+)
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+
+from app.config import Config
+from app.models.appointment import AppointmentCreate, AppointmentStatus
+from app.services.availability import UNIQUE_VIOLATION, availability
+from app.services.conversation_log import is_permanent_error
+from app.services.count_cache import appointment_counts
+from app.services.http_client import LatencyHistogram
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+
+class AppointmentBulkService:
+    """Importación y exportación masiva de citas
+
+    La importación valida cada fila con AppointmentCreate según llega y las inserta en
+    bloques; la exportación recorre la tabla por keyset y entrega cada página en cuanto
+    se lee, sin acumular el resultado.
+    """
+
+    def __init__(self, chunk_size: int = 500, max_rows: int = 100000, max_errors: int = 100,
+                 export_page_size: int = 1000):
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_errors = max_errors
+        self.export_page_size = export_page_size
+
+        self._lock = threading.Lock()
+        self.batch_latency = LatencyHistogram()
+        self.imports = 0
+        self.rows_imported = 0
+        self.rows_rejected = 0
+        self.rows_failed = 0
+        self.exports = 0
+        self.rows_exported = 0
+
+    def import_rows(self, user_id: str, rows: Iterable[Tuple[int, object]], dry_run: bool = False) -> Dict:
+        """Validar e insertar las filas; devuelve el informe con los errores por línea"""
+        started_at = time.monotonic()
+        report = {
+            "received": 0, "valid": 0, "inserted": 0, "rejected": 0, "failed": 0,
+            "truncated": False, "dry_run": dry_run, "errors": [], "batches": []
+        }
+        chunk: List[Tuple[int, Dict]] = []
+
+        for line_no, row in rows:
+            if report["received"] >= self.max_rows:
+                report["truncated"] = True
+                break
+            report["received"] += 1
+
+            record, error = self._validate(user_id, row)
+            if error is not None:
+                report["rejected"] += 1
+                self._add_error(report, line_no, error)
+                continue
+
+            report["valid"] += 1
+            if dry_run:
+                continue
+            chunk.append((line_no, record))
+            if len(chunk) >= self.chunk_size:
+                self._insert_chunk(chunk, report)
+                chunk = []
+
+        if chunk:
+            self._insert_chunk(chunk, report)
+
+        if report["inserted"]:
+            appointment_counts.invalidate(user_id)
+            availability.invalidate(user_id)
+
+        elapsed = time.monotonic() - started_at
+        report["seconds"] = round(elapsed, 3)
+        report["rows_per_second"] = round(report["received"] / elapsed, 1) if elapsed > 0 else 0.0
+
+        with self._lock:
+            self.imports += 1
+            self.rows_imported += report["inserted"]
+            self.rows_rejected += report["rejected"]
+            self.rows_failed += report["failed"]
+
+        logger.info(f"Appointment import for user {user_id}: {report['received']} rows, "
+                    f"{report['inserted']} inserted, {report['rejected']} rejected in {report['seconds']}s")
+        return report
+
+    def export_pages(self, user_id: str, fields: Sequence[str], status: Optional[str] = None,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None) -> Iterator[List[Dict]]:
+        """Páginas de citas en orden (appointment_date, id); cada página se pide al consumir la anterior"""
+        columns = ','.join(dict.fromkeys(['id', 'appointment_date'] + list(fields)))
+        after: Optional[Tuple[str, str]] = None
+        exported = 0
+
+        with self._lock:
+            self.exports += 1
+
+        try:
+            while True:
+                query = db.get_client().table("appointments").select(columns).eq("user_id", user_id)
+                if status:
+                    query = query.eq("status", status)
+                if date_from:
+                    query = query.gte("appointment_date", date_from)
+                if date_to:
+                    query = query.lte("appointment_date", date_to)
+                if after:
+                    query = query.or_(f"appointment_date.gt.{after[0]},and(appointment_date.eq.{after[0]},id.gt.{after[1]})")
+
+                rows = query.order("appointment_date").order("id").limit(self.export_page_size).execute().data or []
+                if not rows:
+                    break
+
+                exported += len(rows)
+                after = (rows[-1]['appointment_date'], rows[-1]['id'])
+                yield rows
+
+                if len(rows) < self.export_page_size:
+                    break
+        finally:
+            with self._lock:
+                self.rows_exported += exported
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "imports": self.imports,
+                "chunk_size": self.chunk_size,
+                "rows_imported": self.rows_imported,
+                "rows_rejected": self.rows_rejected,
+                "rows_failed": self.rows_failed,
+                "exports": self.exports,
+                "rows_exported": self.rows_exported,
+                "batch_latency": self.batch_latency.to_dict()
+            }
+
+    def _add_error(self, report: Dict, line_no: int, error: str):
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append({"line": line_no, "error": error})
+
+    def _validate(self, user_id: str, row) -> Tuple[Optional[Dict], Optional[str]]:
+        if isinstance(row, Exception):
+            return None, f"Fila inválida: {row}"
+        if not isinstance(row, dict):
+            return None, "Se esperaba un objeto"
+
+        try:
+            appointment = AppointmentCreate(**{key: value for key, value in row.items() if value is not None})
+            # Las citas migradas conservan su estado; por defecto, como en el alta individual
+            status = AppointmentStatus(row.get('status') or AppointmentStatus.SCHEDULED)
+        except ValidationError as e:
+            error = e.errors()[0]
+            return None, f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        except (ValueError, TypeError) as e:
+            return None, str(e)
+
+        return {
+            "user_id": user_id,
+            "customer_name": appointment.customer_name,
+            "customer_phone": appointment.customer_phone,
+            "customer_email": appointment.customer_email,
+            "appointment_date": appointment.appointment_date.isoformat(),
+            "appointment_time": appointment.appointment_time.isoformat(),
+            "service": appointment.service,
+            "status": status.value,
+            "notes": appointment.notes
+        }, None
+
+    def _insert_chunk(self, chunk: List[Tuple[int, Dict]], report: Dict):
+        start = time.monotonic()
+        try:
+            result = db.get_client().table("appointments").insert([record for _, record in chunk]).execute()
+            inserted = len(result.data or [])
+            error = None
+        except Exception as e:
+            logger.error(f"Error inserting appointment batch: {e}")
+            error = str(e)
+            if is_permanent_error(e) and len(chunk) > 1:
+                # Una fila rechazada tumba el lote entero: se reintenta fila a fila para aislarla
+                inserted = self._insert_rows(chunk, report)
+            else:
+                inserted = 0
+                report["failed"] += len(chunk)
+                self._add_error(report, chunk[0][0], f"Lote de las líneas {chunk[0][0]}-{chunk[-1][0]} no insertado: {e}")
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.batch_latency.record(elapsed * 1000)
+        report["inserted"] += inserted
+        batch = {
+            "rows": len(chunk),
+            "inserted": inserted,
+            "ms": round(elapsed * 1000, 1),
+            "rows_per_second": round(len(chunk) / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        if error is not None:
+            batch["error"] = error
+        report["batches"].append(batch)
+
+    def _insert_rows(self, chunk: List[Tuple[int, Dict]], report: Dict) -> int:
+        """Insertar las filas una a una; cada fila rechazada deja su propio error de línea"""
+        inserted = 0
+        for line_no, record in chunk:
+            try:
+                result = db.get_client().table("appointments").insert(record).execute()
+                inserted += len(result.data or [])
+            except Exception as e:
+                report["failed"] += 1
+                if str(getattr(e, 'code', '')) == UNIQUE_VIOLATION:
+                    self._add_error(report, line_no, "Ya existe una cita activa en esa fecha y hora")
+                else:
+                    self._add_error(report, line_no, f"No insertada: {e}")
+        return inserted
+
+
+# Global appointment bulk service
+appointment_bulk = AppointmentBulkService(
+    chunk_size=Config.APPOINTMENT_IMPORT_CHUNK_SIZE,
+    max_rows=Config.APPOINTMENT_IMPORT_MAX_ROWS,
+    max_errors=Config.APPOINTMENT_IMPORT_MAX_ERRORS,
+    export_page_size=Config.APPOINTMENT_EXPORT_PAGE_SIZE
+)
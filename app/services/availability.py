@@ -0,0 +1,347 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.services.reminder_scheduler import ACTIVE_STATUSES
+from app.utils.database import db
+from app.utils.validators import validate_business_hours
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Motivos de rechazo de check()
+SLOT_TAKEN = 'slot_taken'
+# Violación de idx_appointments_active_slot: otro worker reservó la misma hora a la vez
+UNIQUE_VIOLATION = '23505'
+OUTSIDE_BUSINESS_HOURS = 'outside_business_hours'
+# Solo se reserva en pasos de la rejilla: así dos citas que se solapan siempre comparten
+# hora de inicio e idx_appointments_active_slot las rechaza
+OFF_SLOT_GRID = 'off_slot_grid'
+
+_RANGE = re.compile(r"^\s*(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})\s*$")
+
+
+def _minutes(value) -> int:
+    """Minutos desde medianoche de 'HH:MM', 'HH:MM:SS' o datetime.time"""
+    if isinstance(value, str):
+        parts = value.split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    return value.hour * 60 + value.minute
+
+
+def _on_minute(value) -> bool:
+    """True si la hora no lleva segundos"""
+    if isinstance(value, str):
+        parts = value.split(':')
+        return len(parts) < 3 or float(parts[2]) == 0
+    return not value.second and not value.microsecond
+
+
+def _clock(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _weekdays(key: str) -> List[int]:
+    """'mon' -> [0]; 'mon-fri' -> [0..4]"""
+    first, _, last = key.strip().lower().partition('-')
+    start = WEEKDAYS.index(first[:3])
+    end = WEEKDAYS.index(last[:3]) if last else start
+    return list(range(start, end + 1))
+
+
+def parse_business_hours(value) -> Dict[int, List[Tuple[int, int]]]:
+    """Horario por día de la semana: {0: [(inicio, fin), ...]} en minutos
+
+    Acepta {"mon-fri": ["09:00-14:00", "16:00-19:00"], "sat": "10:00-13:00"} o la forma
+    compacta "mon-fri=09:00-14:00,16:00-19:00;sat=10:00-13:00". Los tramos que no pasan
+    validate_business_hours se descartan.
+    """
+    if isinstance(value, str):
+        value = dict(item.split('=', 1) for item in value.split(';') if '=' in item)
+    hours: Dict[int, List[Tuple[int, int]]] = {}
+    for key, ranges in (value or {}).items():
+        try:
+            weekdays = _weekdays(key)
+        except ValueError:
+            logger.warning(f"Invalid business hours day: {key}")
+            continue
+
+        if isinstance(ranges, str):
+            ranges = ranges.split(',')
+        for item in ranges or []:
+            match = _RANGE.match(item) if isinstance(item, str) else None
+            start, end = match.groups() if match else (item if isinstance(item, (list, tuple)) and len(item) == 2 else (None, None))
+            if not start or not validate_business_hours(start, end):
+                logger.warning(f"Invalid business hours range for {key}: {item}")
+                continue
+            for weekday in weekdays:
+                hours.setdefault(weekday, []).append((_minutes(start), _minutes(end)))
+
+    return {weekday: sorted(ranges) for weekday, ranges in hours.items()}
+
+
+class DaySchedule:
+    """Citas activas de un cliente en un día: intervalos ordenados por inicio (búsqueda binaria)"""
+
+    __slots__ = ('starts', 'ends', 'ids', 'loaded_at')
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.ids: List[str] = []
+        self.loaded_at = time.monotonic()
+
+    def add(self, start: int, end: int, appointment_id: str):
+        position = bisect.bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, appointment_id)
+
+    def remove(self, start: int, appointment_id: str) -> bool:
+        position = bisect.bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.ids[position] == appointment_id:
+                del self.starts[position], self.ends[position], self.ids[position]
+                return True
+            position += 1
+        return False
+
+    def conflict(self, start: int, end: int, exclude: Optional[str] = None) -> Optional[int]:
+        """Fin de la cita que se solapa con [start, end), o None si el tramo está libre
+
+        Con la misma duración para todas las citas los fines quedan ordenados como los
+        inicios: basta mirar la última cita que empieza antes de `end`.
+        """
+        position = bisect.bisect_left(self.starts, end) - 1
+        while position >= 0:
+            if self.ids[position] != exclude:
+                return self.ends[position] if self.ends[position] > start else None
+            position -= 1
+        return None
+
+
+class AvailabilityEngine:
+    """Disponibilidad de citas por cliente (user_id) y día
+
+    Cada día se carga una vez desde Supabase en un DaySchedule y se mantiene al día con
+    las altas, cambios y bajas de la API; el TTL acota el desfase con escrituras de otros
+    procesos. Los huecos libres salen del horario del negocio (business_context
+    ['business_hours']) en pasos de la duración de la cita.
+    """
+
+    def __init__(self, duration: int = 30, default_hours: str = 'mon-fri=09:00-18:00', horizon_days: int = 14,
+                 day_ttl: int = 60, hours_ttl: int = 300, max_days: int = 20000):
+        self.duration = duration
+        self.default_hours = parse_business_hours(default_hours)
+        self.horizon_days = horizon_days
+        self.day_ttl = day_ttl
+        self.hours_ttl = hours_ttl
+        self.max_days = max_days
+
+        self._days: "OrderedDict[Tuple[str, str], DaySchedule]" = OrderedDict()
+        self._by_id: Dict[str, Tuple[str, str, int]] = {}
+        self._hours: Dict[str, Tuple[Dict, int, float]] = {}
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.conflicts = 0
+        self.slot_queries = 0
+        self.day_loads = 0
+
+    def check(self, tenant: str, day: date, start, exclude_id: Optional[str] = None,
+              business_context: Optional[Dict] = None) -> Optional[str]:
+        """None si la cita cabe; si no, SLOT_TAKEN, OUTSIDE_BUSINESS_HOURS u OFF_SLOT_GRID"""
+        hours, duration = self._tenant_hours(tenant, business_context)
+        on_minute = _on_minute(start)
+        start = _minutes(start)
+        end = start + duration
+
+        with self._lock:
+            self.checks += 1
+        ranges = [(range_start, range_end) for range_start, range_end in hours.get(day.weekday(), [])
+                  if range_start <= start and end <= range_end]
+        if not ranges:
+            return OUTSIDE_BUSINESS_HOURS
+        if not on_minute or all((start - range_start) % duration for range_start, _ in ranges):
+            return OFF_SLOT_GRID
+
+        schedule = self._load_days(tenant, [day])[day.isoformat()]
+        with self._lock:
+            if schedule.conflict(start, end, exclude_id) is None:
+                return None
+            self.conflicts += 1
+        return SLOT_TAKEN
+
+    def next_slots(self, tenant: str, after: datetime, count: int = 5,
+                   business_context: Optional[Dict] = None) -> List[Dict]:
+        """Los `count` primeros huecos libres desde `after` dentro del horizonte"""
+        hours, duration = self._tenant_hours(tenant, business_context)
+        days = [after.date() + timedelta(days=offset) for offset in range(self.horizon_days)]
+        days = [day for day in days if hours.get(day.weekday())]
+        schedules = self._load_days(tenant, days)
+
+        with self._lock:
+            self.slot_queries += 1
+
+        slots = []
+        for day in days:
+            earliest = _minutes(after) if day == after.date() else 0
+            schedule = schedules[day.isoformat()]
+            for range_start, range_end in hours[day.weekday()]:
+                # Primer paso de la rejilla del tramo que no empiece antes de `earliest`
+                slot = range_start + max(0, -(-(earliest - range_start) // duration)) * duration
+                while slot + duration <= range_end and len(slots) < count:
+                    with self._lock:
+                        busy_until = schedule.conflict(slot, slot + duration)
+                    if busy_until is None:
+                        slots.append({
+                            "date": day.isoformat(),
+                            "time": _clock(slot),
+                            "end_time": _clock(slot + duration)
+                        })
+                        slot += duration
+                    else:
+                        # Saltar directamente al primer paso tras la cita que ocupa el hueco
+                        slot = range_start + -(-(busy_until - range_start) // duration) * duration
+                if len(slots) >= count:
+                    return slots
+        return slots
+
+    def duration_for(self, tenant: str) -> int:
+        """Duración de cita (minutos) configurada para el cliente"""
+        return self._tenant_hours(tenant)[1]
+
+    def add(self, tenant: str, appointment: Dict):
+        """Registrar una cita creada o modificada (solo si el día ya está cargado)"""
+        if appointment.get('status') not in ACTIVE_STATUSES:
+            return
+        _, duration = self._tenant_hours(tenant)
+        key = (tenant, str(appointment['appointment_date']))
+        start = _minutes(appointment['appointment_time'])
+        with self._lock:
+            schedule = self._days.get(key)
+            if schedule is not None:
+                schedule.add(start, start + duration, str(appointment['id']))
+                self._by_id[str(appointment['id'])] = (key[0], key[1], start)
+
+    def remove(self, appointment_id: str):
+        with self._lock:
+            entry = self._by_id.pop(str(appointment_id), None)
+            if entry is not None:
+                schedule = self._days.get((entry[0], entry[1]))
+                if schedule is not None:
+                    schedule.remove(entry[2], str(appointment_id))
+
+    def update(self, tenant: str, appointment: Dict):
+        self.remove(appointment['id'])
+        self.add(tenant, appointment)
+
+    def invalidate(self, tenant: str):
+        """Descartar el horario y los días cargados de un cliente"""
+        with self._lock:
+            self._hours.pop(tenant, None)
+            self._drop_tenant_days(tenant)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "days_indexed": len(self._days),
+                "appointments_indexed": len(self._by_id),
+                "tenants_with_hours": len(self._hours),
+                "checks": self.checks,
+                "conflicts": self.conflicts,
+                "slot_queries": self.slot_queries,
+                "day_loads": self.day_loads
+            }
+
+    def _tenant_hours(self, tenant: str, business_context: Optional[Dict] = None) -> Tuple[Dict, int]:
+        """Horario y duración de cita del cliente (de su asistente activo)"""
+        with self._lock:
+            entry = self._hours.get(tenant)
+            if entry is not None and entry[2] > time.monotonic():
+                return entry[0], entry[1]
+
+        if business_context is None:
+            try:
+                result = db.get_client().table("assistants").select("business_context") \
+                    .eq("user_id", tenant).eq("status", "active").limit(1).execute()
+                business_context = (result.data[0].get('business_context') if result.data else None) or {}
+            except Exception as e:
+                logger.error(f"Error loading business hours for {tenant}: {e}")
+                business_context = {}
+
+        hours = parse_business_hours(business_context.get('business_hours')) or self.default_hours
+        duration = int(business_context.get('appointment_duration') or self.duration)
+        with self._lock:
+            # Los intervalos indexados usan la duración anterior: si cambia, se recargan los días
+            if entry is not None and entry[1] != duration:
+                self._drop_tenant_days(tenant)
+            self._hours[tenant] = (hours, duration, time.monotonic() + self.hours_ttl)
+        return hours, duration
+
+    def _load_days(self, tenant: str, days: List[date]) -> Dict[str, DaySchedule]:
+        """Días del cliente desde el índice; los que faltan o caducaron, en una sola consulta"""
+        now = time.monotonic()
+        schedules: Dict[str, DaySchedule] = {}
+        with self._lock:
+            for day in days:
+                schedule = self._days.get((tenant, day.isoformat()))
+                if schedule is not None and now - schedule.loaded_at < self.day_ttl:
+                    self._days.move_to_end((tenant, day.isoformat()))
+                    schedules[day.isoformat()] = schedule
+        missing = [day for day in days if day.isoformat() not in schedules]
+        if not missing:
+            return schedules
+
+        _, duration = self._tenant_hours(tenant)
+        loaded = {day.isoformat(): DaySchedule() for day in missing}
+        rows = db.get_client().table("appointments").select("id,appointment_date,appointment_time") \
+            .eq("user_id", tenant) \
+            .gte("appointment_date", min(missing).isoformat()) \
+            .lte("appointment_date", max(missing).isoformat()) \
+            .in_("status", list(ACTIVE_STATUSES)) \
+            .execute().data or []
+
+        with self._lock:
+            self.day_loads += len(missing)
+            for day, schedule in loaded.items():
+                self._drop_day((tenant, day))
+                self._days[(tenant, day)] = schedule
+            for row in rows:
+                schedule = loaded.get(str(row['appointment_date']))
+                if schedule is not None:
+                    start = _minutes(row['appointment_time'])
+                    schedule.add(start, start + duration, str(row['id']))
+                    self._by_id[str(row['id'])] = (tenant, str(row['appointment_date']), start)
+            while len(self._days) > self.max_days:
+                self._drop_day(next(iter(self._days)))
+
+        schedules.update(loaded)
+        return schedules
+
+    def _drop_tenant_days(self, tenant: str):
+        for key in [key for key in self._days if key[0] == tenant]:
+            self._drop_day(key)
+
+    def _drop_day(self, key: Tuple[str, str]):
+        schedule = self._days.pop(key, None)
+        if schedule is not None:
+            for appointment_id in schedule.ids:
+                self._by_id.pop(appointment_id, None)
+
+
+# Global availability engine
+availability = AvailabilityEngine(
+    duration=Config.APPOINTMENT_DEFAULT_DURATION_MINUTES,
+    default_hours=Config.AVAILABILITY_DEFAULT_HOURS,
+    horizon_days=Config.AVAILABILITY_HORIZON_DAYS,
+    day_ttl=Config.AVAILABILITY_DAY_TTL_SECONDS,
+    max_days=Config.AVAILABILITY_MAX_DAYS
+)
@@ -0,0 +1,151 @@
+import bisect
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.services.tenant_resolver import tenant_resolver
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+# Cubetas de duración en segundos (la última cubeta es "más de una hora")
+DURATION_BUCKETS = [10, 30, 60, 120, 180, 300, 600, 900, 1800, 3600]
+TERMINAL_STATUSES = ('completed', 'busy', 'no-answer', 'failed', 'canceled')
+
+
+def duration_bucket(duration: int) -> int:
+    """Índice (base 1, como los arrays de Postgres) de la cubeta de duración"""
+    return bisect.bisect_left(DURATION_BUCKETS, duration) + 1
+
+
+def bucket_percentile(buckets: List[int], fraction: float) -> Optional[int]:
+    """Cota superior de la cubeta que contiene el percentil"""
+    total = sum(buckets)
+    if not total:
+        return None
+    threshold = fraction * total
+    cumulative = 0
+    for i, count in enumerate(buckets):
+        cumulative += count
+        if cumulative >= threshold:
+            return DURATION_BUCKETS[i] if i < len(DURATION_BUCKETS) else None
+    return None
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class CallAnalytics:
+    """Ingesta de eventos de estado de llamadas y consulta de agregados por cliente
+
+    Cada callback se guarda en call_events (solo inserciones) y, en la misma función
+    de base de datos, incrementa el agregado diario de call_rollups. Las estadísticas
+    leen un registro por día en lugar de recorrer los eventos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def record_status_callback(self, form: Dict) -> bool:
+        """Registrar un callback de estado de Twilio; devuelve False si ya se había registrado"""
+        call_sid = form.get('CallSid')
+        status = form.get('CallStatus')
+        if not call_sid or not status:
+            return False
+
+        direction = form.get('Direction') or 'inbound'
+        from_phone = form.get('From')
+        to_phone = form.get('To')
+        try:
+            duration = int(form.get('CallDuration') or 0)
+        except ValueError:
+            duration = 0
+
+        # El número del negocio es el llamado en entrantes y el llamante en salientes
+        business_phone = to_phone if direction == 'inbound' else from_phone
+        business_context = tenant_resolver.resolve('voice', business_phone) or {}
+        now = datetime.now()
+
+        try:
+            result = db.get_client().rpc("record_call_event", {
+                "p_call_sid": call_sid,
+                "p_tenant_key": business_context.get('user_id') or '',
+                "p_assistant_id": business_context.get('assistant_id'),
+                "p_status": status,
+                "p_direction": direction,
+                "p_from_phone": from_phone,
+                "p_to_phone": to_phone,
+                "p_duration": duration,
+                "p_duration_bucket": duration_bucket(duration),
+                "p_terminal": status in TERMINAL_STATUSES,
+                "p_answered": status == 'completed' and duration > 0,
+                "p_day": now.date().isoformat(),
+                "p_hour": now.hour
+            }).execute()
+        except Exception as e:
+            logger.error(f"Error recording call event {call_sid}: {e}")
+            with self._lock:
+                self.errors += 1
+            return False
+
+        inserted = bool(result.data)
+        with self._lock:
+            if inserted:
+                self.recorded += 1
+            else:
+                self.duplicates += 1
+        return inserted
+
+    def get_stats(self, tenant_key: str, days: int = 7, today: Optional[date] = None) -> Dict:
+        """Combinar los agregados diarios del rango pedido"""
+        today = today or datetime.now().date()
+        start = today - timedelta(days=days - 1)
+
+        result = db.get_client().table("call_rollups") \
+            .select("day,total_calls,answered_calls,missed_calls,total_duration,duration_buckets,hourly_calls") \
+            .eq("tenant_key", tenant_key) \
+            .gte("day", start.isoformat()) \
+            .lte("day", today.isoformat()) \
+            .execute()
+
+        total = answered = missed = total_duration = today_calls = 0
+        buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        hourly = [0] * 24
+        for row in result.data or []:
+            total += row['total_calls']
+            answered += row['answered_calls']
+            missed += row['missed_calls']
+            total_duration += row['total_duration']
+            buckets = [a + b for a, b in zip(buckets, row['duration_buckets'])]
+            hourly = [a + b for a, b in zip(hourly, row['hourly_calls'])]
+            if row['day'] == today.isoformat():
+                today_calls = row['total_calls']
+
+        peak_hour = max(range(24), key=lambda hour: hourly[hour]) if total else None
+        return {
+            "total_calls": total,
+            "answered_calls": answered,
+            "missed_calls": missed,
+            "avg_duration": format_duration(total_duration / answered) if answered else "0:00",
+            "p50_duration": bucket_percentile(buckets, 0.5),
+            "p90_duration": bucket_percentile(buckets, 0.9),
+            "success_rate": round(answered * 100 / total) if total else 0,
+            "today_calls": today_calls,
+            "peak_hours": f"{peak_hour:02d}:00-{(peak_hour + 1) % 24:02d}:00" if peak_hour is not None else None,
+            "hourly_calls": hourly,
+            "days": days
+        }
+
+    def get_ingestion_stats(self) -> Dict:
+        with self._lock:
+            return {"recorded": self.recorded, "duplicates": self.duplicates, "errors": self.errors}
+
+
+# Global call analytics instance
+call_analytics = CallAnalytics()
@@ -1,13 +1,22 @@
 
-import requests
 from app.config import Config
+from app.services.http_client import http_client
 from app.services.openai_service import OpenAIService
+from app.services.response_cache import response_cache
+from app.services.answer_engine import answer_engine
+from app.utils.twiml import TwiML
 import logging
-from typing import Dict, Optional
+import time
+from typing import Dict, Optional, Union
 from urllib.parse import urlencode
 
 logger = logging.getLogger(__name__)
 
+# TwiML de respaldo precompilado
+FALLBACK_TWIML = TwiML() \
+    .say("Disculpe, estoy teniendo problemas técnicos. Por favor, intente llamar más tarde o envíe un mensaje de WhatsApp.") \
+    .to_bytes()
+
 class CallService:
     def __init__(self):
         self.account_sid = Config.TWILIO_ACCOUNT_SID
@@ -32,7 +41,8 @@ class CallService:
                 data['StatusCallback'] = status_callback_url
                 data['StatusCallbackMethod'] = 'POST'
             
-            response = requests.post(
+            response = http_client.post(
+                'twilio',
                 url,
                 auth=(self.account_sid, self.auth_token),
                 data=data
@@ -98,11 +108,12 @@ class CallService:
             logger.error(f"Error making interactive call: {e}")
             return None
     
-    def generate_twiml_response(self, prompt: str, business_context: Dict = None) -> str:
+    def generate_twiml_response(self, prompt: str, business_context: Dict = None) -> Union[str, bytes]:
         """Generar respuesta TwiML usando OpenAI"""
+        started_at = time.monotonic()
         try:
             # Crear contexto para la llamada
-            context = f"""
+            instructions = f"""
             Eres un asistente telefónico profesional para {business_context.get('business_name', 'un negocio')}.
             
             Información del negocio:
@@ -116,46 +127,49 @@ class CallService:
             - Ofrece ayuda específica
             - Si no puedes resolver algo, ofrece transferir a un humano
             - Mantén las respuestas concisas (máximo 2 frases)
-            
+            """
+            context = instructions + f"""
             Pregunta del cliente: {prompt}
             
             Responde de manera natural y útil:
             """
             
-            response = self.openai_service.generate_response(context, business_context)
+            assistant_id = business_context.get('assistant_id')
+            # Conocimiento y plantillas se buscan con la pregunta del cliente, no con el prompt completo
+            response, _, _ = answer_engine.lookup(prompt, business_context, assistant_id)
+            if response is None and Config.RESPONSE_CACHE_ENABLED:
+                response = response_cache.get('call', assistant_id, prompt, '', instructions)
+                if response is not None:
+                    answer_engine.record('cache', started_at)
             
-            # Crear TwiML con la respuesta
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{response}</Say>
-    <Gather input="speech" timeout="5" action="/api/calls/process-speech" method="POST">
-        <Say voice="alice" language="es">¿En qué más puedo ayudarte?</Say>
-    </Gather>
-    <Say voice="alice" language="es">Gracias por llamar. Que tenga un buen día.</Say>
-</Response>"""
+            if response is None:
+                response, _ = self.openai_service.generate_answer(context, business_context, use_cache=False,
+                                                                 local_answers=False)
+                if Config.RESPONSE_CACHE_ENABLED and response != self.openai_service.ERROR_RESPONSE:
+                    response_cache.set('call', assistant_id, prompt, '', instructions, response)
             
-            return twiml
+            # Crear TwiML con la respuesta
+            return TwiML() \
+                .say(response) \
+                .gather("/api/calls/process-speech", "¿En qué más puedo ayudarte?") \
+                .say("Gracias por llamar. Que tenga un buen día.") \
+                .to_xml()
             
         except Exception as e:
             logger.error(f"Error generating TwiML: {e}")
             return self._get_fallback_twiml()
     
-    def _get_fallback_twiml(self) -> str:
+    def _get_fallback_twiml(self) -> bytes:
         """TwiML de respaldo en caso de error"""
-        return """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">
-        Disculpe, estoy teniendo problemas técnicos. 
-        Por favor, intente llamar más tarde o envíe un mensaje de WhatsApp.
-    </Say>
-</Response>"""
+        return FALLBACK_TWIML
     
     def get_call_recording_url(self, call_sid: str) -> Optional[str]:
         """Obtener URL de grabación de llamada"""
         try:
             url = f"{self.base_url}/Calls/{call_sid}/Recordings.json"
             
-            response = requests.get(
+            response = http_client.get(
+                'twilio',
                 url,
                 auth=(self.account_sid, self.auth_token)
             )
@@ -0,0 +1,332 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from app.config import Config
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('whatsapp', 'telegram', 'email', 'calls', 'web')
+ROLLUP_TABLE = 'channel_stat_rollups'
+
+
+class ResponseTimeSketch:
+    """Histograma logarítmico disperso: error relativo acotado y memoria independiente del volumen"""
+
+    GROWTH = 1.05  # ~2.5% de error relativo en los percentiles
+
+    __slots__ = ('counts', 'total', 'sum_ms')
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def record(self, value_ms: float):
+        index = int(math.log(max(value_ms, 1.0), self.GROWTH))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum_ms += value_ms
+
+    def merge(self, other: "ResponseTimeSketch"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_ms += other.sum_ms
+
+    @classmethod
+    def from_rollup(cls, counts: Optional[Dict], total: int, sum_ms: float) -> "ResponseTimeSketch":
+        """Reconstruir el histograma guardado en channel_stat_rollups (claves JSON en texto)"""
+        sketch = cls()
+        sketch.counts = {int(index): int(count) for index, count in (counts or {}).items()}
+        sketch.total = total or 0
+        sketch.sum_ms = sum_ms or 0.0
+        return sketch
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.total:
+            return None
+        threshold = fraction * self.total
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            if cumulative >= threshold:
+                # Punto medio geométrico de la cubeta
+                return round(self.GROWTH ** (index + 0.5), 1)
+        return None
+
+
+class _HourBucket:
+    __slots__ = ('conversations', 'responses', 'errors', 'sketch')
+
+    def __init__(self):
+        self.conversations = 0
+        self.responses = 0
+        self.errors = 0
+        self.sketch = ResponseTimeSketch()
+
+    def merge(self, other: "_HourBucket"):
+        self.conversations += other.conversations
+        self.responses += other.responses
+        self.errors += other.errors
+        self.sketch.merge(other.sketch)
+
+
+def _hour_start(hour: int) -> str:
+    return datetime.fromtimestamp(hour * 3600, timezone.utc).isoformat()
+
+
+def parse_time_range(args, default_hours: int = 168) -> Tuple[datetime, datetime]:
+    """Rango de la consulta a partir de ?from=&to= (ISO) o ?hours="""
+    end = datetime.fromisoformat(args['to']) if args.get('to') else datetime.now()
+    if args.get('from'):
+        start = datetime.fromisoformat(args['from'])
+    else:
+        start = end - timedelta(hours=int(args.get('hours', default_hours)))
+    return start, end
+
+
+def format_response_time(value_ms: Optional[float]) -> str:
+    if value_ms is None:
+        return 'N/A'
+    if value_ms < 60000:
+        return f"{value_ms / 1000:.1f} s"
+    return f"{value_ms / 60000:.1f} min"
+
+
+class ChannelStatsEngine:
+    """Estadísticas materializadas por cliente y canal en cubetas horarias
+
+    Se actualizan al registrar cada conversación y los incrementos de cada worker se
+    suman cada flush_interval en channel_stat_rollups (record_channel_stats), así que las
+    consultas ven a todos los workers y sobreviven a los reinicios. Las cubetas en memoria
+    solo se usan si la base de datos no responde.
+    """
+
+    def __init__(self, retention_hours: int = 720, max_tenants: int = 10000, flush_interval: float = 10.0,
+                 max_pending: int = 50000):
+        self.retention_hours = retention_hours
+        self.max_tenants = max_tenants
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._series: "OrderedDict[Tuple[str, str], OrderedDict[int, _HourBucket]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str, int], _HourBucket] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.fallback_queries = 0
+
+    def record(self, tenant_key: Optional[str], channel: str, response_ms: Optional[float] = None,
+               responded: bool = True, at: Optional[float] = None):
+        """Contabilizar un mensaje entrante y, si hubo respuesta, su tiempo de respuesta"""
+        hour = int((at or time.time()) // 3600)
+        key = (str(tenant_key or ''), channel)
+        self._ensure_started()
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = OrderedDict()
+                while len(self._series) > self.max_tenants * len(CHANNELS):
+                    self._series.popitem(last=False)
+            self._series.move_to_end(key)
+
+            bucket = series.get(hour)
+            if bucket is None:
+                bucket = series[hour] = _HourBucket()
+                # Las horas llegan en orden: las más antiguas están al principio
+                while series and next(iter(series)) <= hour - self.retention_hours:
+                    series.popitem(last=False)
+
+            pending = self._pending.get(key + (hour,))
+            if pending is None:
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    pending = _HourBucket()
+                else:
+                    pending = self._pending[key + (hour,)] = _HourBucket()
+
+            for target in (bucket, pending):
+                target.conversations += 1
+                if responded:
+                    target.responses += 1
+                    if response_ms is not None:
+                        target.sketch.record(response_ms)
+                else:
+                    target.errors += 1
+            self.recorded += 1
+
+    def flush(self) -> int:
+        """Sumar los incrementos pendientes a channel_stat_rollups en una sola llamada"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            rows = [{
+                "tenant_key": tenant_key,
+                "channel": channel,
+                "hour_start": _hour_start(hour),
+                "conversations": bucket.conversations,
+                "responses": bucket.responses,
+                "errors": bucket.errors,
+                "response_count": bucket.sketch.total,
+                "response_sum_ms": bucket.sketch.sum_ms,
+                "response_sketch": {str(index): count for index, count in bucket.sketch.counts.items()}
+            } for (tenant_key, channel, hour), bucket in pending.items()]
+
+            try:
+                db.get_client().rpc("record_channel_stats", {"p_rows": rows}).execute()
+            except Exception as e:
+                logger.error(f"Error flushing channel stats: {e}")
+                # Se reintenta en el siguiente flush junto con lo nuevo
+                with self._lock:
+                    self.errors += 1
+                    for key, bucket in pending.items():
+                        if key in self._pending:
+                            self._pending[key].merge(bucket)
+                        elif len(self._pending) < self.max_pending:
+                            self._pending[key] = bucket
+                        else:
+                            self.dropped += 1
+                return 0
+
+            with self._lock:
+                self.flushed += len(rows)
+            return len(rows)
+
+    def start(self):
+        """Arrancar el hilo que vuelca los incrementos"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='channel-stats-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.flush_interval * 2)
+        self.flush()
+
+    def query(self, tenant_key: Optional[str], channel: str, start: datetime, end: datetime) -> Dict:
+        """Sumar las cubetas horarias del rango [start, end]"""
+        first_hour = int(start.timestamp() // 3600)
+        last_hour = int(end.timestamp() // 3600)
+        key = (str(tenant_key or ''), channel)
+
+        buckets = self._load(key, first_hour, last_hour)
+        if buckets is None:
+            with self._lock:
+                self.fallback_queries += 1
+                buckets = {}
+                for hour, bucket in self._series.get(key, {}).items():
+                    if first_hour <= hour <= last_hour:
+                        buckets[hour] = _HourBucket()
+                        buckets[hour].merge(bucket)
+        else:
+            # Lo que este worker aún no ha volcado también cuenta
+            with self._lock:
+                for (tenant, pending_channel, hour), bucket in self._pending.items():
+                    if (tenant, pending_channel) == key and first_hour <= hour <= last_hour:
+                        buckets.setdefault(hour, _HourBucket()).merge(bucket)
+
+        sketch = ResponseTimeSketch()
+        conversations = responses = errors = 0
+        hourly = []
+        for hour in sorted(buckets):
+            bucket = buckets[hour]
+            conversations += bucket.conversations
+            responses += bucket.responses
+            errors += bucket.errors
+            sketch.merge(bucket.sketch)
+            hourly.append({
+                "hour": datetime.fromtimestamp(hour * 3600).isoformat(),
+                "conversations": bucket.conversations,
+                "responses": bucket.responses
+            })
+
+        avg_ms = sketch.sum_ms / sketch.total if sketch.total else None
+        return {
+            "conversations": conversations,
+            "responses": responses,
+            "errors": errors,
+            "success_rate": round(responses * 100 / conversations) if conversations else 0,
+            "avg_response_time": format_response_time(avg_ms),
+            "avg_response_ms": round(avg_ms, 1) if avg_ms is not None else None,
+            "p50_response_ms": sketch.percentile(0.5),
+            "p95_response_ms": sketch.percentile(0.95),
+            "hourly": hourly,
+            "from": start.isoformat(),
+            "to": end.isoformat()
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "hour_buckets": sum(len(series) for series in self._series.values()),
+                "recorded": self.recorded,
+                "pending_buckets": len(self._pending),
+                "flushed_buckets": self.flushed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "fallback_queries": self.fallback_queries
+            }
+
+    def _load(self, key: Tuple[str, str], first_hour: int, last_hour: int) -> Optional[Dict[int, _HourBucket]]:
+        """Cubetas guardadas del rango; None si la base de datos no responde"""
+        try:
+            result = db.get_client().table(ROLLUP_TABLE) \
+                .select("hour_start,conversations,responses,errors,response_count,response_sum_ms,response_sketch") \
+                .eq("tenant_key", key[0]).eq("channel", key[1]) \
+                .gte("hour_start", _hour_start(first_hour)).lte("hour_start", _hour_start(last_hour)) \
+                .order("hour_start").execute()
+        except Exception as e:
+            logger.error(f"Error loading channel stats for {key[1]}: {e}")
+            return None
+
+        buckets = {}
+        for row in result.data or []:
+            hour = int(datetime.fromisoformat(str(row['hour_start']).replace('Z', '+00:00')).timestamp() // 3600)
+            bucket = buckets.setdefault(hour, _HourBucket())
+            bucket.conversations += row.get('conversations') or 0
+            bucket.responses += row.get('responses') or 0
+            bucket.errors += row.get('errors') or 0
+            bucket.sketch.merge(ResponseTimeSketch.from_rollup(
+                row.get('response_sketch'), row.get('response_count'), row.get('response_sum_ms')
+            ))
+        return buckets
+
+    def _ensure_started(self):
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Channel stats writer error: {e}")
+
+
+# Global channel statistics engine
+channel_stats = ChannelStatsEngine(
+    retention_hours=Config.CHANNEL_STATS_RETENTION_HOURS,
+    max_tenants=Config.CHANNEL_STATS_MAX_TENANTS,
+    flush_interval=Config.CHANNEL_STATS_FLUSH_INTERVAL
+)
+atexit.register(channel_stats.stop)
@@ -0,0 +1,328 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+from app.config import Config
+from app.services.http_client import LatencyHistogram
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_LOG_TABLE = 'conversation_log'
+
+# Errores de PostgREST/Postgres que no se arreglan reintentando: datos (22), restricciones (23),
+# columnas o tablas inexistentes (42) y errores propios de PostgREST (PGRST)
+PERMANENT_ERROR_PREFIXES = ('22', '23', '42', 'PGRST')
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """True si el registro nunca podrá insertarse tal cual (4xx o violación de restricción)"""
+    code = str(getattr(error, 'code', '') or '')
+    if code.startswith(PERMANENT_ERROR_PREFIXES):
+        return True
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+class ConversationLogWriter:
+    """Registro de conversaciones con escritura diferida: inserciones en bloque desde un hilo
+
+    Si Supabase no está disponible los registros se vuelcan a un fichero local (NDJSON,
+    con tamaño máximo) y se reenvían cuando vuelve. Los registros que la base de datos
+    rechaza (columnas o restricciones) se descartan en lugar de volcarse.
+    """
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 2.0, max_buffer: int = 10000,
+                 spill_path: str = 'data/conversation_log.ndjson', max_spill_bytes: int = 50 * 1024 * 1024,
+                 replay_interval: float = 30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self.max_spill_bytes = max_spill_bytes
+        self.replay_interval = replay_interval
+        self._last_replay = 0.0
+
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.flush_latency = LatencyHistogram()
+        self.logged = 0
+        self.flushed = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_rejection = None
+
+    def log(self, table: str, record: Dict):
+        """Encolar un registro; nunca bloquea la petición con la base de datos"""
+        self._ensure_started()
+
+        with self._lock:
+            self.logged += 1
+            if len(self._buffer) >= self.max_buffer:
+                overflow = [self._buffer.popleft()]
+            else:
+                overflow = None
+            self._buffer.append((table, record))
+            full = len(self._buffer) >= self.batch_size
+
+        if overflow:
+            self._spill(overflow)
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Insertar en bloque todo lo pendiente"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+
+                inserted, pending = self._insert(batch)
+                written += inserted
+                if pending:
+                    self._spill(pending)
+                    # Sin base de datos: lo que queda se vuelca también al fichero
+                    with self._lock:
+                        remaining = list(self._buffer)
+                        self._buffer.clear()
+                    if remaining:
+                        self._spill(remaining)
+                    return written
+
+            # El fichero se reenvía tras un flush correcto o, sin tráfico, cada replay_interval
+            if os.path.exists(self.spill_path) and (written or time.monotonic() - self._last_replay >= self.replay_interval):
+                self._last_replay = time.monotonic()
+                self._replay_spill()
+        return written
+
+    def start(self):
+        """Arrancar el hilo de escritura"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='conversation-log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(self.flush_interval * 2)
+        self.flush()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "buffered": len(self._buffer),
+                "logged": self.logged,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "avg_batch_size": round(self.flushed / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch,
+                "flush_latency": self.flush_latency.to_dict(),
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "last_rejection": self.last_rejection,
+                "errors": self.errors,
+                "spill_file_bytes": os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            }
+
+    def _ensure_started(self):
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Conversation log writer error: {e}")
+
+    def _insert(self, batch: List[Tuple[str, Dict]]) -> Tuple[int, List[Tuple[str, Dict]]]:
+        """Insertar el lote: (filas escritas, registros pendientes por fallo transitorio)"""
+        # PostgREST toma las columnas del primer registro: agrupamos por tabla y conjunto de campos
+        groups: Dict[Tuple, List[Dict]] = {}
+        for table, record in batch:
+            groups.setdefault((table, tuple(sorted(record))), []).append(record)
+
+        start = time.monotonic()
+        written = 0
+        pending: List[Tuple[str, Dict]] = []
+        for (table, _), records in groups.items():
+            if pending:
+                pending.extend((table, record) for record in records)
+                continue
+            try:
+                db.get_client().table(table).insert(records).execute()
+                written += len(records)
+            except Exception as e:
+                if is_permanent_error(e):
+                    # Reintentar no sirve: se descartan en lugar de llenar el fichero de respaldo
+                    logger.error(f"Conversation log rejected {len(records)} records for {table}: {e}")
+                    with self._lock:
+                        self.rejected += len(records)
+                        self.last_rejection = str(e)[:500]
+                    continue
+                logger.error(f"Error inserting conversation log batch: {e}")
+                with self._lock:
+                    self.errors += 1
+                pending.extend((table, record) for record in records)
+
+        with self._lock:
+            if written:
+                self.flush_latency.record((time.monotonic() - start) * 1000)
+                self.flushed += written
+                self.batches += 1
+                self.max_batch = max(self.max_batch, written)
+        return written, pending
+
+    def _spill(self, batch: List[Tuple[str, Dict]]):
+        """Añadir registros al fichero local de respaldo"""
+        try:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lines = [json.dumps({"table": table, "record": record}, ensure_ascii=False) + '\n' for table, record in batch]
+            kept = 0
+            with self._open_spill('a') as f:
+                size = os.fstat(f.fileno()).st_size
+                for line in lines:
+                    size += len(line.encode('utf-8'))
+                    if size > self.max_spill_bytes:
+                        break
+                    f.write(line)
+                    kept += 1
+        except OSError as e:
+            logger.error(f"Error spilling conversation log: {e}")
+            with self._lock:
+                self.dropped += len(batch)
+            return
+
+        if kept < len(batch):
+            logger.warning(f"Conversation log spill file full ({self.max_spill_bytes} bytes): dropping {len(batch) - kept} records")
+        with self._lock:
+            self.spilled += kept
+            self.dropped += len(batch) - kept
+
+    def _open_spill(self, mode: str):
+        """Abrir el fichero de respaldo con flock exclusivo
+
+        Si otro worker lo renombró para reenviarlo mientras esperábamos el bloqueo, se
+        abre el fichero nuevo: nunca se escribe en uno que ya se está reenviando.
+        """
+        while True:
+            f = open(self.spill_path, mode, encoding='utf-8')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.spill_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _replay_spill(self):
+        """Reenviar los registros volcados mientras la base de datos no estaba disponible"""
+        # Nombre por proceso: cada worker reenvía solo lo que él mismo apartó
+        replay_path = f"{self.spill_path}.replay.{os.getpid()}"
+        if os.path.exists(replay_path):
+            # Dejado por un proceso anterior con el mismo PID
+            self._replay_file(replay_path)
+        try:
+            with self._open_spill('r'):
+                os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f"Error preparing conversation log replay: {e}")
+            return
+
+        self._replay_file(replay_path)
+        # Ficheros apartados por workers que murieron antes de terminar el reenvío
+        for orphan in glob.glob(f"{self.spill_path}.replay.*"):
+            pid = orphan.rsplit('.', 1)[-1]
+            if pid.isdigit() and int(pid) != os.getpid() and not _process_alive(int(pid)):
+                try:
+                    os.replace(orphan, replay_path)
+                except OSError:
+                    continue
+                self._replay_file(replay_path)
+
+    def _replay_file(self, replay_path: str):
+        batch = []
+        failed = False
+        with open(replay_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    with self._lock:
+                        self.dropped += 1
+                    continue
+
+                batch.append((entry['table'], entry['record']))
+                if len(batch) >= self.batch_size:
+                    failed = self._replay_batch(batch, failed)
+                    batch = []
+            if batch:
+                self._replay_batch(batch, failed)
+
+        os.remove(replay_path)
+
+    def _replay_batch(self, batch: List[Tuple[str, Dict]], failed: bool) -> bool:
+        """Reenviar un bloque del fichero; tras el primer fallo el resto vuelve al fichero sin intentarlo"""
+        if failed:
+            self._spill(batch)
+            return True
+        written, pending = self._insert(batch)
+        with self._lock:
+            self.replayed += written
+        if pending:
+            self._spill(pending)
+        return bool(pending)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Global conversation log writer
+conversation_logger = ConversationLogWriter(
+    batch_size=Config.CONVERSATION_LOG_BATCH_SIZE,
+    flush_interval=Config.CONVERSATION_LOG_FLUSH_INTERVAL,
+    max_buffer=Config.CONVERSATION_LOG_MAX_BUFFER,
+    spill_path=Config.CONVERSATION_LOG_SPILL_PATH,
+    max_spill_bytes=Config.CONVERSATION_LOG_MAX_SPILL_BYTES
+)
+atexit.register(conversation_logger.stop)
@@ -0,0 +1,347 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.services.conversation_log import is_permanent_error
+from app.services.worker_pool import BackgroundWorkerPool
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('user', 'assistant')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)"""
+    return max(1, len(text) // 4)
+
+
+class _Conversation:
+    __slots__ = ('turns', 'tokens', 'summary', 'overflow', 'overflow_tokens', 'summarizing',
+                 'message_count', 'last_active', 'synced_at')
+
+    def __init__(self, summary: str = '', turns: List[Tuple[int, str]] = None, message_count: int = 0):
+        # Turnos como (índice de rol, texto) para ocupar lo mínimo
+        self.turns: deque = deque()
+        self.tokens = 0
+        self.summary = summary
+        self.overflow: List[Tuple[int, str]] = []
+        self.overflow_tokens = 0
+        self.summarizing = False
+        self.message_count = message_count
+        self.last_active = time.time()
+        # Última vez que esta copia coincidía con la fila de la base de datos
+        self.synced_at = time.time()
+        for role, text in turns or ():
+            self.turns.append((role, text))
+            self.tokens += estimate_tokens(text)
+
+
+class ConversationMemory:
+    """Memoria de conversación por (asistente, canal, cliente): ventana acotada por tokens + resumen
+
+    LRU en memoria con escritura diferida (write-behind) a la tabla conversations. Otro
+    worker puede atender al mismo cliente: una copia sin cambios pendientes que lleva más
+    de reload_after segundos sin sincronizarse se relee antes de usarla, para no pisar sus turnos.
+    """
+
+    def __init__(self, max_conversations: int = 10000, token_budget: int = 1000, summarize_after_tokens: int = 600,
+                 summary_max_tokens: int = 200, idle_ttl: int = 86400, flush_interval: float = 5.0,
+                 reload_after: float = 300.0, summarizer: Optional[Callable[[str, List[Dict], int], str]] = None):
+        self.max_conversations = max_conversations
+        self.token_budget = token_budget
+        self.summarize_after_tokens = summarize_after_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.reload_after = reload_after
+        self.summarizer = summarizer
+
+        self._conversations: "OrderedDict[Tuple[str, str, str], _Conversation]" = OrderedDict()
+        self._dirty: Dict[Tuple[str, str, str], Dict] = {}
+        self._lock = threading.Lock()
+        self._summary_pool = BackgroundWorkerPool('conversation-summary', workers=1, max_queue_depth=1000)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.summaries = 0
+        self.summary_errors = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _key(assistant_id: Optional[str], channel: str, customer_id) -> Tuple[str, str, str]:
+        return (str(assistant_id or ''), channel, str(customer_id))
+
+    @staticmethod
+    def _memory_key(key: Tuple[str, str, str]) -> str:
+        return '|'.join(key)
+
+    def get_history(self, assistant_id: Optional[str], channel: str, customer_id) -> List[Dict]:
+        """Mensajes previos (resumen + ventana reciente) listos para el prompt"""
+        if customer_id is None or customer_id == '':
+            return []
+
+        conversation = self._get(self._key(assistant_id, channel, customer_id))
+        with self._lock:
+            messages = []
+            if conversation.summary:
+                messages.append({"role": "system", "content": f"Resumen de la conversación previa con este cliente: {conversation.summary}"})
+            messages.extend({"role": ROLES[role], "content": text} for role, text in conversation.turns)
+            return messages
+
+    def record_turn(self, assistant_id: Optional[str], channel: str, customer_id, user_message: str, assistant_message: str):
+        """Añadir el intercambio a la ventana; lo que no cabe pasa a resumirse"""
+        if customer_id is None or customer_id == '':
+            return
+
+        self._ensure_started()
+        key = self._key(assistant_id, channel, customer_id)
+        conversation = self._get(key)
+
+        with self._lock:
+            for role, text in ((0, user_message), (1, assistant_message)):
+                conversation.turns.append((role, text))
+                conversation.tokens += estimate_tokens(text)
+
+            # Se retiran pares pregunta/respuesta para que la ventana empiece siempre por el cliente
+            while conversation.tokens > self.token_budget and len(conversation.turns) > 2:
+                for turn in (conversation.turns.popleft(), conversation.turns.popleft()):
+                    turn_tokens = estimate_tokens(turn[1])
+                    conversation.tokens -= turn_tokens
+                    conversation.overflow.append(turn)
+                    conversation.overflow_tokens += turn_tokens
+
+            # Si el resumen no avanza, no dejamos crecer el desbordamiento sin límite
+            while conversation.overflow_tokens > self.summarize_after_tokens * 4:
+                dropped = conversation.overflow.pop(0)
+                conversation.overflow_tokens -= estimate_tokens(dropped[1])
+
+            conversation.message_count += 2
+            conversation.last_active = time.time()
+            self._dirty[key] = self._snapshot(key, conversation)
+
+            summarize = conversation.overflow_tokens >= self.summarize_after_tokens and not conversation.summarizing
+            if summarize:
+                conversation.summarizing = True
+
+        if summarize and not self._summary_pool.submit(self._summarize, key, conversation):
+            with self._lock:
+                conversation.summarizing = False
+
+    def flush(self) -> int:
+        """Escribir en bloque las conversaciones modificadas"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            batch = self._dirty
+            self._dirty = {}
+
+        try:
+            db.get_client().table("conversations").upsert(list(batch.values()), on_conflict="memory_key").execute()
+        except Exception as e:
+            if not is_permanent_error(e):
+                logger.error(f"Error flushing conversation memory: {e}")
+                with self._lock:
+                    self.flush_errors += 1
+                    # Reencolar sin pisar cambios más recientes
+                    for key, record in batch.items():
+                        self._dirty.setdefault(key, record)
+                return 0
+            # Una fila imposible (p. ej. asistente borrado) no debe bloquear al resto: de una en una
+            batch = self._flush_rows(batch)
+
+        now = time.time()
+        with self._lock:
+            self.flushed += len(batch)
+            for key in batch:
+                conversation = self._conversations.get(key)
+                if conversation is not None and key not in self._dirty:
+                    conversation.synced_at = now
+        return len(batch)
+
+    def _flush_rows(self, batch: Dict[Tuple[str, str, str], Dict]) -> Dict[Tuple[str, str, str], Dict]:
+        """Escribir fila a fila tras un error permanente; devuelve las que se escribieron"""
+        written = {}
+        for key, record in batch.items():
+            try:
+                db.get_client().table("conversations").upsert(record, on_conflict="memory_key").execute()
+                written[key] = record
+            except Exception as e:
+                with self._lock:
+                    if is_permanent_error(e):
+                        logger.warning(f"Conversation memory {record.get('memory_key')} rejected, dropping: {e}")
+                        self.rejected += 1
+                    else:
+                        logger.error(f"Error flushing conversation memory: {e}")
+                        self.flush_errors += 1
+                        self._dirty.setdefault(key, record)
+        return written
+
+    def start(self):
+        """Arrancar el hilo de escritura diferida"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='conversation-memory-flush', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.flush_interval * 2)
+        self.flush()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "max_conversations": self.max_conversations,
+                "pending_writes": len(self._dirty),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "summaries": self.summaries,
+                "summary_errors": self.summary_errors,
+                "flushed": self.flushed,
+                "flush_errors": self.flush_errors,
+                "rejected": self.rejected
+            }
+
+    def _ensure_started(self):
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self._evict_idle()
+
+    def _get(self, key: Tuple[str, str, str]) -> _Conversation:
+        with self._lock:
+            cached = self._conversations.get(key)
+            if cached is not None and (key in self._dirty or cached.summarizing
+                                       or time.time() - cached.synced_at < self.reload_after):
+                self._conversations.move_to_end(key)
+                self.hits += 1
+                return cached
+
+            # Una conversación expulsada pero aún no escrita se recupera de la cola
+            pending = self._dirty.get(key)
+
+        if pending:
+            conversation = self._from_record(pending)
+        else:
+            # Sin copia o con una copia que otro worker puede haber dejado atrás
+            conversation = self._load(key)
+            if conversation is None:
+                conversation = cached or _Conversation()
+
+        with self._lock:
+            existing = self._conversations.get(key)
+            if existing is not None and existing is not cached:
+                return existing
+            if existing is not None and key in self._dirty:
+                # Se registró un turno mientras se releía: la copia local es la más reciente
+                return existing
+            self._conversations[key] = conversation
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+            return conversation
+
+    def _load(self, key: Tuple[str, str, str]) -> Optional[_Conversation]:
+        """Conversación guardada (vacía si no existe); None si la base de datos no responde"""
+        try:
+            result = db.get_client().table("conversations").select("summary,history,message_count") \
+                .eq("memory_key", self._memory_key(key)).limit(1).execute()
+        except Exception as e:
+            logger.error(f"Error loading conversation memory: {e}")
+            return None
+
+        with self._lock:
+            self.loads += 1
+        return self._from_record(result.data[0]) if result.data else _Conversation()
+
+    @staticmethod
+    def _from_record(record: Dict) -> _Conversation:
+        turns = [(ROLES.index(message['role']), message['content'])
+                 for message in record.get('history') or [] if message.get('role') in ROLES]
+        return _Conversation(record.get('summary') or '', turns, record.get('message_count') or 0)
+
+    def _snapshot(self, key: Tuple[str, str, str], conversation: _Conversation) -> Dict:
+        assistant_id, channel, customer_id = key
+        return {
+            "memory_key": self._memory_key(key),
+            "assistant_id": assistant_id or None,
+            "channel": channel,
+            "customer_phone": customer_id[:20] if channel in ('whatsapp', 'voice') else None,
+            "summary": conversation.summary,
+            "history": [{"role": ROLES[role], "content": text} for role, text in conversation.turns],
+            "last_message": conversation.turns[-1][1] if conversation.turns else None,
+            "message_count": conversation.message_count,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+
+    def _summarize(self, key: Tuple[str, str, str], conversation: _Conversation):
+        with self._lock:
+            turns = list(conversation.overflow)
+            previous_summary = conversation.summary
+
+        try:
+            messages = [{"role": ROLES[role], "content": text} for role, text in turns]
+            summary = self._summarizer()(previous_summary, messages, self.summary_max_tokens)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            summary = None
+
+        with self._lock:
+            conversation.summarizing = False
+            if not summary:
+                self.summary_errors += 1
+                return
+
+            # Solo se retiran los turnos resumidos; los llegados mientras tanto esperan al siguiente resumen
+            del conversation.overflow[:len(turns)]
+            conversation.overflow_tokens = sum(estimate_tokens(text) for _, text in conversation.overflow)
+            conversation.summary = summary
+            self.summaries += 1
+            if self._conversations.get(key) is conversation:
+                self._dirty[key] = self._snapshot(key, conversation)
+
+    def _summarizer(self) -> Callable[[str, List[Dict], int], str]:
+        if self.summarizer is None:
+            from app.services.openai_service import OpenAIService
+            self.summarizer = OpenAIService().summarize_conversation
+        return self.summarizer
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            while self._conversations:
+                key, conversation = next(iter(self._conversations.items()))
+                if conversation.last_active > cutoff:
+                    break
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+
+
+# Global conversation memory instance
+conversation_memory = ConversationMemory(
+    max_conversations=Config.CONVERSATION_MEMORY_MAX_CONVERSATIONS,
+    token_budget=Config.CONVERSATION_MEMORY_TOKEN_BUDGET,
+    summarize_after_tokens=Config.CONVERSATION_MEMORY_SUMMARIZE_AFTER,
+    idle_ttl=Config.CONVERSATION_MEMORY_IDLE_TTL,
+    flush_interval=Config.CONVERSATION_MEMORY_FLUSH_INTERVAL,
+    reload_after=Config.CONVERSATION_MEMORY_RELOAD_AFTER
+)
@@ -1,10 +1,18 @@
 
 import os
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, Float
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text, Column, Integer, String, DateTime, Boolean, Text, Float
+from sqlalchemy import exc as sqlalchemy_exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+from app.config import Config
+from app.services.http_client import LatencyHistogram
 
 Base = declarative_base()
 
@@ -48,17 +56,106 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     responded_at = Column(DateTime)
 
+class PoolStats:
+    """Connection pool checkout counters and wait-time histogram"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait = LatencyHistogram()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_wait_ms = 0.0
+
+    def record_wait(self, wait_ms, timed_out=False):
+        with self._lock:
+            self.wait.record(wait_ms)
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "max_wait_ms": round(self.max_wait_ms, 2),
+                "wait": self.wait.to_dict()
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that measures how long callers wait for a connection"""
+
+    stats = None
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            connection = super()._do_get()
+        except sqlalchemy_exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.record_wait((time.monotonic() - start) * 1000, timed_out=True)
+            raise
+        if self.stats is not None:
+            self.stats.record_wait((time.monotonic() - start) * 1000)
+        return connection
+
+    def recreate(self):
+        # dispose() rebuilds the pool; keep reporting into the same counters
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer; busy_timeout waits instead of failing on locks"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
 class DatabaseManager:
     def __init__(self, database_url=None):
         self.database_url = database_url or os.environ.get('DATABASE_URL', 'sqlite:///app.db')
         self.engine = None
         self.SessionLocal = None
+        self.Session = None
+        self.pool_stats = PoolStats()
+        
+    def _engine_options(self):
+        """Pool settings for the configured database"""
+        url = make_url(self.database_url)
+        if url.get_backend_name() == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                # In-memory databases live in a single connection; keep SQLAlchemy's default pool
+                return {'connect_args': {'check_same_thread': False}}
+            options = {'connect_args': {'check_same_thread': False}}
+        else:
+            options = {}
         
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=Config.DATABASE_POOL_SIZE,
+            max_overflow=Config.DATABASE_MAX_OVERFLOW,
+            pool_timeout=Config.DATABASE_POOL_TIMEOUT,
+            pool_recycle=Config.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=Config.DATABASE_POOL_PRE_PING
+        )
+        return options
+    
     def init_db(self):
         """Initialize database connection"""
         try:
-            self.engine = create_engine(self.database_url)
+            self.engine = create_engine(self.database_url, **self._engine_options())
+            if isinstance(self.engine.pool, InstrumentedQueuePool):
+                self.engine.pool.stats = self.pool_stats
+            if self.engine.dialect.name == 'sqlite':
+                event.listen(self.engine, 'connect', _set_sqlite_pragmas)
+            
             self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+            self.Session = scoped_session(self.SessionLocal)
             
             # Create tables
             Base.metadata.create_all(bind=self.engine)
@@ -68,22 +165,66 @@ class DatabaseManager:
             logging.error(f"Database initialization failed: {e}")
             raise
     
+    def init_app(self, app):
+        """Release the request's session when the app context ends"""
+        app.teardown_appcontext(self.remove_session)
+    
     def get_session(self):
-        """Get database session"""
+        """Get the session scoped to the current request/thread"""
+        if not self.Session:
+            self.init_db()
+        return self.Session()
+    
+    def remove_session(self, exception=None):
+        """Close the scoped session and return its connection to the pool"""
+        if self.Session:
+            if exception is not None:
+                self.Session.rollback()
+            self.Session.remove()
+    
+    @contextmanager
+    def session_scope(self):
+        """Session for work outside a request: commit on success, rollback on error"""
         if not self.SessionLocal:
             self.init_db()
-        return self.SessionLocal()
+        session = self.SessionLocal()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
     
     def health_check(self):
         """Check database health"""
         try:
-            session = self.get_session()
-            session.execute("SELECT 1")
-            session.close()
+            if not self.engine:
+                self.init_db()
+            # A pooled connection, not a new session per probe
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
             return True
         except Exception as e:
             logging.error(f"Database health check failed: {e}")
             return False
+    
+    def get_stats(self):
+        """Pool occupancy and checkout wait times"""
+        stats = {"pool_stats": self.pool_stats.to_dict()}
+        if self.engine is not None:
+            pool = self.engine.pool
+            stats["pool_class"] = type(pool).__name__
+            if isinstance(pool, QueuePool):
+                stats.update(
+                    size=pool.size(),
+                    checked_in=pool.checkedin(),
+                    checked_out=pool.checkedout(),
+                    overflow=pool.overflow(),
+                    max_overflow=Config.DATABASE_MAX_OVERFLOW
+                )
+        return stats
 
 # Global database instance
 db_manager = DatabaseManager()
@@ -0,0 +1,176 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MemorySeenBackend:
+    """Conjunto de IDs vistos en memoria, con caducidad y tamaño máximo"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_if_absent(self, key: str, ttl: int) -> bool:
+        now = time.time()
+        with self._lock:
+            # Con TTL fijo el orden de inserción coincide con el de caducidad
+            while self._keys:
+                oldest_key, expires_at = next(iter(self._keys.items()))
+                if expires_at > now and len(self._keys) < self.max_keys:
+                    break
+                self._keys.popitem(last=False)
+
+            expires_at = self._keys.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+
+            self._keys[key] = now + ttl
+            self._keys.move_to_end(key)
+            return True
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._keys)
+
+
+class SQLiteSeenBackend:
+    """Conjunto de IDs vistos en SQLite, compartido entre procesos del mismo host"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._inserts = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_seen (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_webhook_seen_expires ON webhook_seen(expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def add_if_absent(self, key: str, ttl: int) -> bool:
+        now = time.time()
+        connection = self._connection()
+
+        connection.execute("DELETE FROM webhook_seen WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO webhook_seen (key, expires_at) VALUES (?, ?)", (key, now + ttl)
+        )
+        inserted = cursor.rowcount == 1
+
+        if inserted:
+            with self._lock:
+                self._inserts += 1
+                purge = self._inserts % self.PURGE_EVERY == 0
+            if purge:
+                connection.execute("DELETE FROM webhook_seen WHERE expires_at <= ?", (now,))
+
+        return inserted
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM webhook_seen").fetchone()[0]
+
+
+class RedisSeenBackend:
+    """Conjunto de IDs vistos en Redis (SET NX EX), compartido entre hosts"""
+
+    def __init__(self, url: str, prefix: str = 'webhook_seen:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def add_if_absent(self, key: str, ttl: int) -> bool:
+        return bool(self.client.set(self.prefix + key, 1, nx=True, ex=ttl))
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+def create_seen_backend(storage_url: str, max_keys: int = 100000):
+    """Crear el backend a partir de una URL: memory://, sqlite:///ruta o redis://"""
+    if storage_url.startswith('sqlite:///'):
+        return SQLiteSeenBackend(storage_url[len('sqlite:///'):])
+    if storage_url.startswith(('redis://', 'rediss://')):
+        return RedisSeenBackend(storage_url)
+    return MemorySeenBackend(max_keys)
+
+
+class WebhookDeduplicator:
+    """Descartar reintentos de webhooks ya procesados según el ID del proveedor"""
+
+    def __init__(self, backend, ttl: int = 86400):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._checked: Dict[str, int] = {}
+        self._duplicates: Dict[str, int] = {}
+        self.errors = 0
+
+    def is_duplicate(self, namespace: str, message_id) -> bool:
+        """Registrar el ID y devolver True si ya se había visto dentro del TTL"""
+        if message_id is None or message_id == '':
+            return False
+
+        try:
+            is_new = self.backend.add_if_absent(f"{namespace}:{message_id}", self.ttl)
+        except Exception as e:
+            # Ante fallos del backend preferimos procesar antes que perder mensajes
+            logger.error(f"Deduplication backend error: {e}")
+            with self._lock:
+                self.errors += 1
+            return False
+
+        with self._lock:
+            self._checked[namespace] = self._checked.get(namespace, 0) + 1
+            if not is_new:
+                self._duplicates[namespace] = self._duplicates.get(namespace, 0) + 1
+
+        if not is_new:
+            logger.info(f"Duplicate {namespace} webhook ignored: {message_id}")
+        return not is_new
+
+    def get_stats(self) -> Dict:
+        try:
+            tracked = self.backend.size()
+        except Exception:
+            tracked = None
+
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "tracked_ids": tracked,
+                "checked": dict(self._checked),
+                "duplicates": dict(self._duplicates),
+                "errors": self.errors
+            }
+
+
+# Global deduplicator instance
+webhook_deduplicator = WebhookDeduplicator(
+    create_seen_backend(Config.WEBHOOK_DEDUP_STORAGE_URL, Config.WEBHOOK_DEDUP_MAX_KEYS),
+    ttl=Config.WEBHOOK_DEDUP_TTL
+)
@@ -1,8 +1,10 @@
 
-import requests
 import json
 import logging
+import time
 from app.config import Config
+from app.services.channel_stats import channel_stats
+from app.services.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -12,8 +14,9 @@ class EmailService:
         self.from_email = Config.FROM_EMAIL
         self.base_url = "https://api.sendgrid.com/v3"
     
-    def send_email(self, to_email, subject, html_content, text_content=None):
-        """Enviar email"""
+    def send_email(self, to_email, subject, html_content, text_content=None, tenant_key=None):
+        """Enviar email; los envíos con tenant_key cuentan en /api/email/stats"""
+        started_at = time.monotonic()
         try:
             url = f"{self.base_url}/mail/send"
             headers = {
@@ -38,14 +41,18 @@ class EmailService:
                     "value": text_content
                 })
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post('sendgrid', url, headers=headers, json=payload)
             response.raise_for_status()
             
             logger.info(f"Email sent to {to_email}")
+            if tenant_key:
+                channel_stats.record(tenant_key, 'email', (time.monotonic() - started_at) * 1000)
             return True
             
         except Exception as e:
             logger.error(f"Error sending email: {e}")
+            if tenant_key:
+                channel_stats.record(tenant_key, 'email', responded=False)
             return False
     
     def send_template_email(self, to_email, template_id, dynamic_data=None):
@@ -68,7 +75,7 @@ class EmailService:
             if dynamic_data:
                 payload["personalizations"][0]["dynamic_template_data"] = dynamic_data
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post('sendgrid', url, headers=headers, json=payload)
             response.raise_for_status()
             
             return True
@@ -0,0 +1,227 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# POST/PATCH pueden haber tenido efecto aunque fallen: solo se reintentan si el
+# proveedor pide esperar explícitamente (estos códigos con Retry-After)
+NON_IDEMPOTENT_RETRY_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def parse_limits(value: str, cast=int) -> Dict[str, int]:
+    """Convertir 'whatsapp=20,twilio=10' en un diccionario"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            provider, limit = item.split('=', 1)
+            limits[provider.strip()] = cast(limit)
+    return limits
+
+
+class LatencyHistogram:
+    """Histograma de latencias con cubetas fijas en milisegundos"""
+
+    BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def record(self, latency_ms: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, latency_ms)] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Cota superior de la cubeta que contiene el percentil"""
+        if not self.total:
+            return None
+        threshold = fraction * self.total
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else float('inf')
+        return float('inf')
+
+    def to_dict(self) -> Dict:
+        labels = [f"le_{bound}" for bound in self.BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.total,
+            "avg_ms": round(self.sum_ms / self.total, 2) if self.total else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class _ProviderState:
+    def __init__(self, concurrency: int, pool_maxsize: int):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.status_counts: Dict[int, int] = {}
+
+
+class HTTPClient:
+    """Cliente HTTP saliente compartido: pools keep-alive, timeouts, reintentos y límites por proveedor"""
+
+    def __init__(self, connect_timeout: float = 5, read_timeout: float = 30, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 10, pool_maxsize: int = 20,
+                 default_concurrency: int = 20, provider_concurrency: Dict[str, int] = None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+        self.default_concurrency = default_concurrency
+        self.provider_concurrency = provider_concurrency or {}
+        self._providers: Dict[str, _ProviderState] = {}
+        self._lock = threading.Lock()
+
+    def _provider(self, provider: str) -> _ProviderState:
+        state = self._providers.get(provider)
+        if state is None:
+            with self._lock:
+                state = self._providers.get(provider)
+                if state is None:
+                    concurrency = self.provider_concurrency.get(provider, self.default_concurrency)
+                    state = _ProviderState(concurrency, max(self.pool_maxsize, concurrency))
+                    self._providers[provider] = state
+        return state
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Espera exponencial con jitter completo; respeta Retry-After si viene en segundos"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _connect_failed(error: requests.exceptions.ConnectionError) -> bool:
+        """True si el fallo ocurrió al abrir la conexión, antes de enviar la petición"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def _should_retry(response: requests.Response, idempotent: bool) -> bool:
+        if idempotent:
+            return response.status_code in RETRY_STATUSES
+        return (response.status_code in NON_IDEMPOTENT_RETRY_STATUSES
+                and bool(response.headers.get('Retry-After')))
+
+    def request(self, provider: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Realizar la petición a través del pool del proveedor"""
+        state = self._provider(provider)
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            with state.semaphore:
+                start = time.monotonic()
+                try:
+                    response = state.session.request(method, url, **kwargs)
+                except requests.exceptions.ConnectionError as e:
+                    # Si la conexión se cortó después de enviar, un POST pudo ejecutarse ya
+                    with self._lock:
+                        state.errors += 1
+                    if attempt >= self.max_retries or not (idempotent or self._connect_failed(e)):
+                        raise
+                    logger.warning(f"{provider} connection error, retrying: {e}")
+                    response = None
+                finally:
+                    latency_ms = (time.monotonic() - start) * 1000
+
+            with self._lock:
+                state.requests += 1
+                state.latency.record(latency_ms)
+                if response is not None:
+                    state.status_counts[response.status_code] = state.status_counts.get(response.status_code, 0) + 1
+
+            if response is not None and (not self._should_retry(response, idempotent) or attempt >= self.max_retries):
+                return response
+
+            delay = self._backoff(attempt, response)
+            attempt += 1
+            with self._lock:
+                state.retries += 1
+            if response is not None:
+                logger.warning(f"{provider} returned {response.status_code}, retry {attempt} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def get(self, provider: str, url: str, **kwargs) -> requests.Response:
+        return self.request(provider, 'GET', url, **kwargs)
+
+    def post(self, provider: str, url: str, **kwargs) -> requests.Response:
+        return self.request(provider, 'POST', url, **kwargs)
+
+    def get_stats(self) -> Dict:
+        stats = {}
+        with self._lock:
+            providers = dict(self._providers)
+
+        for provider, state in providers.items():
+            connections, pooled_requests = self._pool_counters(state)
+            with self._lock:
+                stats[provider] = {
+                    "requests": state.requests,
+                    "retries": state.retries,
+                    "connection_errors": state.errors,
+                    "status_codes": dict(state.status_counts),
+                    "connections_opened": connections,
+                    "connection_reuse_rate": round(1 - connections / pooled_requests, 4) if pooled_requests else None,
+                    "latency": state.latency.to_dict()
+                }
+        return stats
+
+    @staticmethod
+    def _pool_counters(state: _ProviderState) -> List[int]:
+        """Sumar conexiones abiertas y peticiones servidas por los pools de urllib3"""
+        connections = 0
+        pooled_requests = 0
+        pools = state.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pooled_requests += pool.num_requests
+        return [connections, pooled_requests]
+
+
+# Global HTTP client instance
+http_client = HTTPClient(
+    connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+    read_timeout=Config.HTTP_READ_TIMEOUT,
+    max_retries=Config.HTTP_MAX_RETRIES,
+    backoff_base=Config.HTTP_BACKOFF_BASE,
+    backoff_max=Config.HTTP_BACKOFF_MAX,
+    pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+    default_concurrency=Config.HTTP_MAX_CONCURRENCY,
+    provider_concurrency=parse_limits(Config.HTTP_PROVIDER_CONCURRENCY)
+)
@@ -0,0 +1,153 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.services.response_cache import normalize_message
+from app.utils.aho_corasick import AhoCorasick
+
+logger = logging.getLogger(__name__)
+
+# Intenciones por defecto; el orden decide los empates. Las frases se comparan por palabras
+# completas, así que los plurales se listan aparte
+DEFAULT_INTENTS = {
+    'appointment': ['cita', 'citas', 'appointment', 'reservar', 'agendar', 'turno', 'turnos', 'consulta', 'consultas',
+                    'horario disponible'],
+    'transfer': ['urgente', 'emergencia', 'hablar con persona', 'hablar con una persona', 'hablar con alguien',
+                 'hablar con un humano', 'hablar con un representante', 'hablar con un agente',
+                 'hablar con un operador', 'pasar con una persona', 'pasar con un representante']
+}
+
+# Comandos de Telegram -> intención
+COMMANDS = {
+    '/start': 'start',
+    '/help': 'help',
+    '/agendar': 'appointment'
+}
+
+# Clave de business_context con las frases propias del cliente: {"intención": ["frase", ...]}
+TENANT_INTENTS_KEY = 'intent_keywords'
+
+
+class CompiledIntents:
+    """Frases de todas las intenciones compiladas en un único autómata"""
+
+    def __init__(self, intents: Dict[str, List[str]]):
+        self.order = {intent: position for position, intent in enumerate(intents)}
+        self.matcher = AhoCorasick()
+        seen = set()
+        for intent, phrases in intents.items():
+            for phrase in phrases:
+                normalized = normalize_message(phrase)
+                if normalized and (intent, normalized) not in seen:
+                    seen.add((intent, normalized))
+                    # Espacios a ambos lados: solo palabras completas ("humano" no en "humanos", "cita" no en "felicitar")
+                    self.matcher.add(f" {normalized} ", (intent, normalized, len(normalized.split())))
+        self.matcher.build()
+
+    def classify(self, text: str) -> List[Tuple[str, float, List[str]]]:
+        """Una pasada sobre el texto: (intención, puntuación, frases encontradas), de mayor a menor"""
+        hits: Dict[str, Dict[str, int]] = {}
+        for _, _, (intent, phrase, weight) in self.matcher.iter_matches(f" {normalize_message(text)} "):
+            hits.setdefault(intent, {})[phrase] = weight
+
+        # Cada frase distinta suma una vez; las de varias palabras pesan más
+        scored = [(intent, float(sum(phrases.values())), list(phrases)) for intent, phrases in hits.items()]
+        scored.sort(key=lambda item: (-item[1], self.order[item[0]]))
+        return scored
+
+
+class IntentMatcher:
+    """Clasificación de intenciones por palabras clave, compilada por cliente
+
+    Las frases por defecto se amplían con las de business_context['intent_keywords'].
+    Los autómatas se guardan en una LRU por asistente y se recompilan cuando cambian
+    sus frases o al invalidarlos.
+    """
+
+    def __init__(self, intents: Dict[str, List[str]] = None, max_tenants: int = 1000):
+        self.intents = intents or DEFAULT_INTENTS
+        self.max_tenants = max_tenants
+        self._default = CompiledIntents(self.intents)
+        self._tenants: "OrderedDict[str, Tuple[Dict, CompiledIntents]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.classifications = 0
+        self.compilations = 0
+
+    def classify(self, text: str, business_context: Optional[Dict] = None) -> List[Tuple[str, float, List[str]]]:
+        """Intenciones puntuadas del texto para el cliente del contexto"""
+        with self._lock:
+            self.classifications += 1
+        if not text:
+            return []
+        return self._compiled(business_context).classify(text)
+
+    def best_intent(self, text: str, business_context: Optional[Dict] = None) -> Optional[str]:
+        scored = self.classify(text, business_context)
+        return scored[0][0] if scored else None
+
+    def explicit_request(self, text: str, intent: str, business_context: Optional[Dict] = None) -> bool:
+        """True si `intent` es la intención principal y el texto contiene una de sus frases de varias palabras
+
+        Para atajos que se saltan el modelo: una palabra suelta ("urgente") no basta.
+        """
+        scored = self.classify(text, business_context)
+        return bool(scored) and scored[0][0] == intent and any(' ' in phrase for phrase in scored[0][2])
+
+    @staticmethod
+    def command(text: str) -> Optional[str]:
+        """Intención de un comando de Telegram (/agendar, /agendar@bot, /agendar mañana)"""
+        if not text or not text.startswith('/'):
+            return None
+        return COMMANDS.get(text.split(maxsplit=1)[0].split('@', 1)[0].lower())
+
+    def invalidate(self, assistant_id: Optional[str] = None):
+        """Descartar los autómatas de un asistente (o de todos)"""
+        with self._lock:
+            if assistant_id is None:
+                self._tenants.clear()
+            else:
+                self._tenants.pop(str(assistant_id), None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "tenants": len(self._tenants),
+                "max_tenants": self.max_tenants,
+                "default_patterns": len(self._default.matcher),
+                "classifications": self.classifications,
+                "compilations": self.compilations
+            }
+
+    def _compiled(self, business_context: Optional[Dict]) -> CompiledIntents:
+        tenant_intents = (business_context or {}).get(TENANT_INTENTS_KEY)
+        assistant_id = (business_context or {}).get('assistant_id')
+        if not tenant_intents or not isinstance(tenant_intents, dict) or not assistant_id:
+            return self._default
+
+        assistant_id = str(assistant_id)
+        with self._lock:
+            entry = self._tenants.get(assistant_id)
+            if entry is not None and entry[0] == tenant_intents:
+                self._tenants.move_to_end(assistant_id)
+                return entry[1]
+
+        intents = {intent: list(phrases) for intent, phrases in self.intents.items()}
+        for intent, phrases in tenant_intents.items():
+            if isinstance(phrases, list):
+                intents.setdefault(intent, []).extend(phrase for phrase in phrases if isinstance(phrase, str))
+        compiled = CompiledIntents(intents)
+
+        with self._lock:
+            self.compilations += 1
+            self._tenants[assistant_id] = (dict(tenant_intents), compiled)
+            self._tenants.move_to_end(assistant_id)
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        return compiled
+
+
+# Global intent matcher
+intent_matcher = IntentMatcher(max_tenants=Config.INTENT_MATCHER_MAX_TENANTS)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.utils.aho_corasick import AhoCorasick
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.6
+KEYWORD_WEIGHT = 0.3
+
+
+def knowledge_signature(custom_knowledge: Dict) -> str:
+    """Hash del contenido de custom_knowledge: cambia al editar cualquier pregunta o respuesta"""
+    serialized = json.dumps(custom_knowledge, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def _keyword_score(matches: int) -> float:
+    """Replicar la suma incremental de _calculate_similarity (mismo redondeo)"""
+    score = 0
+    for _ in range(matches):
+        score += KEYWORD_WEIGHT
+    return score
+
+
+class KnowledgeIndex:
+    """Índice invertido sobre los pares pregunta-respuesta de custom_knowledge"""
+
+    def __init__(self, custom_knowledge: Dict):
+        self.answers: List[str] = []
+        self.question_sizes: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        self.keyword_matcher = AhoCorasick()
+        self.keyword_owners: List[int] = []
+        self.always_matching_keywords: Dict[int, int] = {}
+
+        for qa_pairs in custom_knowledge.values():
+            for qa in qa_pairs:
+                self._add(qa)
+
+        self.keyword_matcher.build()
+
+    def _add(self, qa: Dict):
+        qa_id = len(self.answers)
+        self.answers.append(qa['answer'])
+
+        question_words = set(qa['question'].lower().split())
+        self.question_sizes.append(len(question_words))
+        for word in question_words:
+            self.postings.setdefault(word, []).append(qa_id)
+
+        # Las palabras clave se comparan como subcadenas del mensaje, igual que antes;
+        # cada entrada de la lista suma una vez aunque aparezca varias veces
+        for keyword in qa.get('keywords') or []:
+            keyword = keyword.lower()
+            if keyword:
+                self.keyword_matcher.add(keyword, len(self.keyword_owners))
+                self.keyword_owners.append(qa_id)
+            else:
+                # "" in mensaje siempre es True
+                self.always_matching_keywords[qa_id] = self.always_matching_keywords.get(qa_id, 0) + 1
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def search(self, message: str, threshold: float = SIMILARITY_THRESHOLD) -> Tuple[Optional[str], float]:
+        """Devolver la mejor respuesta y su puntuación (o None si no supera el umbral)"""
+        best_id, best_score = self.best_match(message)
+        if best_id is None or best_score <= threshold:
+            return None, best_score
+        return self.answers[best_id], best_score
+
+    def best_match(self, message: str) -> Tuple[Optional[int], float]:
+        """Puntuar solo los pares presentes en las listas de coincidencias del mensaje"""
+        message_lower = message.lower()
+
+        keyword_hits: Dict[int, int] = dict(self.always_matching_keywords)
+        matched_entries = {entry_id for _, _, entry_id in self.keyword_matcher.iter_matches(message_lower)}
+        for entry_id in matched_entries:
+            qa_id = self.keyword_owners[entry_id]
+            keyword_hits[qa_id] = keyword_hits.get(qa_id, 0) + 1
+
+        common_words: Dict[int, int] = {}
+        for word in set(message_lower.split()):
+            for qa_id in self.postings.get(word, ()):
+                common_words[qa_id] = common_words.get(qa_id, 0) + 1
+
+        best_id = None
+        best_score = 0
+        for qa_id in sorted(keyword_hits.keys() | common_words.keys()):
+            question_size = self.question_sizes[qa_id]
+            question_score = common_words.get(qa_id, 0) / question_size if question_size > 0 else 0
+            score = min(_keyword_score(keyword_hits.get(qa_id, 0)) + question_score, 1.0)
+
+            if score > best_score:
+                best_score = score
+                best_id = qa_id
+
+        return best_id, best_score
+
+
+class KnowledgeIndexRegistry:
+    """Caché LRU de índices por asistente; se reconstruye solo cuando cambia knowledge_version"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[object, Tuple[object, KnowledgeIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get_index(self, custom_knowledge: Dict, assistant_id: Optional[str] = None,
+                  version: Optional[float] = None) -> KnowledgeIndex:
+        """Obtener el índice del asistente, construyéndolo si no existe o está desactualizado
+
+        version es el knowledge_version de business_context; las escrituras invalidan la
+        entrada, así que solo se calcula el hash del conocimiento cuando falta la versión.
+        """
+        if assistant_id is not None:
+            key = ('assistant', assistant_id)
+            fingerprint = ('version', version) if version is not None else knowledge_signature(custom_knowledge)
+        else:
+            # Sin asistente identificamos el diccionario por identidad
+            key = ('object', id(custom_knowledge))
+            fingerprint = custom_knowledge
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_fingerprint, index = entry
+                if cached_fingerprint is fingerprint or (assistant_id is not None and cached_fingerprint == fingerprint):
+                    self._entries.move_to_end(key)
+                    return index
+
+        index = KnowledgeIndex(custom_knowledge)
+
+        with self._lock:
+            self.builds += 1
+            self._entries[key] = (fingerprint, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        logger.info(f"Knowledge index built with {len(index)} QA pairs (assistant: {assistant_id})")
+        return index
+
+    def invalidate(self, assistant_id: str):
+        """Descartar el índice de un asistente cuando se actualiza su business_context"""
+        with self._lock:
+            self._entries.pop(('assistant', assistant_id), None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "indexes": len(self._entries),
+                "builds": self.builds
+            }
+
+
+# Global registry instance
+knowledge_index_registry = KnowledgeIndexRegistry(Config.KNOWLEDGE_INDEX_MAX_ENTRIES)
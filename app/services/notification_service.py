@@ -1,17 +1,59 @@
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
 from app.config import Config
 from app.services.whatsapp_service import WhatsAppService
 from app.services.sms_service import SMSService
 from app.services.email_service import EmailService
 from app.services.voice_service import VoiceService
 from app.services.call_service import CallService
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
-from typing import Dict, Optional, List
+import threading
+import time
+from typing import Dict, Optional, List, Iterable, Iterator, Tuple
 
 logger = logging.getLogger(__name__)
 
+CHANNELS = ['whatsapp', 'sms', 'email', 'voice']
+
+class ChannelThrottle:
+    """Token bucket bloqueante para respetar la cuota de envío de un canal"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        if not rate > 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+def build_throttles(value: str) -> Dict[str, ChannelThrottle]:
+    """Throttles de NOTIFICATION_RATE_LIMITS; las cuotas no numéricas o <= 0 se ignoran"""
+    throttles = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        channel, rate = (part.strip() for part in item.split('=', 1))
+        try:
+            throttles[channel] = ChannelThrottle(float(rate))
+        except ValueError:
+            logger.error(f"Invalid NOTIFICATION_RATE_LIMITS entry '{item.strip()}': rate must be a positive number")
+    return {channel: throttles[channel] for channel in CHANNELS if channel in throttles}
+
+# Global channel throttles: la cuota es del proveedor, todas las instancias la comparten
+channel_throttles = build_throttles(Config.NOTIFICATION_RATE_LIMITS)
+
 class NotificationService:
     def __init__(self):
         self.whatsapp_service = WhatsAppService()
@@ -20,6 +62,10 @@ class NotificationService:
         self.voice_service = VoiceService()
         self.call_service = CallService()
 
+        self.throttles = channel_throttles
+        self.bulk_stats = {}
+        self._stats_lock = threading.Lock()
+
     def send_appointment_reminder(self, appointment_data: Dict) -> bool:
         """Envía recordatorio de cita por WhatsApp"""
         try:
@@ -146,37 +192,163 @@ Accede a tu dashboard: [LINK]
 
         results = {}
 
+        for channel in CHANNELS:
+            if channel in channels and self._has_destination(channel, customer_data):
+                results[channel] = self._send_channel(channel, customer_data, notification_data)
+
+        return results
+
+    def send_bulk_notifications(self, recipients: Iterable[Tuple[Dict, Dict]], channels: List[str] = None,
+                                max_in_flight: int = None) -> Iterator[Dict]:
+        """Enviar notificaciones masivas en paralelo por canal y devolver resultados por destinatario"""
+        if channels is None:
+            channels = ['whatsapp', 'sms', 'email']
+        max_in_flight = max_in_flight or Config.NOTIFICATION_MAX_IN_FLIGHT
+
+        run_stats = {channel: {"sent": 0, "failed": 0} for channel in channels}
+        started_at = time.monotonic()
+        executors = {
+            channel: ThreadPoolExecutor(max_workers=Config.NOTIFICATION_CHANNEL_WORKERS, thread_name_prefix=f"notify-{channel}")
+            for channel in channels
+        }
+
+        pending = {}
+        in_flight = {}
+        recipients_iter = enumerate(recipients)
+        exhausted = False
+
+        try:
+            while True:
+                # Mantener un número acotado de destinatarios en vuelo
+                while not exhausted and len(in_flight) < max_in_flight:
+                    try:
+                        index, (customer_data, notification_data) = next(recipients_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    targets = [channel for channel in channels if self._has_destination(channel, customer_data)]
+                    outcome = {"index": index, "customer": customer_data, "results": {}, "errors": {}}
+                    if not targets:
+                        yield outcome
+                        continue
+
+                    in_flight[index] = (outcome, len(targets))
+                    for channel in targets:
+                        future = executors[channel].submit(self._send_throttled, channel, customer_data, notification_data)
+                        pending[future] = (index, channel)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, channel = pending.pop(future)
+                    outcome, remaining = in_flight[index]
+
+                    try:
+                        result = future.result()
+                        outcome["results"][channel] = bool(result)
+                    except Exception as e:
+                        outcome["results"][channel] = False
+                        outcome["errors"][channel] = str(e)
+
+                    run_stats[channel]["sent" if outcome["results"][channel] else "failed"] += 1
+
+                    if remaining == 1:
+                        del in_flight[index]
+                        yield outcome
+                    else:
+                        in_flight[index] = (outcome, remaining - 1)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._record_bulk_run(run_stats, time.monotonic() - started_at)
+
+    def send_bulk_appointment_reminders(self, appointments: Iterable[Dict], channels: List[str] = None) -> Iterator[Dict]:
+        """Enviar recordatorios para un lote de citas (p. ej. todas las del día)"""
+        return self.send_bulk_notifications(
+            ((appointment, self._build_reminder_notification(appointment)) for appointment in appointments),
+            channels
+        )
+
+    def get_bulk_stats(self) -> Dict:
+        with self._stats_lock:
+            return {channel: dict(stats) for channel, stats in self.bulk_stats.items()}
+
+    def _has_destination(self, channel: str, customer_data: Dict) -> bool:
+        if channel == 'email':
+            return bool(customer_data.get('customer_email'))
+        return bool(customer_data.get('customer_phone'))
+
+    def _send_channel(self, channel: str, customer_data: Dict, notification_data: Dict):
         # WhatsApp
-        if 'whatsapp' in channels and customer_data.get('customer_phone'):
-            results['whatsapp'] = self.whatsapp_service.send_message(
+        if channel == 'whatsapp':
+            return self.whatsapp_service.send_message(
                 customer_data['customer_phone'], 
                 notification_data['whatsapp_message']
             )
 
         # SMS
-        if 'sms' in channels and customer_data.get('customer_phone'):
-            results['sms'] = self.sms_service.send_sms(
+        if channel == 'sms':
+            return self.sms_service.send_sms(
                 customer_data['customer_phone'], 
                 notification_data['sms_message']
             )
 
         # Email
-        if 'email' in channels and customer_data.get('customer_email'):
-            results['email'] = self.email_service.send_email(
+        if channel == 'email':
+            return self.email_service.send_email(
                 customer_data['customer_email'],
                 notification_data['email_subject'],
-                notification_data['email_message']
+                notification_data['email_message'],
+                tenant_key=customer_data.get('user_id')
             )
 
         # Voice Call
-        if 'voice' in channels and customer_data.get('customer_phone'):
-            results['voice'] = self.voice_service.make_outbound_call(
+        if channel == 'voice':
+            return self.voice_service.make_outbound_call(
                 customer_data['customer_phone'],
                 notification_data['voice_message'],
                 notification_data.get('business_context', {})
             )
 
-        return results
+        raise ValueError(f"Unknown notification channel: {channel}")
+
+    def _send_throttled(self, channel: str, customer_data: Dict, notification_data: Dict):
+        throttle = self.throttles.get(channel)
+        if throttle:
+            throttle.acquire()
+        return self._send_channel(channel, customer_data, notification_data)
+
+    def _record_bulk_run(self, run_stats: Dict, elapsed: float):
+        with self._stats_lock:
+            for channel, stats in run_stats.items():
+                total = self.bulk_stats.setdefault(channel, {"sent": 0, "failed": 0, "last_run_throughput": 0.0})
+                total["sent"] += stats["sent"]
+                total["failed"] += stats["failed"]
+                processed = stats["sent"] + stats["failed"]
+                total["last_run_throughput"] = round(processed / elapsed, 2) if elapsed > 0 else 0.0
+
+        summary = ', '.join(f"{channel}: {stats['sent']} ok/{stats['failed']} failed" for channel, stats in run_stats.items())
+        logger.info(f"Bulk notification run finished in {elapsed:.1f}s ({summary})")
+
+    def _build_reminder_notification(self, appointment_data: Dict) -> Dict:
+        customer_name = appointment_data.get('customer_name')
+        appointment_date = appointment_data.get('appointment_date')
+        appointment_time = appointment_data.get('appointment_time')
+        service = appointment_data.get('service')
+        business_name = appointment_data.get('business_name', 'Su cita')
+
+        text = f"Hola {customer_name}, le recordamos su cita para {service} el {appointment_date} a las {appointment_time}."
+
+        return {
+            "whatsapp_message": f"🔔 *Recordatorio de Cita*\n\n{text}\n\nSi necesitas reprogramar o cancelar, responde a este mensaje.",
+            "sms_message": f"Recordatorio {business_name}: {text} Para cancelar/reprogramar responda CANCELAR.",
+            "email_subject": f"Recordatorio de Cita - {business_name}",
+            "email_message": f"<p>{text}</p><p>Si necesitas cancelar o reprogramar tu cita, por favor contáctanos.</p>",
+            "voice_message": text
+        }
 
     def send_appointment_reminder_call(self, appointment_data: Dict) -> bool:
         """Enviar recordatorio de cita por llamada telefónica"""
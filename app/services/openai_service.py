@@ -1,50 +1,153 @@
 import openai
 from app.config import Config
+from app.models.training import BUSINESS_TEMPLATES
+from app.services.answer_engine import answer_engine
+from app.services.response_cache import response_cache
 import logging
-from typing import Dict, Optional, List
+import re
+import time
+from typing import Dict, Iterator, Optional, List, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Emojis y símbolos que el sintetizador de voz lee mal
+_EMOJI = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F]")
+
+
+class StreamInterrupted(Exception):
+    """El modelo cortó el stream después de enviar parte de la respuesta"""
+
 class OpenAIService:
+    ERROR_RESPONSE = "Disculpa, estoy experimentando dificultades técnicas. ¿Podrías contactar directamente con nuestro equipo?"
+
     def __init__(self):
         openai.api_key = Config.OPENAI_API_KEY
 
-    def generate_response(self, message: str, business_context: Dict = None, personality: str = "profesional y amigable") -> str:
+    def generate_response(self, message: str, business_context: Dict = None, personality: str = "profesional y amigable",
+                          assistant_id: Optional[str] = None, use_cache: bool = True,
+                          history: Optional[List[Dict]] = None) -> str:
         """Generar respuesta usando OpenAI con contexto específico del negocio"""
+        return self.generate_answer(message, business_context, personality, assistant_id, use_cache, history)[0]
+
+    def generate_answer(self, message: str, business_context: Dict = None, personality: str = "profesional y amigable",
+                        assistant_id: Optional[str] = None, use_cache: bool = True,
+                        history: Optional[List[Dict]] = None, local_answers: bool = True) -> Tuple[str, str]:
+        """Generar respuesta e indicar el nivel que la sirvió (template, knowledge, cache, llm o error)"""
+        started_at = time.monotonic()
         try:
-            # Buscar respuesta en conocimiento personalizado primero
-            custom_response = self._search_custom_knowledge(message, business_context)
-            if custom_response:
-                return custom_response
+            # Plantillas y conocimiento personalizado se resuelven sin llamar al modelo
+            if local_answers:
+                local_response, tier, _ = answer_engine.lookup(message, business_context, assistant_id)
+                if local_response is not None:
+                    return local_response, tier
 
             # Construir prompt basado en el contexto del negocio
             system_prompt = self._build_system_prompt(business_context, personality)
 
+            # Con historial la respuesta depende de la conversación: no se cachea
+            use_cache = use_cache and Config.RESPONSE_CACHE_ENABLED and not history
+            if use_cache:
+                cached_response = response_cache.get('chat', assistant_id, message, personality, system_prompt)
+                if cached_response is not None:
+                    answer_engine.record('cache', started_at)
+                    return cached_response, 'cache'
+
             response = openai.ChatCompletion.create(
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
+                messages=[{"role": "system", "content": system_prompt}] + (history or []) + [
                     {"role": "user", "content": message}
                 ],
                 max_tokens=500,
                 temperature=0.7
             )
 
-            return response.choices[0].message.content.strip()
+            response_text = response.choices[0].message.content.strip()
+            if use_cache:
+                response_cache.set('chat', assistant_id, message, personality, system_prompt, response_text)
+
+            answer_engine.record('llm', started_at)
+            return response_text, 'llm'
 
         except Exception as e:
             logger.error(f"OpenAI error: {e}")
-            return "Disculpa, estoy experimentando dificultades técnicas. ¿Podrías contactar directamente con nuestro equipo?"
+            return self.ERROR_RESPONSE, 'error'
 
-    def generate_voice_response(self, speech_text: str, business_context: Dict = None) -> str:
-        """Generar respuesta optimizada para llamadas telefónicas"""
+    def generate_response_stream(self, message: str, business_context: Dict = None,
+                                 personality: str = "profesional y amigable",
+                                 assistant_id: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+        """Generar la respuesta por fragmentos (fragmento, nivel) a medida que llegan del modelo"""
+        started_at = time.monotonic()
         try:
-            system_prompt = self._build_voice_system_prompt(business_context)
+            local_response, tier, _ = answer_engine.lookup(message, business_context, assistant_id)
+            if local_response is not None:
+                yield local_response, tier
+                return
+
+            system_prompt = self._build_system_prompt(business_context, personality)
+
+            if Config.RESPONSE_CACHE_ENABLED:
+                cached_response = response_cache.get('chat', assistant_id, message, personality, system_prompt)
+                if cached_response is not None:
+                    answer_engine.record('cache', started_at)
+                    yield cached_response, 'cache'
+                    return
 
             response = openai.ChatCompletion.create(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": message}
+                ],
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            )
+        except Exception as e:
+            logger.error(f"OpenAI stream error: {e}")
+            yield self.ERROR_RESPONSE, 'error'
+            return
+
+        chunks = []
+        try:
+            for chunk in response:
+                content = chunk.choices[0].delta.get('content')
+                if content:
+                    chunks.append(content)
+                    yield content, 'llm'
+        except Exception as e:
+            logger.error(f"OpenAI stream interrupted: {e}")
+            if not chunks:
+                yield self.ERROR_RESPONSE, 'error'
+                return
+            raise StreamInterrupted(str(e)) from e
+
+        answer_engine.record('llm', started_at)
+        # Solo se cachean respuestas completas
+        response_text = ''.join(chunks).strip()
+        if Config.RESPONSE_CACHE_ENABLED and response_text:
+            response_cache.set('chat', assistant_id, message, personality, system_prompt, response_text)
+
+    def generate_voice_response(self, speech_text: str, business_context: Dict = None,
+                                assistant_id: Optional[str] = None, history: Optional[List[Dict]] = None) -> str:
+        """Generar respuesta optimizada para llamadas telefónicas"""
+        started_at = time.monotonic()
+        try:
+            local_response, _, _ = answer_engine.lookup(speech_text, business_context, assistant_id)
+            if local_response is not None:
+                return self._optimize_for_voice(local_response)
+
+            system_prompt = self._build_voice_system_prompt(business_context)
+            use_cache = Config.RESPONSE_CACHE_ENABLED and not history
+
+            if use_cache:
+                cached_response = response_cache.get('voice', assistant_id, speech_text, '', system_prompt)
+                if cached_response is not None:
+                    answer_engine.record('cache', started_at)
+                    return cached_response
+
+            response = openai.ChatCompletion.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "system", "content": system_prompt}] + (history or []) + [
                     {"role": "user", "content": speech_text}
                 ],
                 max_tokens=200,  # Respuestas más cortas para voz
@@ -52,13 +155,40 @@ class OpenAIService:
             )
 
             # Limpiar respuesta para que sea más natural en voz
-            voice_response = response.choices[0].message.content.strip()
-            return self._optimize_for_voice(voice_response)
+            voice_response = self._optimize_for_voice(response.choices[0].message.content.strip())
+            if use_cache:
+                response_cache.set('voice', assistant_id, speech_text, '', system_prompt, voice_response)
+
+            answer_engine.record('llm', started_at)
+            return voice_response
 
         except Exception as e:
             logger.error(f"OpenAI voice API error: {e}")
             return "Lo siento, estoy experimentando dificultades técnicas en este momento."
 
+    def summarize_conversation(self, previous_summary: str, messages: List[Dict], max_tokens: int = 200) -> str:
+        """Condensar el resumen previo y los mensajes antiguos en un resumen breve"""
+        transcript = "\n".join(
+            f"{'Cliente' if message['role'] == 'user' else 'Asistente'}: {message['content']}" for message in messages
+        )
+        prompt = f"""Resumen previo: {previous_summary or 'ninguno'}
+
+Mensajes nuevos:
+{transcript}
+
+Escribe un resumen breve y actualizado de la conversación: datos del cliente, lo que ha pedido y lo acordado."""
+
+        response = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "Resumes conversaciones de atención al cliente de forma concisa y en español."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.3
+        )
+        return response.choices[0].message.content.strip()
+
     def _build_system_prompt(self, business_context: Dict = None, personality: str = "profesional y amigable") -> str:
         """Construir prompt del sistema basado en el contexto del negocio"""
 
@@ -133,53 +263,7 @@ Responde como el asistente telefónico oficial de {business_name}."""
 
     def get_business_template_response(self, business_type: str, query_type: str) -> str:
         """Obtener respuestas predefinidas por tipo de negocio"""
-
-        templates = {
-            "clinic": {
-                "appointment": "Para agendar una cita médica, necesito algunos datos: ¿Para qué especialidad necesitas la cita? ¿Tienes alguna preferencia de fecha y horario? 📅",
-                "services": "Ofrecemos servicios de medicina general y especialidades médicas. ¿Te interesa alguna especialidad en particular? 🏥",
-                "pricing": "Los costos varían según el tipo de consulta y especialidad. ¿Podrías decirme qué tipo de consulta necesitas para darte información más específica? 💰"
-            },
-            "management": {
-                "appointment": "Para programar una consulta, ¿sobre qué tipo de trámite o gestión necesitas asesoría? ¿Tienes disponibilidad esta semana? 📋",
-                "services": "Gestionamos trámites fiscales, laborales y administrativos. ¿En qué área específica necesitas ayuda? 📊",
-                "pricing": "Nuestros honorarios varían según la complejidad del trámite. ¿Podrías contarme más sobre lo que necesitas gestionar? 💼"
-            },
-            "property_admin": {
-                "appointment": "¿Necesitas una visita para ver una propiedad o es para gestiones administrativas? ¿Qué día te viene mejor? 🏢",
-                "services": "Administramos propiedades, gestionamos inquilinos y mantenimiento. ¿Con qué tema específico necesitas ayuda? 🏠",
-                "pricing": "Las tarifas dependen del tipo de propiedad y servicios. ¿Podrías contarme más sobre tu propiedad? 🏘️"
-            },
-            "ecommerce": {
-                "product_info": "¿Qué producto te interesa? Puedo ayudarte con información detallada, disponibilidad y precios 🛍️",
-                "shipping": "Tenemos diferentes opciones de envío. ¿A qué ciudad necesitas el envío para darte los costos exactos? 📦",
-                "support": "¿Con qué puedo ayudarte hoy? ¿Es sobre un pedido existente o estás buscando un producto específico? 🛒"
-            }
-        }
-
-        return templates.get(business_type, {}).get(query_type, "¿En qué puedo ayudarte hoy? 😊")
-
-    def _search_custom_knowledge(self, message: str, business_context: Dict = None) -> Optional[str]:
-        """Buscar respuesta en el conocimiento personalizado del negocio"""
-        if not business_context or 'custom_knowledge' not in business_context:
-            return None
-
-        custom_knowledge = business_context['custom_knowledge']
-        message_lower = message.lower()
-
-        best_match = None
-        highest_score = 0
-
-        for category, qa_pairs in custom_knowledge.items():
-            for qa in qa_pairs:
-                # Calcular similitud basada en palabras clave y contenido
-                score = self._calculate_similarity(message_lower, qa)
-
-                if score > highest_score and score > 0.6:  # Umbral de similitud
-                    highest_score = score
-                    best_match = qa['answer']
-
-        return best_match
+        return BUSINESS_TEMPLATES.get(business_type, {}).get(query_type, "¿En qué puedo ayudarte hoy? 😊")
 
     def _calculate_similarity(self, message: str, qa_pair: Dict) -> float:
         """Calcular similitud entre mensaje y par pregunta-respuesta"""
@@ -224,6 +308,7 @@ Responde como el asistente telefónico oficial de {business_name}."""
 
         # Limpiar caracteres que no suenan bien en voz
         text = text.replace('*', '').replace('#', '').replace('_', '')
+        text = _EMOJI.sub('', text).strip()
 
         return text
 
@@ -0,0 +1,359 @@
+import fcntl
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+REMINDER_FIELDS = "id,user_id,customer_name,customer_phone,customer_email,appointment_date,appointment_time,service,status,updated_at"
+ACTIVE_STATUSES = ('scheduled', 'confirmed')
+
+
+class ReminderScheduler:
+    """Programador de recordatorios de citas con cola de prioridad por hora de envío
+
+    Cada worker puede arrancarlo: solo el que obtiene el bloqueo del fichero del cursor
+    programa y envía; los demás esperan para relevarlo si ese proceso termina.
+    """
+
+    def __init__(self, notification_service=None, offsets_minutes: List[int] = None, tick_seconds: int = 30,
+                 horizon_days: int = 7, grace_minutes: int = 30, page_size: int = 1000,
+                 cursor_path: str = 'data/reminder_cursor.json'):
+        self.notification_service = notification_service
+        self.offsets = sorted(offsets_minutes or [1440, 120], reverse=True)
+        self.tick_seconds = tick_seconds
+        self.horizon_days = horizon_days
+        self.grace = timedelta(minutes=grace_minutes)
+        self.page_size = page_size
+        self.cursor_path = cursor_path
+
+        self._heap: List[Tuple[float, int, str, int, Tuple]] = []
+        self._sequence = itertools.count()
+        self._signatures: Dict[str, Tuple] = {}
+        self._appointments: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+        # Cursor persistente: última fila vista y último recordatorio enviado
+        self.updated_after: Optional[str] = None
+        self.updated_after_id: Optional[str] = None
+        self.fired_until: float = 0.0
+        self._recovered_until: float = 0.0
+        self.loaded_until: Optional[date] = None
+
+        self.sent = 0
+        self.failed = 0
+        self.skipped_late = 0
+        self.skipped_stale = 0
+        self.rows_scanned = 0
+
+    def start(self):
+        """Arrancar el hilo del programador (espera a ser el único proceso activo)"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        if self.notification_service is None:
+            from app.services.notification_service import NotificationService
+            self.notification_service = NotificationService()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.tick_seconds)
+        self._release_leadership()
+
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+
+    def _run(self):
+        # Con varios workers (gunicorn) solo uno envía; el resto reintenta el bloqueo en cada tick
+        while not self._stop.is_set() and not self._acquire_leadership():
+            self._stop.wait(self.tick_seconds)
+        if self._stop.is_set():
+            return
+
+        self._load_cursor()
+        logger.info(f"Reminder scheduler started in process {os.getpid()} (offsets: {self.offsets} min)")
+
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Reminder scheduler tick error: {e}")
+            self._stop.wait(self.tick_seconds)
+
+    def _acquire_leadership(self) -> bool:
+        """Bloqueo exclusivo no bloqueante junto al cursor; el sistema lo libera si el proceso muere"""
+        lock_path = f"{self.cursor_path}.lock"
+        try:
+            directory = os.path.dirname(lock_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lock_file = open(lock_path, 'a')
+        except OSError as e:
+            logger.error(f"Error opening reminder scheduler lock: {e}")
+            return False
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        return True
+
+    def _release_leadership(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def tick(self, now: Optional[datetime] = None):
+        """Extender el horizonte, leer cambios incrementales y enviar recordatorios vencidos"""
+        now = now or datetime.now()
+        self._extend_horizon(now.date())
+        self._scan_changes()
+        self._fire_due(now)
+        self._evict_past(now)
+
+    def index_appointment(self, row: Dict):
+        """Indexar (o reindexar) una cita; las canceladas dejan de tener recordatorios"""
+        appointment_id = str(row['id'])
+        # Un cambio de estado (p. ej. scheduled -> confirmed) no reprograma los avisos
+        signature = (row.get('appointment_date'), row.get('appointment_time'))
+
+        with self._lock:
+            if row.get('status') not in ACTIVE_STATUSES:
+                # Las entradas del heap se descartan de forma perezosa al vencer
+                self._signatures.pop(appointment_id, None)
+                self._appointments.pop(appointment_id, None)
+                return
+
+            appointment_at = self._appointment_datetime(row)
+            horizon_end = datetime.combine(date.today() + timedelta(days=self.horizon_days + 1), datetime.min.time())
+            if appointment_at is None or appointment_at < datetime.now() - self.grace or appointment_at >= horizon_end:
+                # Pasada o fuera del horizonte (se cargará al entrar en él): no se guarda
+                self._signatures.pop(appointment_id, None)
+                self._appointments.pop(appointment_id, None)
+                return
+
+            self._appointments[appointment_id] = row
+            if self._signatures.get(appointment_id) == signature:
+                return
+
+            self._signatures[appointment_id] = signature
+            min_fire_at = (datetime.now() - self.grace).timestamp()
+            for offset in self.offsets:
+                fire_at = (appointment_at - timedelta(minutes=offset)).timestamp()
+                if fire_at > self._recovered_until and fire_at >= min_fire_at:
+                    heapq.heappush(self._heap, (fire_at, next(self._sequence), appointment_id, offset, signature))
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            next_fire_at = self._heap[0][0] if self._heap else None
+            return {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "leader": self.is_leader(),
+                "indexed_appointments": len(self._signatures),
+                "pending_reminders": len(self._heap),
+                "next_reminder_at": datetime.fromtimestamp(next_fire_at).isoformat() if next_fire_at else None,
+                "sent": self.sent,
+                "failed": self.failed,
+                "skipped_late": self.skipped_late,
+                "skipped_stale": self.skipped_stale,
+                "rows_scanned": self.rows_scanned,
+                "cursor": self.updated_after
+            }
+
+    def _extend_horizon(self, today: date):
+        """Cargar por rangos de fecha las citas que entran en el horizonte"""
+        horizon_end = today + timedelta(days=self.horizon_days)
+        start = today if self.loaded_until is None or self.loaded_until < today else self.loaded_until + timedelta(days=1)
+        # Los cambios posteriores a esta lectura llegan por el cursor; sin cursor se empieza aquí
+        loaded_at = datetime.utcnow().isoformat() + '+00:00'
+        if start > horizon_end:
+            self._seed_cursor(loaded_at)
+            return
+
+        offset = 0
+        while True:
+            result = db.get_client().table("appointments").select(REMINDER_FIELDS) \
+                .gte("appointment_date", start.isoformat()) \
+                .lte("appointment_date", horizon_end.isoformat()) \
+                .in_("status", list(ACTIVE_STATUSES)) \
+                .order("id") \
+                .range(offset, offset + self.page_size - 1) \
+                .execute()
+
+            rows = result.data or []
+            for row in rows:
+                self.index_appointment(row)
+            self.rows_scanned += len(rows)
+
+            if len(rows) < self.page_size:
+                break
+            offset += self.page_size
+
+        self.loaded_until = horizon_end
+        self._seed_cursor(loaded_at)
+        self._save_cursor()
+
+    def _seed_cursor(self, loaded_at: str):
+        """Primer arranque: no se lee el histórico, solo lo que cambie desde la carga del horizonte"""
+        if self.updated_after is None:
+            self.updated_after = loaded_at
+            self.updated_after_id = '00000000-0000-0000-0000-000000000000'
+
+    def _scan_changes(self):
+        """Leer solo las filas modificadas desde el cursor (keyset sobre updated_at, id)"""
+        if self.updated_after is None:
+            # Sin horizonte cargado no hay cursor: nunca se recorre la tabla entera
+            return
+        while True:
+            query = db.get_client().table("appointments").select(REMINDER_FIELDS).or_(
+                f"updated_at.gt.{self.updated_after},"
+                f"and(updated_at.eq.{self.updated_after},id.gt.{self.updated_after_id})"
+            )
+            result = query.order("updated_at").order("id").limit(self.page_size).execute()
+
+            rows = result.data or []
+            for row in rows:
+                self.index_appointment(row)
+            self.rows_scanned += len(rows)
+
+            if rows:
+                self.updated_after = rows[-1]['updated_at']
+                self.updated_after_id = str(rows[-1]['id'])
+                self._save_cursor()
+
+            if len(rows) < self.page_size:
+                break
+
+    def _fire_due(self, now: datetime):
+        now_ts = now.timestamp()
+
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now_ts:
+                    return
+                fire_at, _, appointment_id, offset, signature = heapq.heappop(self._heap)
+                if self._signatures.get(appointment_id) != signature:
+                    continue
+                row = self._appointments.get(appointment_id)
+
+            if fire_at < now_ts - self.grace.total_seconds():
+                self.skipped_late += 1
+            else:
+                row = self._current(appointment_id, signature)
+                if row is not None:
+                    self._send(row, offset)
+
+            self.fired_until = max(self.fired_until, fire_at)
+            self._save_cursor()
+
+    def _evict_past(self, now: datetime):
+        """Olvidar las citas cuya hora ya pasó (sus avisos ya vencieron)"""
+        cutoff = now - self.grace
+        with self._lock:
+            past = [
+                appointment_id for appointment_id, row in self._appointments.items()
+                if (self._appointment_datetime(row) or cutoff) <= cutoff
+            ]
+            for appointment_id in past:
+                self._signatures.pop(appointment_id, None)
+                self._appointments.pop(appointment_id, None)
+
+    def _current(self, appointment_id: str, signature: Tuple) -> Optional[Dict]:
+        """Releer la cita antes de enviar: el cursor de updated_at no ve los borrados"""
+        try:
+            result = db.get_client().table("appointments").select(REMINDER_FIELDS).eq("id", appointment_id).execute()
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error reloading appointment {appointment_id} before reminder: {e}")
+            return None
+
+        row = result.data[0] if result.data else None
+        if row is None or row.get('status') not in ACTIVE_STATUSES \
+                or (row.get('appointment_date'), row.get('appointment_time')) != signature:
+            # Borrada, cancelada o movida: se olvida (si se movió, el escaneo la reprograma)
+            with self._lock:
+                if self._signatures.get(appointment_id) == signature:
+                    self._signatures.pop(appointment_id, None)
+                    self._appointments.pop(appointment_id, None)
+            self.skipped_stale += 1
+            return None
+        return row
+
+    def _send(self, row: Dict, offset: int):
+        try:
+            if self.notification_service.send_appointment_reminder(row):
+                self.sent += 1
+                logger.info(f"Reminder sent for appointment {row['id']} ({offset} min before)")
+            else:
+                self.failed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error sending reminder for appointment {row.get('id')}: {e}")
+
+    @staticmethod
+    def _appointment_datetime(row: Dict) -> Optional[datetime]:
+        try:
+            return datetime.fromisoformat(f"{row['appointment_date']}T{row['appointment_time']}")
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"Invalid appointment date/time for {row.get('id')}")
+            return None
+
+    def _load_cursor(self):
+        if not os.path.exists(self.cursor_path):
+            return
+        try:
+            with open(self.cursor_path) as f:
+                state = json.load(f)
+            self.updated_after = state.get('updated_after')
+            self.updated_after_id = state.get('updated_after_id')
+            self.fired_until = state.get('fired_until', 0.0)
+            # Lo enviado antes del reinicio no se vuelve a programar
+            self._recovered_until = self.fired_until
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading reminder cursor: {e}")
+
+    def _save_cursor(self):
+        state = {
+            "updated_after": self.updated_after,
+            "updated_after_id": self.updated_after_id,
+            "fired_until": self.fired_until
+        }
+        try:
+            directory = os.path.dirname(self.cursor_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.cursor_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.cursor_path)
+        except OSError as e:
+            logger.error(f"Error saving reminder cursor: {e}")
+
+
+# Global scheduler instance
+reminder_scheduler = ReminderScheduler(
+    offsets_minutes=[int(offset) for offset in Config.REMINDER_OFFSETS_MINUTES.split(',') if offset.strip()],
+    tick_seconds=Config.REMINDER_TICK_SECONDS,
+    horizon_days=Config.REMINDER_HORIZON_DAYS,
+    cursor_path=Config.REMINDER_CURSOR_PATH
+)
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_message(text: str) -> str:
+    """Normalizar mensaje: minúsculas, sin acentos, sin signos y espacios colapsados"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = _PUNCTUATION.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def message_shingles(normalized: str, size: int = 2) -> FrozenSet[Tuple[str, ...]]:
+    """Obtener los shingles de palabras de un mensaje normalizado"""
+    tokens = normalized.split()
+    if len(tokens) < size:
+        return frozenset([tuple(tokens)]) if tokens else frozenset()
+    return frozenset(tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+
+class ResponseCache:
+    """Caché LRU con TTL para respuestas del LLM, con modo opcional de casi-duplicados"""
+
+    def __init__(self, max_entries: int = 5000, ttl: int = 3600, near_duplicates: bool = False,
+                 similarity_threshold: float = 0.8, shingle_size: int = 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+        self.shingle_size = shingle_size
+
+        self._entries: "OrderedDict[Tuple, Tuple[str, float]]" = OrderedDict()
+        self._assistant_keys: Dict[str, Set[Tuple]] = {}
+        # scope -> shingle -> claves, para encontrar candidatos casi-duplicados sin recorrer todo
+        self._shingle_postings: Dict[Tuple, Dict[Tuple[str, ...], Set[Tuple]]] = {}
+        self._shingles: Dict[Tuple, FrozenSet[Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _scope(namespace: str, assistant_id: Optional[str], personality: str, prompt: str) -> Tuple:
+        prompt_hash = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        return (namespace, assistant_id or '', personality or '', prompt_hash)
+
+    def get(self, namespace: str, assistant_id: Optional[str], message: str, personality: str, prompt: str) -> Optional[str]:
+        """Buscar una respuesta cacheada para el mensaje"""
+        scope = self._scope(namespace, assistant_id, personality, prompt)
+        normalized = normalize_message(message)
+        key = scope + (normalized,)
+        now = time.time()
+
+        with self._lock:
+            response = self._lookup(key, now)
+            if response is not None:
+                self.hits += 1
+                return response
+
+            if self.near_duplicates:
+                response = self._lookup_near_duplicate(scope, normalized, now)
+                if response is not None:
+                    self.near_hits += 1
+                    return response
+
+            self.misses += 1
+            return None
+
+    def set(self, namespace: str, assistant_id: Optional[str], message: str, personality: str, prompt: str, response: str):
+        """Guardar la respuesta generada para el mensaje"""
+        scope = self._scope(namespace, assistant_id, personality, prompt)
+        normalized = normalize_message(message)
+        key = scope + (normalized,)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (response, time.time() + self.ttl)
+            self._assistant_keys.setdefault(scope[1], set()).add(key)
+
+            if self.near_duplicates:
+                shingles = message_shingles(normalized, self.shingle_size)
+                self._shingles[key] = shingles
+                postings = self._shingle_postings.setdefault(scope, {})
+                for shingle in shingles:
+                    postings.setdefault(shingle, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, assistant_id: str):
+        """Eliminar todas las respuestas de un asistente (p. ej. al cambiar su contexto)"""
+        with self._lock:
+            for key in list(self._assistant_keys.get(assistant_id, ())):
+                self._remove(key)
+            self._assistant_keys.pop(assistant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._assistant_keys.clear()
+            self._shingle_postings.clear()
+            self._shingles.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "near_duplicates": self.near_duplicates
+            }
+
+    def _lookup(self, key: Tuple, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        response, expires_at = entry
+        if expires_at <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return response
+
+    def _lookup_near_duplicate(self, scope: Tuple, normalized: str, now: float) -> Optional[str]:
+        shingles = message_shingles(normalized, self.shingle_size)
+        postings = self._shingle_postings.get(scope)
+        if not shingles or not postings:
+            return None
+
+        overlaps: Dict[Tuple, int] = {}
+        for shingle in shingles:
+            for candidate in postings.get(shingle, ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+
+        best_key = None
+        best_similarity = 0.0
+        for candidate, overlap in overlaps.items():
+            union = len(shingles) + len(self._shingles[candidate]) - overlap
+            similarity = overlap / union if union else 0.0
+            if similarity > best_similarity:
+                best_similarity = similarity
+                best_key = candidate
+
+        if best_key is None or best_similarity < self.similarity_threshold:
+            return None
+
+        return self._lookup(best_key, now)
+
+    def _remove(self, key: Tuple):
+        self._entries.pop(key, None)
+
+        assistant_keys = self._assistant_keys.get(key[1])
+        if assistant_keys is not None:
+            assistant_keys.discard(key)
+
+        shingles = self._shingles.pop(key, None)
+        if shingles:
+            scope = key[:4]
+            postings = self._shingle_postings.get(scope, {})
+            for shingle in shingles:
+                keys = postings.get(shingle)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del postings[shingle]
+            if not postings:
+                self._shingle_postings.pop(scope, None)
+
+
+# Global cache instance
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    near_duplicates=Config.RESPONSE_CACHE_NEAR_DUPLICATES,
+    similarity_threshold=Config.RESPONSE_CACHE_SIMILARITY
+)
@@ -0,0 +1,422 @@
+import fcntl
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.services.knowledge_index import knowledge_signature
+from app.services.response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset(
+    "a al algo como con de del el en es esta este hay la las lo los me mi mis o para por que se su sus "
+    "te tengo tu tus un una uno y yo".split()
+)
+
+
+class HashedTfidfEmbedder:
+    """Embeddings locales sin modelo: palabras y trigramas de caracteres con hashing
+
+    El IDF se aplica en la consulta (ver TenantSemanticIndex.search), de modo que los
+    vectores guardados no cambian al añadir o borrar filas.
+    """
+
+    name = 'hashed-tfidf'
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def features(self, text: str) -> Dict[str, int]:
+        terms: Dict[str, int] = {}
+        for token in normalize_message(text).split():
+            if token in STOPWORDS:
+                continue
+            terms[token] = terms.get(token, 0) + 1
+            # Trigramas con marcas de inicio y fin: toleran plurales y variantes flexivas
+            padded = f"<{token}>"
+            for i in range(len(padded) - 2):
+                gram = '#' + padded[i:i + 3]
+                terms[gram] = terms.get(gram, 0) + 1
+        return terms
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, count in self.features(text).items():
+                # crc32 es estable entre procesos (hash() no lo es)
+                digest = zlib.crc32(term.encode('utf-8'))
+                sign = 1.0 if (digest // self.dim) & 1 else -1.0
+                matrix[row, digest % self.dim] += sign * (1.0 + math.log(count))
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+def load_embedder(spec: str, dim: int):
+    """'hashed' o 'paquete.modulo:Clase' (la clase recibe dim y expone embed(textos) -> matriz float32)"""
+    if not spec or spec == 'hashed':
+        return HashedTfidfEmbedder(dim)
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)(dim)
+
+
+def qa_key(qa: Dict) -> str:
+    return hashlib.sha1(f"{qa.get('question', '')}\0{qa.get('answer', '')}".encode('utf-8')).hexdigest()[:16]
+
+
+class TenantSemanticIndex:
+    """Matriz float32 contigua (memmap) con los pares pregunta-respuesta de un asistente
+
+    Las altas se escriben al final (la capacidad crece al doble) y las bajas dejan la
+    fila a cero; se compacta cuando los huecos superan un cuarto de las filas. Los
+    procesos que solo leen comparten las páginas del fichero y se remapean cuando
+    cambia meta.json, que guarda también el hash y la versión del conocimiento indexado.
+    """
+
+    def __init__(self, path: str, embedder, initial_capacity: int = 64):
+        self.path = path
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self.initial_capacity = initial_capacity
+
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._entries: List[Optional[Dict]] = []
+        self._rows: Dict[str, int] = {}
+        self._doc_freq = np.zeros(self.dim, dtype=np.float32)
+        self._capacity = 0
+        self._meta_mtime = None
+        self._checked_at = 0.0
+        self.signature: Optional[str] = None
+        self.version: Optional[float] = None
+
+        os.makedirs(path, exist_ok=True)
+        self._reload()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, 'vectors.f32')
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, 'meta.json')
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def keys(self) -> set:
+        self._refresh()
+        with self._lock:
+            return set(self._rows)
+
+    def sync(self, qa_pairs: List[Dict], signature: Optional[str] = None,
+             version: Optional[float] = None) -> Tuple[int, int]:
+        """Dejar el índice igual que la lista de pares: solo se embeben los nuevos"""
+        wanted = {qa_key(qa): qa for qa in qa_pairs if qa.get('question') and qa.get('answer')}
+        with self._write_lock():
+            with self._lock:
+                if signature is not None and signature == self.signature:
+                    return 0, 0
+                if self.version is not None and (version is None or version < self.version):
+                    # Un worker con una copia antigua de custom_knowledge no deshace lo ya indexado
+                    logger.info(f"Semantic index at {self.path} is newer than the knowledge given, skipping sync")
+                    return 0, 0
+                current = set(self._rows)
+                added = [wanted[key] for key in wanted.keys() - current]
+                removed = current - wanted.keys()
+                self._delete(removed)
+                self._add(added)
+                changed = added or removed or signature != self.signature or version != self.version
+                self.signature = signature
+                self.version = version
+            if changed:
+                self._save()
+        return len(added), len(removed)
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[str, float, str]]:
+        """Top-k (respuesta, similitud, pregunta) con un único producto matriz-vector"""
+        self._refresh()
+        with self._lock:
+            count = len(self._entries)
+            if not self._rows or self._matrix is None:
+                return []
+
+            # IDF en la consulta: pesa más lo poco frecuente entre las preguntas del asistente
+            idf = np.log((1.0 + len(self._rows)) / (1.0 + self._doc_freq)) + 1.0
+            query = self.embedder.embed([text])[0] * idf
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+            scores = self._matrix[:count] @ (query / norm)
+
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            return [
+                (self._entries[row]['answer'], float(scores[row]), self._entries[row]['question'])
+                for row in top[np.argsort(-scores[top])]
+                if self._entries[row] is not None
+            ]
+
+    def _add(self, qa_pairs: List[Dict]):
+        if not qa_pairs:
+            return
+        vectors = self.embedder.embed([qa['question'] for qa in qa_pairs]).astype(np.float32)
+        start = len(self._entries)
+        self._ensure_capacity(start + len(qa_pairs))
+
+        writable = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(self._capacity, self.dim))
+        writable[start:start + len(qa_pairs)] = vectors
+        writable.flush()
+        del writable
+
+        for offset, qa in enumerate(qa_pairs):
+            key = qa_key(qa)
+            self._entries.append({'key': key, 'question': qa['question'], 'answer': qa['answer']})
+            self._rows[key] = start + offset
+        self._doc_freq += (vectors != 0).sum(axis=0)
+        self._remap()
+
+    def _delete(self, keys):
+        rows = [self._rows.pop(key) for key in keys if key in self._rows]
+        if not rows:
+            return
+
+        writable = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(self._capacity, self.dim))
+        self._doc_freq -= (writable[rows] != 0).sum(axis=0)
+        writable[rows] = 0.0
+        writable.flush()
+        del writable
+        for row in rows:
+            self._entries[row] = None
+
+        holes = len(self._entries) - len(self._rows)
+        if holes > max(16, len(self._entries) // 4):
+            self._compact()
+
+    def _compact(self):
+        """Reescribir solo las filas vivas (tras muchas bajas)"""
+        live = [row for row, entry in enumerate(self._entries) if entry is not None]
+        source = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._capacity, self.dim))
+        vectors = np.array(source[live]) if live else np.zeros((0, self.dim), dtype=np.float32)
+        del source
+
+        self._capacity = max(self.initial_capacity, len(live) * 2)
+        self._write_vectors(vectors)
+        self._entries = [self._entries[row] for row in live]
+        self._rows = {entry['key']: row for row, entry in enumerate(self._entries)}
+        self._remap()
+        logger.info(f"Semantic index compacted at {self.path}: {len(live)} rows")
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity and os.path.exists(self._vectors_path):
+            return
+        capacity = max(self.initial_capacity, self._capacity)
+        while capacity < rows:
+            capacity *= 2
+        # Crecer el fichero sin copiar: las filas nuevas quedan a cero
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._capacity = capacity
+
+    def _write_vectors(self, vectors: np.ndarray):
+        tmp_path = f"{self._vectors_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.truncate(self._capacity * self.dim * 4)
+        writable = np.memmap(tmp_path, dtype=np.float32, mode='r+', shape=(self._capacity, self.dim))
+        writable[:len(vectors)] = vectors
+        writable.flush()
+        del writable
+        os.replace(tmp_path, self._vectors_path)
+
+    def _remap(self):
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._capacity, self.dim))
+
+    def _save(self):
+        meta = {
+            "dim": self.dim,
+            "embedder": getattr(self.embedder, 'name', type(self.embedder).__name__),
+            "capacity": self._capacity,
+            "signature": self.signature,
+            "version": self.version,
+            "entries": self._entries
+        }
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path)
+        self._reload()
+
+    def _refresh(self):
+        # Otro proceso puede haber escrito el índice: se comprueba como mucho una vez por segundo
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._meta_mtime:
+            self._reload()
+
+    def _reload(self):
+        with self._lock:
+            try:
+                with open(self._meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                mtime = os.stat(self._meta_path).st_mtime_ns
+            except (OSError, ValueError):
+                return
+
+            if meta.get('dim') != self.dim or meta.get('embedder') != getattr(self.embedder, 'name', type(self.embedder).__name__):
+                # Otro embedder u otra dimensión: los vectores no son comparables, se reconstruye
+                logger.warning(f"Semantic index at {self.path} built with another embedder, rebuilding")
+                self._entries, self._rows, self._capacity, self._matrix = [], {}, 0, None
+                self.signature = self.version = None
+                self._doc_freq = np.zeros(self.dim, dtype=np.float32)
+                for path in (self._vectors_path, self._meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+
+            self._capacity = meta['capacity']
+            self._entries = meta['entries']
+            self.signature = meta.get('signature')
+            self.version = meta.get('version')
+            self._rows = {entry['key']: row for row, entry in enumerate(self._entries) if entry is not None}
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._capacity, self.dim)) \
+                if self._capacity else None
+            self._doc_freq = (self._matrix[:len(self._entries)] != 0).sum(axis=0).astype(np.float32) \
+                if self._matrix is not None else np.zeros(self.dim, dtype=np.float32)
+            self._meta_mtime = mtime
+
+    def _write_lock(self):
+        return _FileLock(os.path.join(self.path, 'lock'), self)
+
+
+class _FileLock:
+    """Un solo escritor entre procesos; al entrar se relee lo que hayan escrito otros"""
+
+    def __init__(self, path: str, index: TenantSemanticIndex):
+        self.path = path
+        self.index = index
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        self.index._reload()
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+class SemanticIndexRegistry:
+    """Índices semánticos por asistente, sincronizados con su custom_knowledge"""
+
+    def __init__(self, base_path: str = 'data/semantic', embedder=None, max_tenants: int = 1000):
+        self.base_path = base_path
+        self.embedder = embedder or HashedTfidfEmbedder()
+        self.max_tenants = max_tenants
+        self._indexes: "OrderedDict[str, Tuple[object, TenantSemanticIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.syncs = 0
+        self.embedded = 0
+        self.deleted = 0
+        self.searches = 0
+
+    def search(self, assistant_id: str, custom_knowledge: Dict, text: str, k: int = 3,
+               version: Optional[float] = None) -> List[Tuple[str, float, str]]:
+        index = self.get_index(assistant_id, custom_knowledge, version)
+        with self._lock:
+            self.searches += 1
+        return index.search(text, k)
+
+    def get_index(self, assistant_id: str, custom_knowledge: Dict,
+                  version: Optional[float] = None) -> TenantSemanticIndex:
+        """Índice del asistente; se sincroniza (altas y bajas incrementales) si cambió custom_knowledge
+
+        version es el knowledge_version de business_context: identifica la entrada en caché
+        (el hash del conocimiento solo se calcula si falta) y nunca se sincroniza desde un
+        conocimiento más antiguo que el que ya está en disco.
+        """
+        assistant_id = str(assistant_id)
+        fingerprint = ('version', version) if version is not None else knowledge_signature(custom_knowledge)
+        with self._lock:
+            entry = self._indexes.get(assistant_id)
+            if entry is not None and entry[0] == fingerprint:
+                self._indexes.move_to_end(assistant_id)
+                return entry[1]
+
+        index = entry[1] if entry is not None else TenantSemanticIndex(
+            os.path.join(self.base_path, _safe_name(assistant_id)), self.embedder
+        )
+        signature = fingerprint if version is None else knowledge_signature(custom_knowledge)
+        added, removed = index.sync([qa for qa_pairs in custom_knowledge.values() for qa in qa_pairs],
+                                    signature, version)
+
+        with self._lock:
+            self.syncs += 1
+            self.embedded += added
+            self.deleted += removed
+            # Se guarda lo que quedó en disco: si la sincronización se saltó (el disco era
+            # más nuevo) la próxima búsqueda con este conocimiento vuelve a intentarlo
+            cached = ('version', index.version) if version is not None else index.signature
+            self._indexes[assistant_id] = (cached, index)
+            self._indexes.move_to_end(assistant_id)
+            while len(self._indexes) > self.max_tenants:
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, assistant_id: str):
+        """Forzar la sincronización en la próxima búsqueda"""
+        with self._lock:
+            entry = self._indexes.get(str(assistant_id))
+            if entry is not None:
+                self._indexes[str(assistant_id)] = (None, entry[1])
+
+    def delete(self, assistant_id: str):
+        """Borrar el índice de un asistente eliminado"""
+        with self._lock:
+            self._indexes.pop(str(assistant_id), None)
+        shutil.rmtree(os.path.join(self.base_path, _safe_name(str(assistant_id))), ignore_errors=True)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "tenants": len(self._indexes),
+                "rows": sum(len(index) for _, index in self._indexes.values()),
+                "dim": self.embedder.dim,
+                "syncs": self.syncs,
+                "embedded": self.embedded,
+                "deleted": self.deleted,
+                "searches": self.searches
+            }
+
+
+def _safe_name(assistant_id: str) -> str:
+    return ''.join(char for char in assistant_id if char.isalnum() or char in '-_') or 'default'
+
+
+# Global semantic index registry
+semantic_index_registry = SemanticIndexRegistry(
+    base_path=Config.SEMANTIC_INDEX_PATH,
+    embedder=load_embedder(Config.SEMANTIC_EMBEDDER, Config.SEMANTIC_INDEX_DIM),
+    max_tenants=Config.SEMANTIC_INDEX_MAX_TENANTS
+)
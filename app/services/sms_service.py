@@ -1,7 +1,7 @@
 
-import requests
 import logging
 from app.config import Config
+from app.services.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +17,8 @@ class SMSService:
         try:
             url = f"{self.base_url}/Messages.json"
             
-            response = requests.post(
+            response = http_client.post(
+                'twilio',
                 url,
                 auth=(self.account_sid, self.auth_token),
                 data={
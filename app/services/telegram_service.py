@@ -1,8 +1,8 @@
 
-import requests
 import json
 import logging
 from app.config import Config
+from app.services.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +25,7 @@ class TelegramService:
             if reply_markup:
                 payload["reply_markup"] = json.dumps(reply_markup)
             
-            response = requests.post(url, json=payload)
+            response = http_client.post('telegram', url, json=payload)
             response.raise_for_status()
             
             logger.info(f"Telegram message sent to {chat_id}")
@@ -48,7 +48,7 @@ class TelegramService:
             if caption:
                 payload["caption"] = caption
             
-            response = requests.post(url, json=payload)
+            response = http_client.post('telegram', url, json=payload)
             response.raise_for_status()
             
             return response.json()
@@ -70,7 +70,7 @@ class TelegramService:
             if caption:
                 payload["caption"] = caption
             
-            response = requests.post(url, json=payload)
+            response = http_client.post('telegram', url, json=payload)
             response.raise_for_status()
             
             return response.json()
@@ -89,7 +89,7 @@ class TelegramService:
                 "allowed_updates": ["message", "callback_query"]
             }
             
-            response = requests.post(url, json=payload)
+            response = http_client.post('telegram', url, json=payload)
             response.raise_for_status()
             
             return response.json()
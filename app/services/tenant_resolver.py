@@ -0,0 +1,224 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.config import Config
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+TENANT_FIELDS = "id,user_id,name,personality,business_context"
+
+# Canal -> clave de business_context que identifica al asistente
+# (la voz se busca por la columna generada voice_phone_normalized: ver migrations/006)
+CHANNEL_KEYS = {
+    'voice': 'voice_phone',
+    'whatsapp': 'whatsapp_phone_number_id',
+    'telegram': 'telegram_chat_ids'
+}
+
+_NON_PHONE_CHARS = re.compile(r"[^0-9+]")
+NORMALIZED_VOICE_PHONE_COLUMN = "voice_phone_normalized"
+
+
+def normalize_channel_key(channel: str, value) -> str:
+    """Normalizar el identificador del canal (los teléfonos sin prefijos ni separadores)
+
+    Debe coincidir con la expresión de assistants.voice_phone_normalized.
+    """
+    key = str(value).strip()
+    if channel == 'voice':
+        for prefix in ('tel:', 'whatsapp:'):
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+        key = _NON_PHONE_CHARS.sub('', key)
+    return key
+
+
+class TenantContextResolver:
+    """Resolver número llamado / phone ID de WhatsApp / chat de Telegram al contexto del asistente
+
+    Caché con TTL y caché negativa para que los identificadores desconocidos no consulten
+    Supabase en cada mensaje.
+    """
+
+    def __init__(self, ttl: int = 300, negative_ttl: int = 60, max_entries: int = 10000, page_size: int = 1000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.page_size = page_size
+
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Optional[Dict], float]]" = OrderedDict()
+        self._assistant_keys: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._preloaded = False
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.errors = 0
+
+    def preload(self) -> int:
+        """Cargar en bloque el mapeo de todos los asistentes activos"""
+        self._preloaded = True
+        loaded = 0
+        offset = 0
+        try:
+            while True:
+                result = db.get_client().table("assistants").select(TENANT_FIELDS) \
+                    .eq("status", "active") \
+                    .order("id") \
+                    .range(offset, offset + self.page_size - 1) \
+                    .execute()
+
+                rows = result.data or []
+                for row in rows:
+                    loaded += self._index_assistant(row)
+
+                if len(rows) < self.page_size:
+                    break
+                offset += self.page_size
+        except Exception as e:
+            logger.error(f"Error preloading tenant contexts: {e}")
+            with self._lock:
+                self.errors += 1
+
+        logger.info(f"Tenant resolver preloaded {loaded} channel keys")
+        return loaded
+
+    def resolve(self, channel: str, value) -> Optional[Dict]:
+        """Obtener el contexto del negocio (con assistant_id) para el identificador del canal"""
+        if value is None or value == '' or channel not in CHANNEL_KEYS:
+            return None
+
+        if not self._preloaded:
+            self.preload()
+
+        cache_key = (channel, normalize_channel_key(channel, value))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(cache_key)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                    return None
+                self.hits += 1
+                return dict(entry[0])
+            self.misses += 1
+
+        try:
+            row = self._lookup(channel, cache_key[1])
+        except Exception as e:
+            # Un fallo de la base de datos no se guarda como resultado negativo
+            logger.error(f"Error resolving {channel} tenant {cache_key[1]}: {e}")
+            with self._lock:
+                self.errors += 1
+            return None
+
+        if row is None:
+            self._store(cache_key, None, self.negative_ttl)
+            return None
+
+        context = self._build_context(row)
+        self._store(cache_key, context, self.ttl, str(row['id']))
+        return dict(context)
+
+    def invalidate(self, assistant_id: Optional[str] = None):
+        """Olvidar las claves de un asistente y la caché negativa (puede haber números nuevos)"""
+        with self._lock:
+            if assistant_id is not None:
+                for cache_key in self._assistant_keys.pop(str(assistant_id), ()):
+                    self._entries.pop(cache_key, None)
+            for cache_key in [key for key, entry in self._entries.items() if entry[0] is None]:
+                del self._entries[cache_key]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            negative = sum(1 for entry in self._entries.values() if entry[0] is None)
+            resolved = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._entries) - negative,
+                "negative_entries": negative,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / resolved, 4) if resolved else 0.0,
+                "db_lookups": self.lookups,
+                "errors": self.errors,
+                "preloaded": self._preloaded
+            }
+
+    def _lookup(self, channel: str, key: str) -> Optional[Dict]:
+        """Consulta puntual a Supabase por la clave del canal"""
+        field = CHANNEL_KEYS[channel]
+        query = db.get_client().table("assistants").select(TENANT_FIELDS).eq("status", "active")
+        if channel == 'telegram':
+            query = query.contains("business_context", {field: [key]})
+        elif channel == 'voice':
+            # El número guardado puede llevar espacios o guiones: se compara ya normalizado
+            query = query.eq(NORMALIZED_VOICE_PHONE_COLUMN, key)
+        else:
+            query = query.eq(f"business_context->>{field}", key)
+        result = query.limit(1).execute()
+
+        with self._lock:
+            self.lookups += 1
+        return result.data[0] if result.data else None
+
+    def _index_assistant(self, row: Dict) -> int:
+        business_context = row.get('business_context') or {}
+        context = self._build_context(row)
+        assistant_id = str(row['id'])
+        indexed = 0
+
+        for channel, field in CHANNEL_KEYS.items():
+            values = business_context.get(field)
+            if values is None or values == '':
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                self._store((channel, normalize_channel_key(channel, value)), context, self.ttl, assistant_id)
+                indexed += 1
+        return indexed
+
+    @staticmethod
+    def _build_context(row: Dict) -> Dict:
+        context = dict(row.get('business_context') or {})
+        context['assistant_id'] = str(row['id'])
+        context['user_id'] = row.get('user_id')
+        context['personality'] = row.get('personality') or context.get('personality')
+        return context
+
+    def _store(self, cache_key: Tuple[str, str], context: Optional[Dict], ttl: int, assistant_id: str = None):
+        with self._lock:
+            self._entries[cache_key] = (context, time.time() + ttl)
+            self._entries.move_to_end(cache_key)
+            if assistant_id is not None:
+                self._assistant_keys.setdefault(assistant_id, set()).add(cache_key)
+
+            while len(self._entries) > self.max_entries:
+                oldest_key, _ = self._entries.popitem(last=False)
+                self._forget_owner(oldest_key)
+
+    def _forget_owner(self, cache_key: Tuple[str, str]):
+        for assistant_id, keys in list(self._assistant_keys.items()):
+            if cache_key in keys:
+                keys.discard(cache_key)
+                if not keys:
+                    del self._assistant_keys[assistant_id]
+                return
+
+
+# Global resolver instance
+tenant_resolver = TenantContextResolver(
+    ttl=Config.TENANT_CONTEXT_TTL,
+    negative_ttl=Config.TENANT_CONTEXT_NEGATIVE_TTL,
+    max_entries=Config.TENANT_CONTEXT_MAX_ENTRIES
+)
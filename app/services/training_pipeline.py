@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.config import Config
+from app.models.training import TrainingDataCreate, TrainingType
+from app.services.answer_engine import answer_engine
+from app.services.http_client import LatencyHistogram
+from app.services.knowledge_index import knowledge_index_registry
+from app.services.response_cache import normalize_message, response_cache
+from app.services.tenant_resolver import tenant_resolver
+from app.utils.database import db
+
+logger = logging.getLogger(__name__)
+
+TRAINING_TABLE = 'training_data'
+
+# Categoría asignada con auto_categorize cuando la fila no trae una
+DEFAULT_CATEGORIES = {
+    TrainingType.FAQ: 'Preguntas Frecuentes',
+    TrainingType.PRODUCT_INFO: 'Productos',
+    TrainingType.SERVICE_INFO: 'Servicios',
+    TrainingType.PROCESS_INFO: 'Procesos',
+    TrainingType.CUSTOM_RESPONSE: 'Respuestas Personalizadas'
+}
+
+
+def question_hash(question: str) -> str:
+    """Clave de deduplicación: la pregunta normalizada (mayúsculas, acentos y signos no cuentan)"""
+    return hashlib.sha1(normalize_message(question).encode('utf-8')).hexdigest()
+
+
+class TrainingIngestPipeline:
+    """Ingesta de datos de entrenamiento por lotes
+
+    Las filas se validan y deduplican una a una según llegan, se insertan en bloques
+    (las preguntas ya guardadas se ignoran en la base de datos) y las filas nuevas de
+    cada bloque se añaden al custom_knowledge de los asistentes del cliente, hasta
+    max_knowledge_pairs pares por asistente.
+    """
+
+    def __init__(self, chunk_size: int = 500, max_rows: int = 200000, max_errors: int = 50,
+                 max_knowledge_pairs: int = 5000):
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_errors = max_errors
+        self.max_knowledge_pairs = max_knowledge_pairs
+
+        self._lock = threading.Lock()
+        self.batch_latency = LatencyHistogram()
+        self.uploads = 0
+        self.received = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.reindexed = 0
+        self.last_rows_per_second = 0.0
+
+    def ingest(self, user_id: str, rows: Iterable[Tuple[int, object]], assistant_ids: List[str] = (),
+               auto_categorize: bool = True) -> Dict:
+        """Validar, deduplicar e insertar las filas; devuelve el informe de la carga"""
+        started_at = time.monotonic()
+        report = {
+            "received": 0, "valid": 0, "inserted": 0, "existing": 0, "duplicates": 0,
+            "rejected": 0, "failed": 0, "truncated": False, "errors": [], "batches": []
+        }
+        seen = set()
+        chunk: List[Dict] = []
+        reindexed = set()
+
+        for line_no, row in rows:
+            if report["received"] >= self.max_rows:
+                report["truncated"] = True
+                break
+            report["received"] += 1
+
+            record, error = self._validate(user_id, row, auto_categorize)
+            if error is not None:
+                report["rejected"] += 1
+                if len(report["errors"]) < self.max_errors:
+                    report["errors"].append({"line": line_no, "error": error})
+                continue
+
+            report["valid"] += 1
+            if record['question_hash'] in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(record['question_hash'])
+
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                reindexed.update(self._process_chunk(user_id, chunk, assistant_ids, report))
+                chunk = []
+
+        if chunk:
+            reindexed.update(self._process_chunk(user_id, chunk, assistant_ids, report))
+
+        report["existing"] = report["valid"] - report["duplicates"] - report["inserted"] - report["failed"]
+        report["reindexed_assistants"] = [str(assistant_id) for assistant_id in assistant_ids
+                                          if str(assistant_id) in reindexed]
+        for assistant_id in report["reindexed_assistants"]:
+            self._invalidate(assistant_id)
+
+        elapsed = time.monotonic() - started_at
+        report["seconds"] = round(elapsed, 3)
+        report["rows_per_second"] = round(report["received"] / elapsed, 1) if elapsed > 0 else 0.0
+
+        with self._lock:
+            self.uploads += 1
+            self.received += report["received"]
+            self.inserted += report["inserted"]
+            self.rejected += report["rejected"]
+            self.duplicates += report["duplicates"]
+            self.failed += report["failed"]
+            self.reindexed += len(report["reindexed_assistants"])
+            self.last_rows_per_second = report["rows_per_second"]
+
+        logger.info(f"Training upload for user {user_id}: {report['received']} rows, {report['inserted']} inserted, "
+                    f"{report['rejected']} rejected in {report['seconds']}s")
+        return report
+
+    def append_knowledge(self, user_id: str, assistant_ids: List[str], records: List[Dict]) -> List[str]:
+        """Añadir un bloque de filas nuevas al custom_knowledge de los asistentes
+
+        append_training_knowledge bloquea cada fila de assistants y fusiona en la base de
+        datos, así que no se pisan ediciones concurrentes ni se viaja con el JSONB completo.
+        """
+        items = [{
+            'question': record['question'],
+            'answer': record['answer'],
+            'keywords': record.get('keywords') or [],
+            'category': record.get('category') or 'General',
+            'question_hash': record['question_hash']
+        } for record in records]
+
+        try:
+            result = db.get_client().rpc("append_training_knowledge", {
+                "p_assistant_ids": list(assistant_ids),
+                "p_user_id": user_id,
+                "p_items": items,
+                "p_max_pairs": self.max_knowledge_pairs
+            }).execute()
+        except Exception as e:
+            logger.error(f"Error appending training data to assistants {list(assistant_ids)}: {e}")
+            return []
+        return [str(row['assistant_id']) for row in result.data or [] if row.get('added')]
+
+    @staticmethod
+    def _invalidate(assistant_id: str):
+        # Los índices se reconstruyen con la nueva versión; el semántico solo embebe las filas nuevas
+        knowledge_index_registry.invalidate(assistant_id)
+        response_cache.invalidate(assistant_id)
+        tenant_resolver.invalidate(assistant_id)
+        answer_engine.invalidate(assistant_id)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "chunk_size": self.chunk_size,
+                "rows_received": self.received,
+                "rows_inserted": self.inserted,
+                "rows_rejected": self.rejected,
+                "rows_duplicated": self.duplicates,
+                "rows_failed": self.failed,
+                "reindexed_assistants": self.reindexed,
+                "last_rows_per_second": self.last_rows_per_second,
+                "batch_latency": self.batch_latency.to_dict()
+            }
+
+    def _validate(self, user_id: str, row, auto_categorize: bool) -> Tuple[Optional[Dict], Optional[str]]:
+        if isinstance(row, Exception):
+            return None, f"JSON inválido: {row}"
+        if not isinstance(row, dict):
+            return None, "Se esperaba un objeto JSON"
+
+        try:
+            item = TrainingDataCreate(**{**row, 'user_id': user_id})
+        except ValidationError as e:
+            error = e.errors()[0]
+            return None, f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        except TypeError as e:
+            return None, str(e)
+
+        question = item.question.strip()
+        answer = item.answer.strip()
+        if not question or not answer:
+            return None, "question y answer no pueden estar vacíos"
+
+        training_type = TrainingType(item.training_type)
+        category = item.category or (DEFAULT_CATEGORIES[training_type] if auto_categorize else None)
+        return {
+            'user_id': user_id,
+            'training_type': training_type.value,
+            'question': question,
+            'answer': answer,
+            'category': category,
+            'keywords': item.keywords or [],
+            'context': item.context,
+            'question_hash': question_hash(question),
+            'status': 'completed'
+        }, None
+
+    def _process_chunk(self, user_id: str, chunk: List[Dict], assistant_ids: List[str], report: Dict) -> List[str]:
+        """Insertar el bloque y pasar sus filas nuevas a los asistentes (no se acumulan entre bloques)"""
+        inserted = self._insert_chunk(chunk, report)
+        report["inserted"] += len(inserted)
+        if not inserted or not assistant_ids:
+            return []
+        return self.append_knowledge(user_id, assistant_ids, inserted)
+
+    def _insert_chunk(self, chunk: List[Dict], report: Dict) -> List[Dict]:
+        start = time.monotonic()
+        try:
+            # ignore_duplicates: las preguntas que el cliente ya tenía no se sobrescriben
+            result = db.get_client().table(TRAINING_TABLE).upsert(
+                chunk, on_conflict="user_id,question_hash", ignore_duplicates=True
+            ).execute()
+            inserted = result.data or []
+            error = None
+        except Exception as e:
+            logger.error(f"Error inserting training batch: {e}")
+            inserted = []
+            error = str(e)
+            report["failed"] += len(chunk)
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.batch_latency.record(elapsed * 1000)
+        batch = {
+            "rows": len(chunk),
+            "inserted": len(inserted),
+            "ms": round(elapsed * 1000, 1),
+            "rows_per_second": round(len(chunk) / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        if error is not None:
+            batch["error"] = error
+        report["batches"].append(batch)
+        return inserted
+
+
+# Global training ingest pipeline
+training_pipeline = TrainingIngestPipeline(
+    chunk_size=Config.TRAINING_INSERT_CHUNK_SIZE,
+    max_rows=Config.TRAINING_UPLOAD_MAX_ROWS,
+    max_errors=Config.TRAINING_MAX_REPORTED_ERRORS,
+    max_knowledge_pairs=Config.TRAINING_KNOWLEDGE_MAX_PAIRS
+)
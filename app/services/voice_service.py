@@ -1,13 +1,42 @@
 
-import requests
 import logging
 from app.config import Config
+from app.services.http_client import http_client
 from app.services.openai_service import OpenAIService
-from typing import Dict, Optional
+from app.services.tenant_resolver import tenant_resolver
+from app.services.conversation_memory import conversation_memory
+from app.services.channel_stats import channel_stats
+from app.services.voice_turns import VoiceTurn, voice_turns
+from app.services.intent_matcher import intent_matcher
+from app.utils.twiml import TwiML
+from typing import Dict, Optional, Union
 import json
 
 logger = logging.getLogger(__name__)
 
+# Respuestas estáticas precompiladas una sola vez
+FALLBACK_TWIML = TwiML() \
+    .say("Lo siento, no he podido entender tu consulta claramente.") \
+    .gather("/api/voice/process_speech", "¿Podrías repetir tu consulta por favor?", speech_timeout=3) \
+    .say("Si continúas teniendo problemas, te recomiendo enviar un mensaje por WhatsApp o visitar nuestro sitio web.") \
+    .hangup() \
+    .to_bytes()
+
+ERROR_TWIML = TwiML() \
+    .say("Lo siento, estamos experimentando dificultades técnicas. Por favor, intenta llamar más tarde.") \
+    .hangup() \
+    .to_bytes()
+
+# Pasado el plazo sin respuesta del modelo y sin acción detectada
+DEADLINE_TWIML = TwiML() \
+    .say("Lo siento, estoy tardando más de lo normal en encontrar la respuesta.") \
+    .gather("/api/voice/process_speech", "¿Podrías repetir o reformular tu consulta?", speech_timeout=3) \
+    .say("Si lo prefieres, envíanos un mensaje por WhatsApp y te responderemos enseguida.") \
+    .hangup() \
+    .to_bytes()
+
+POLL_URL = "/api/voice/process_speech/poll"
+
 class VoiceService:
     def __init__(self):
         self.account_sid = Config.TWILIO_ACCOUNT_SID
@@ -24,7 +53,8 @@ class VoiceService:
             
             url = f"{self.base_url}/Calls.json"
             
-            response = requests.post(
+            response = http_client.post(
+                'twilio',
                 url,
                 auth=(self.account_sid, self.auth_token),
                 data={
@@ -44,7 +74,7 @@ class VoiceService:
             logger.error(f"Error making outbound call: {e}")
             return None
     
-    def handle_incoming_call(self, call_data: Dict) -> str:
+    def handle_incoming_call(self, call_data: Dict) -> Union[str, bytes]:
         """Manejar llamada entrante y generar respuesta TwiML"""
         try:
             caller_phone = call_data.get('From')
@@ -57,23 +87,18 @@ class VoiceService:
             welcome_message = self._generate_welcome_message(business_context)
             
             # Generar TwiML para respuesta interactiva
-            twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{welcome_message}</Say>
-    <Gather input="speech" timeout="5" speechTimeout="3" action="/api/voice/process_speech" method="POST">
-        <Say voice="alice" language="es">¿En qué puedo ayudarte hoy?</Say>
-    </Gather>
-    <Say voice="alice" language="es">No he recibido respuesta. Te transferiré con un representante. Un momento por favor.</Say>
-    <Dial>{business_context.get('support_phone', self.from_phone)}</Dial>
-</Response>"""
-            
-            return twiml
+            return TwiML() \
+                .say(welcome_message) \
+                .gather("/api/voice/process_speech", "¿En qué puedo ayudarte hoy?", speech_timeout=3) \
+                .say("No he recibido respuesta. Te transferiré con un representante. Un momento por favor.") \
+                .dial(business_context.get('support_phone', self.from_phone)) \
+                .to_xml()
             
         except Exception as e:
             logger.error(f"Error handling incoming call: {e}")
             return self._generate_error_twiml()
     
-    def process_speech(self, speech_data: Dict) -> str:
+    def process_speech(self, speech_data: Dict) -> Union[str, bytes]:
         """Procesar reconocimiento de voz y generar respuesta"""
         try:
             speech_text = speech_data.get('SpeechResult', '')
@@ -85,26 +110,78 @@ class VoiceService:
             # Obtener contexto del negocio
             business_context = self._get_business_context_by_phone(speech_data.get('To'))
             
-            # Generar respuesta con OpenAI
-            ai_response = self.openai_service.generate_voice_response(
-                speech_text, 
-                business_context
+            # Generar respuesta con OpenAI en segundo plano, con presupuesto de latencia
+            assistant_id = business_context.get('assistant_id')
+            history = conversation_memory.get_history(assistant_id, 'voice', caller_phone) \
+                if Config.CONVERSATION_MEMORY_ENABLED else None
+            turn = voice_turns.start(
+                speech_text,
+                {'business_context': business_context, 'caller_phone': caller_phone},
+                lambda: self.openai_service.generate_voice_response(
+                    speech_text,
+                    business_context,
+                    assistant_id=assistant_id,
+                    history=history
+                )
             )
+            if turn is None:
+                return self._generate_deadline_twiml(speech_text, business_context)
             
-            # Verificar si la consulta requiere acción específica
-            action_needed = self._analyze_speech_for_actions(speech_text, ai_response)
+            if voice_turns.wait(turn, first=True):
+                return self._complete_turn(turn)
             
-            if action_needed.get('type') == 'appointment':
-                return self._generate_appointment_twiml(ai_response, action_needed)
-            elif action_needed.get('type') == 'transfer':
-                return self._generate_transfer_twiml(ai_response, business_context)
-            else:
-                return self._generate_response_twiml(ai_response)
+            # Relleno mientras se genera; Twilio vuelve a pedir la respuesta
+            return self._generate_filler_twiml(turn, "Un momento, por favor.")
                 
         except Exception as e:
             logger.error(f"Error processing speech: {e}")
             return self._generate_error_twiml()
     
+    def poll_speech(self, turn_id: Optional[str]) -> Union[str, bytes]:
+        """Servir la respuesta de un turno que no estuvo lista dentro del presupuesto"""
+        try:
+            turn = voice_turns.get(turn_id) if turn_id else None
+            if turn is None:
+                return self._generate_fallback_twiml()
+            
+            if voice_turns.wait(turn):
+                return self._complete_turn(turn)
+            
+            if voice_turns.is_expired(turn):
+                # Plazo agotado: se responde con el análisis por palabras clave
+                voice_turns.finish(turn)
+                business_context = turn.context['business_context']
+                channel_stats.record(business_context.get('user_id'), 'calls', responded=False)
+                return self._generate_deadline_twiml(turn.speech_text, business_context)
+            
+            return self._generate_filler_twiml(turn, "Sigo buscando la información, un momento.")
+            
+        except Exception as e:
+            logger.error(f"Error polling voice response: {e}")
+            return self._generate_error_twiml()
+    
+    def _complete_turn(self, turn: VoiceTurn) -> str:
+        """Generar el TwiML final con la respuesta del modelo"""
+        voice_turns.finish(turn)
+        speech_text = turn.speech_text
+        business_context = turn.context['business_context']
+        ai_response = turn.answer or self.openai_service.ERROR_RESPONSE
+        
+        if Config.CONVERSATION_MEMORY_ENABLED and turn.answer:
+            conversation_memory.record_turn(business_context.get('assistant_id'), 'voice',
+                                            turn.context['caller_phone'], speech_text, ai_response)
+        channel_stats.record(business_context.get('user_id'), 'calls', turn.elapsed() * 1000)
+        
+        # Verificar si la consulta requiere acción específica
+        action_needed = self._analyze_speech_for_actions(speech_text, ai_response, business_context)
+        
+        if action_needed.get('type') == 'appointment':
+            return self._generate_appointment_twiml(ai_response, action_needed)
+        elif action_needed.get('type') == 'transfer':
+            return self._generate_transfer_twiml(ai_response, business_context)
+        else:
+            return self._generate_response_twiml(ai_response)
+    
     def _generate_welcome_message(self, business_context: Dict) -> str:
         """Generar mensaje de bienvenida personalizado"""
         business_name = business_context.get('business_name', 'nuestro negocio')
@@ -119,84 +196,79 @@ class VoiceService:
         
         return messages.get(business_type, f"Hola, has llamado a {business_name}. Soy tu asistente virtual.")
     
-    def _analyze_speech_for_actions(self, speech_text: str, ai_response: str) -> Dict:
+    def _analyze_speech_for_actions(self, speech_text: str, ai_response: str, business_context: Dict = None) -> Dict:
         """Analizar si la consulta requiere acciones específicas"""
-        speech_lower = speech_text.lower()
-        
-        # Palabras clave para citas
-        appointment_keywords = ['cita', 'appointment', 'reservar', 'agendar', 'turno', 'consulta', 'horario disponible']
-        
-        # Palabras clave para transferencia
-        transfer_keywords = ['urgente', 'emergencia', 'hablar con persona', 'representante', 'humano']
-        
-        if any(keyword in speech_lower for keyword in appointment_keywords):
-            return {'type': 'appointment', 'keywords': appointment_keywords}
-        elif any(keyword in speech_lower for keyword in transfer_keywords):
-            return {'type': 'transfer', 'keywords': transfer_keywords}
+        for intent, score, keywords in intent_matcher.classify(speech_text, business_context):
+            if intent in ('appointment', 'transfer'):
+                return {'type': intent, 'keywords': keywords, 'score': score}
         
         return {'type': 'general'}
     
     def _generate_response_twiml(self, response_text: str) -> str:
         """Generar TwiML para respuesta general"""
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{response_text}</Say>
-    <Gather input="speech" timeout="5" speechTimeout="3" action="/api/voice/process_speech" method="POST">
-        <Say voice="alice" language="es">¿Hay algo más en lo que pueda ayudarte?</Say>
-    </Gather>
-    <Say voice="alice" language="es">Gracias por llamar. Que tengas un buen día.</Say>
-    <Hangup/>
-</Response>"""
+        return TwiML() \
+            .say(response_text) \
+            .gather("/api/voice/process_speech", "¿Hay algo más en lo que pueda ayudarte?", speech_timeout=3) \
+            .say("Gracias por llamar. Que tengas un buen día.") \
+            .hangup() \
+            .to_xml()
     
     def _generate_appointment_twiml(self, response_text: str, action_data: Dict) -> str:
         """Generar TwiML para gestión de citas"""
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{response_text}</Say>
-    <Say voice="alice" language="es">Para agendar tu cita, necesito algunos datos. Te voy a transferir con nuestro sistema de reservas telefónicas.</Say>
-    <Gather input="dtmf" numDigits="1" timeout="10" action="/api/voice/appointment_menu" method="POST">
-        <Say voice="alice" language="es">Presiona 1 para agendar una nueva cita, 2 para modificar una cita existente, o 3 para hablar con un representante.</Say>
-    </Gather>
-</Response>"""
+        return TwiML() \
+            .say(response_text) \
+            .say("Para agendar tu cita, necesito algunos datos. Te voy a transferir con nuestro sistema de reservas telefónicas.") \
+            .gather("/api/voice/appointment_menu",
+                    "Presiona 1 para agendar una nueva cita, 2 para modificar una cita existente, o 3 para hablar con un representante.",
+                    input="dtmf", num_digits=1, timeout=10) \
+            .to_xml()
     
     def _generate_transfer_twiml(self, response_text: str, business_context: Dict) -> str:
         """Generar TwiML para transferencia a humano"""
         support_phone = business_context.get('support_phone', self.from_phone)
         
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">{response_text}</Say>
-    <Say voice="alice" language="es">Te voy a transferir con un representante. Un momento por favor.</Say>
-    <Dial timeout="30">
-        <Number>{support_phone}</Number>
-    </Dial>
-    <Say voice="alice" language="es">Lo siento, no hay representantes disponibles en este momento. Por favor, llama más tarde o envía un mensaje por WhatsApp.</Say>
-</Response>"""
-    
-    def _generate_fallback_twiml(self) -> str:
+        return TwiML() \
+            .say(response_text) \
+            .say("Te voy a transferir con un representante. Un momento por favor.") \
+            .dial(support_phone, timeout=30) \
+            .say("Lo siento, no hay representantes disponibles en este momento. Por favor, llama más tarde o envía un mensaje por WhatsApp.") \
+            .to_xml()
+    
+    def _generate_filler_twiml(self, turn: VoiceTurn, filler: str) -> str:
+        """Generar TwiML de relleno con redirección a la respuesta pendiente"""
+        return TwiML() \
+            .say(filler) \
+            .redirect(f"{POLL_URL}?turn={turn.turn_id}") \
+            .to_xml()
+    
+    def _generate_deadline_twiml(self, speech_text: str, business_context: Dict):
+        """Generar TwiML sin respuesta del modelo, solo con las palabras clave"""
+        action_needed = self._analyze_speech_for_actions(speech_text, '', business_context)
+        
+        if action_needed.get('type') == 'appointment':
+            return self._generate_appointment_twiml("Te ayudo con tu cita.", action_needed)
+        elif action_needed.get('type') == 'transfer':
+            return self._generate_transfer_twiml("Entendido.", business_context)
+        return DEADLINE_TWIML
+    
+    def _generate_fallback_twiml(self) -> bytes:
         """Generar TwiML cuando no se entiende el audio"""
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">Lo siento, no he podido entender tu consulta claramente.</Say>
-    <Gather input="speech" timeout="5" speechTimeout="3" action="/api/voice/process_speech" method="POST">
-        <Say voice="alice" language="es">¿Podrías repetir tu consulta por favor?</Say>
-    </Gather>
-    <Say voice="alice" language="es">Si continúas teniendo problemas, te recomiendo enviar un mensaje por WhatsApp o visitar nuestro sitio web.</Say>
-    <Hangup/>
-</Response>"""
-    
-    def _generate_error_twiml(self) -> str:
+        return FALLBACK_TWIML
+    
+    def _generate_error_twiml(self) -> bytes:
         """Generar TwiML para errores"""
-        return f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Say voice="alice" language="es">Lo siento, estamos experimentando dificultades técnicas. Por favor, intenta llamar más tarde.</Say>
-    <Hangup/>
-</Response>"""
+        return ERROR_TWIML
     
     def _get_business_context_by_phone(self, phone_number: str) -> Dict:
         """Obtener contexto del negocio por número de teléfono"""
-        # Esta función debería consultar la base de datos
-        # Por ahora devolvemos un contexto por defecto
+        try:
+            business_context = tenant_resolver.resolve('voice', phone_number)
+            if business_context:
+                return business_context
+        except Exception as e:
+            logger.error(f"Error getting business context for {phone_number}: {e}")
+
+        # Contexto por defecto para números no asociados a ningún asistente
         return {
             "business_name": "Mi Negocio",
             "business_type": "clinic",
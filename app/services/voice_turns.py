@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from app.config import Config
+from app.services.http_client import LatencyHistogram
+from app.services.worker_pool import BackgroundWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+# Intervalo de consulta al almacén compartido mientras otro worker genera la respuesta
+STORE_POLL_INTERVAL = 0.2
+
+
+class VoiceTurn:
+    """Turno de voz en curso: la respuesta se genera en segundo plano"""
+
+    __slots__ = ('turn_id', 'speech_text', 'context', 'started_at', 'answer', 'done', 'polls', 'remote')
+
+    def __init__(self, turn_id: str, speech_text: str, context: Dict, started_at: Optional[float] = None):
+        self.turn_id = turn_id
+        self.speech_text = speech_text
+        self.context = context
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.answer: Optional[str] = None
+        self.done = threading.Event()
+        self.polls = 0
+        # True si la respuesta se genera en otro worker y se lee del almacén compartido
+        self.remote = False
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class SQLiteTurnStore:
+    """Turnos pendientes en SQLite, compartidos entre los workers del mismo host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS voice_turns "
+            "(turn_id TEXT PRIMARY KEY, payload TEXT NOT NULL, answer TEXT, done INTEGER NOT NULL DEFAULT 0, "
+            "expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def put(self, turn_id: str, payload: Dict, ttl: float):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("DELETE FROM voice_turns WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "INSERT OR REPLACE INTO voice_turns (turn_id, payload, expires_at) VALUES (?, ?, ?)",
+            (turn_id, json.dumps(payload, ensure_ascii=False), now + ttl)
+        )
+
+    def set_answer(self, turn_id: str, answer: Optional[str]):
+        self._connection().execute("UPDATE voice_turns SET answer = ?, done = 1 WHERE turn_id = ?", (answer, turn_id))
+
+    def load(self, turn_id: str) -> Optional[Tuple[Dict, Optional[str], bool]]:
+        row = self._connection().execute(
+            "SELECT payload, answer, done FROM voice_turns WHERE turn_id = ? AND expires_at > ?", (turn_id, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), row[1], bool(row[2])) if row else None
+
+    def delete(self, turn_id: str):
+        self._connection().execute("DELETE FROM voice_turns WHERE turn_id = ?", (turn_id,))
+
+
+class RedisTurnStore:
+    """Turnos pendientes en Redis, compartidos entre hosts"""
+
+    def __init__(self, url: str, prefix: str = 'voice_turn:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def put(self, turn_id: str, payload: Dict, ttl: float):
+        self.client.hset(self.prefix + turn_id, mapping={'payload': json.dumps(payload, ensure_ascii=False), 'done': 0})
+        self.client.expire(self.prefix + turn_id, int(ttl) + 1)
+
+    def set_answer(self, turn_id: str, answer: Optional[str]):
+        # Solo si el turno sigue existiendo (no recrear uno ya retirado o caducado)
+        if self.client.exists(self.prefix + turn_id):
+            self.client.hset(self.prefix + turn_id, mapping={'answer': answer or '', 'done': 1})
+
+    def load(self, turn_id: str) -> Optional[Tuple[Dict, Optional[str], bool]]:
+        entry = self.client.hgetall(self.prefix + turn_id)
+        if not entry:
+            return None
+        answer = entry.get(b'answer')
+        return json.loads(entry[b'payload']), answer.decode('utf-8') if answer else None, entry.get(b'done') == b'1'
+
+    def delete(self, turn_id: str):
+        self.client.delete(self.prefix + turn_id)
+
+
+def create_turn_store(storage_url: str):
+    """Almacén compartido de turnos: sqlite:///ruta o redis://; memory:// (None) solo vale con un worker"""
+    if storage_url.startswith('sqlite:///'):
+        return SQLiteTurnStore(storage_url[len('sqlite:///'):])
+    if storage_url.startswith(('redis://', 'rediss://')):
+        return RedisTurnStore(storage_url)
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        logger.warning("VOICE_TURN_STORAGE_URL is memory:// with several workers: "
+                       "voice poll redirects that reach another worker will fall back")
+    return None
+
+
+class VoiceTurnPipeline:
+    """Generación de respuestas de voz con presupuesto de latencia
+
+    La respuesta se genera en un pool de hilos. Si no está lista dentro del presupuesto,
+    la petición de Twilio se contesta con un relleno y una redirección; la respuesta se
+    sirve en la petición siguiente. Pasado el plazo máximo el turno se abandona.
+
+    La redirección puede llegar a otro worker: con un almacén compartido (store) el turno
+    y su respuesta se guardan también allí. Sin él, hace falta un solo worker o que el
+    balanceador mantenga cada llamada en el mismo proceso.
+    """
+
+    def __init__(self, budget: float = 2.5, poll_wait: float = 4.0, deadline: float = 10.0,
+                 workers: int = 8, max_pending: int = 1000, store=None):
+        self.store = store
+        self.budget = budget
+        self.poll_wait = poll_wait
+        self.deadline = deadline
+        self.max_pending = max_pending
+
+        self._turns: "OrderedDict[str, VoiceTurn]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = BackgroundWorkerPool('voice-generation', workers=workers, max_queue_depth=max_pending)
+
+        self.generation_latency = LatencyHistogram()
+        self.within_budget = 0
+        self.after_poll = 0
+        self.deadline_fallbacks = 0
+        self.rejected = 0
+        self.expired = 0
+        self.remote_turns = 0
+        self.store_errors = 0
+
+    def start(self, speech_text: str, context: Dict, generate: Callable[[], str]) -> Optional[VoiceTurn]:
+        """Lanzar la generación; devuelve None si el pool está saturado"""
+        turn = VoiceTurn(uuid.uuid4().hex, speech_text, context)
+
+        with self._lock:
+            self._expire()
+            if len(self._turns) >= self.max_pending:
+                self.rejected += 1
+                return None
+            self._turns[turn.turn_id] = turn
+
+        if self.store is not None:
+            payload = {'speech_text': speech_text, 'context': context, 'created_at': time.time()}
+            self._store_call('put', turn.turn_id, payload, self.deadline * 2)
+
+        if not self._pool.submit(self._generate, turn, generate):
+            with self._lock:
+                self._turns.pop(turn.turn_id, None)
+                self.rejected += 1
+            return None
+        return turn
+
+    def wait(self, turn: VoiceTurn, first: bool = False) -> bool:
+        """Esperar la respuesta: el presupuesto en la primera petición, después hasta el plazo máximo"""
+        timeout = max(self.budget if first else min(self.poll_wait, self.deadline - turn.elapsed()), 0)
+        if not turn.remote:
+            return turn.done.wait(timeout)
+
+        # Generado en otro worker: se consulta el almacén hasta que aparezca la respuesta
+        wait_until = time.monotonic() + timeout
+        while True:
+            entry = self._store_call('load', turn.turn_id)
+            if entry is not None and entry[2]:
+                turn.answer = entry[1]
+                turn.done.set()
+                return True
+            if entry is None or time.monotonic() >= wait_until:
+                return False
+            time.sleep(STORE_POLL_INTERVAL)
+
+    def get(self, turn_id: str) -> Optional[VoiceTurn]:
+        """Turno pendiente para una petición de seguimiento (None si no existe o ya expiró)"""
+        with self._lock:
+            turn = self._turns.get(turn_id)
+        if turn is None and self.store is not None:
+            turn = self._load_remote(turn_id)
+        if turn is not None:
+            turn.polls += 1
+        return turn
+
+    def is_expired(self, turn: VoiceTurn) -> bool:
+        return not turn.done.is_set() and turn.elapsed() >= self.deadline
+
+    def finish(self, turn: VoiceTurn):
+        """Retirar el turno; si se abandona por plazo, la respuesta que llegue se descarta"""
+        if self.store is not None:
+            self._store_call('delete', turn.turn_id)
+        with self._lock:
+            self._turns.pop(turn.turn_id, None)
+            if not turn.done.is_set():
+                self.deadline_fallbacks += 1
+            elif turn.polls:
+                self.after_poll += 1
+            else:
+                self.within_budget += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": len(self._turns),
+                "budget_seconds": self.budget,
+                "deadline_seconds": self.deadline,
+                "within_budget": self.within_budget,
+                "after_poll": self.after_poll,
+                "deadline_fallbacks": self.deadline_fallbacks,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "store": type(self.store).__name__ if self.store is not None else None,
+                "remote_turns": self.remote_turns,
+                "store_errors": self.store_errors,
+                "generation_latency": self.generation_latency.to_dict(),
+                "pool": self._pool.get_stats()
+            }
+
+    def _generate(self, turn: VoiceTurn, generate: Callable[[], str]):
+        try:
+            turn.answer = generate()
+        finally:
+            with self._lock:
+                self.generation_latency.record(turn.elapsed() * 1000)
+            turn.done.set()
+            if self.store is not None:
+                self._store_call('set_answer', turn.turn_id, turn.answer)
+
+    def _load_remote(self, turn_id: str) -> Optional[VoiceTurn]:
+        """Reconstruir un turno iniciado en otro worker a partir del almacén compartido"""
+        entry = self._store_call('load', turn_id)
+        if entry is None:
+            return None
+        payload, answer, done = entry
+        started_at = time.monotonic() - max(time.time() - payload['created_at'], 0)
+        turn = VoiceTurn(turn_id, payload['speech_text'], payload['context'], started_at=started_at)
+        turn.remote = True
+        if done:
+            turn.answer = answer
+            turn.done.set()
+        with self._lock:
+            self.remote_turns += 1
+        return turn
+
+    def _store_call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            # Sin almacén el turno sigue funcionando si el seguimiento llega al mismo worker
+            logger.error(f"Voice turn store error ({method}): {e}")
+            with self._lock:
+                self.store_errors += 1
+            return None
+
+    def _expire(self):
+        # Turnos cuyo seguimiento nunca llegó (llamada colgada); se insertan en orden
+        cutoff = self.deadline * 2
+        while self._turns:
+            turn = next(iter(self._turns.values()))
+            if turn.elapsed() < cutoff:
+                break
+            self._turns.popitem(last=False)
+            self.expired += 1
+
+
+# Global voice turn pipeline
+voice_turns = VoiceTurnPipeline(
+    budget=Config.VOICE_RESPONSE_BUDGET_SECONDS,
+    poll_wait=Config.VOICE_POLL_WAIT_SECONDS,
+    deadline=Config.VOICE_RESPONSE_DEADLINE_SECONDS,
+    workers=Config.VOICE_GENERATION_WORKERS,
+    max_pending=Config.VOICE_MAX_PENDING_TURNS,
+    store=create_turn_store(Config.VOICE_TURN_STORAGE_URL)
+)
@@ -1,8 +1,8 @@
 
-import requests
 import json
 import logging
 from app.config import Config
+from app.services.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +35,7 @@ class WhatsAppService:
                 "text": {"body": message_text}
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post('whatsapp', url, headers=headers, json=payload)
             response.raise_for_status()
             
             logger.info(f"Message sent to {to_phone}")
@@ -67,7 +67,7 @@ class WhatsAppService:
             if components:
                 payload["template"]["components"] = components
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post('whatsapp', url, headers=headers, json=payload)
             response.raise_for_status()
             
             return response.json()
@@ -98,7 +98,7 @@ class WhatsAppService:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post('whatsapp', url, headers=headers, json=payload)
             response.raise_for_status()
             
             return response.json()
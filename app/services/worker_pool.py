@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorkerPool:
+    """Pool de hilos con cola acotada para procesar trabajo fuera del ciclo de la petición"""
+
+    def __init__(self, name: str, workers: int = 4, max_queue_depth: int = 1000):
+        self.name = name
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_depth)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_workers = 0
+        self.max_observed_depth = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def start(self):
+        """Arrancar los hilos de trabajo (idempotente)"""
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+        logger.info(f"Worker pool '{self.name}' started with {self.workers} workers")
+
+    def submit(self, func: Callable, *args, **kwargs) -> bool:
+        """Encolar una tarea; devuelve False si la cola está llena"""
+        if not self._started:
+            self.start()
+
+        try:
+            self._queue.put_nowait((func, args, kwargs, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f"Worker pool '{self.name}' queue full ({self.max_queue_depth}), task rejected")
+            return False
+
+        with self._lock:
+            self.submitted += 1
+            self.max_observed_depth = max(self.max_observed_depth, self._queue.qsize())
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Esperar a que se vacíe la cola y detener los hilos"""
+        with self._lock:
+            if not self._started:
+                return
+            threads = list(self._threads)
+            self._threads = []
+            self._started = False
+
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            dequeued = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "busy_workers": self.busy_workers,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "max_observed_depth": self.max_observed_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_time / dequeued * 1000, 2) if dequeued else 0.0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 2)
+            }
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+
+            func, args, kwargs, enqueued_at = task
+            wait_time = time.monotonic() - enqueued_at
+            with self._lock:
+                self.busy_workers += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+            try:
+                func(*args, **kwargs)
+                succeeded = True
+            except Exception as e:
+                succeeded = False
+                logger.error(f"Worker pool '{self.name}' task error: {e}")
+            finally:
+                self._queue.task_done()
+
+            with self._lock:
+                self.busy_workers -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
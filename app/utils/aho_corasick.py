@@ -0,0 +1,76 @@
+from collections import deque
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """Autómata Aho-Corasick para buscar muchas subcadenas en una sola pasada"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[str, Any]]] = [[]]
+        self._matches: List[List[Tuple[str, Any]]] = [[]]
+        self._pattern_count = 0
+        self._built = False
+
+    def add(self, pattern: str, value: Any = None):
+        """Agregar un patrón con el valor que se devolverá al encontrarlo"""
+        if not pattern:
+            raise ValueError("Pattern must not be empty")
+
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+
+        self._outputs[node].append((pattern, pattern if value is None else value))
+        self._pattern_count += 1
+        self._built = False
+
+    def build(self):
+        """Calcular enlaces de fallo (BFS); se llama automáticamente al buscar"""
+        self._matches = [list(output) for output in self._outputs]
+        queue = deque()
+        for next_node in self._goto[0].values():
+            self._fail[next_node] = 0
+            queue.append(next_node)
+
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_node] = self._goto[fallback].get(char, 0)
+                self._matches[next_node].extend(self._matches[self._fail[next_node]])
+
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, Any]]:
+        """Recorrer el texto una vez y devolver (posición final, patrón, valor) por coincidencia"""
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        matches = self._matches
+        node = 0
+
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for pattern, value in matches[node]:
+                yield position, pattern, value
+
+    def __len__(self) -> int:
+        return self._pattern_count
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+from typing import Dict, Iterable, Iterator, Sequence, Tuple
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+
+
+def iter_ndjson(stream) -> Iterator[Tuple[int, object]]:
+    """Filas de un cuerpo NDJSON leído línea a línea: (número de línea, objeto o error de formato)"""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, e
+
+
+def iter_csv(stream, encoding: str = 'utf-8-sig') -> Iterator[Tuple[int, object]]:
+    """Filas de un CSV con cabecera leído en streaming: (línea, dict con celdas vacías a None, o error)"""
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding=encoding, newline=''))
+    try:
+        for row in reader:
+            if None in row:
+                yield reader.line_num, ValueError("La fila tiene más columnas que la cabecera")
+                continue
+            yield reader.line_num, {
+                key.strip(): value.strip() or None if isinstance(value, str) else value
+                for key, value in row.items()
+            }
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num, e
+
+
+def csv_chunk(rows: Iterable[Dict], fields: Sequence[str], header: bool = False) -> str:
+    """Filas serializadas como CSV (con cabecera opcional) para enviarlas en streaming"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    for row in rows:
+        writer.writerow(['' if row.get(field) is None else row.get(field) for field in fields])
+    return buffer.getvalue()
+
+
+def ndjson_chunk(rows: Iterable[Dict]) -> str:
+    return ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows)
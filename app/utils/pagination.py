@@ -0,0 +1,32 @@
+import base64
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def encode_cursor(position: Dict) -> str:
+    """Cursor opaco (base64 url-safe) con la posición de la última fila servida"""
+    raw = json.dumps(position, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> Dict:
+    """Posición de un cursor; ValueError si el token no es válido"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        position = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+    if not isinstance(position, dict):
+        raise ValueError("Cursor inválido")
+    return position
+
+
+def parse_fields(value: Optional[str], allowed: Iterable[str], default: Tuple[str, ...],
+                 required: Tuple[str, ...] = ('id',)) -> Optional[Tuple[str, ...]]:
+    """Columnas pedidas en ?fields=a,b (None si alguna no está permitida); siempre incluye las requeridas"""
+    if not value:
+        return default
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields or any(field not in allowed for field in fields):
+        return None
+    return tuple(dict.fromkeys(list(required) + fields))
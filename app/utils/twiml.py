@@ -0,0 +1,83 @@
+from typing import Optional
+
+from flask import Response
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+TWIML_MIMETYPE = 'application/xml'
+
+# str.translate con tabla precalculada: una sola pasada sobre el texto
+_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&apos;'
+})
+
+
+def escape_xml(value) -> str:
+    """Escapar texto o atributo para incluirlo en TwiML"""
+    return str(value).translate(_ESCAPE_TABLE)
+
+
+def _attributes(**attributes) -> str:
+    return ''.join(
+        f' {name}="{escape_xml(value)}"' for name, value in attributes.items() if value is not None
+    )
+
+
+class TwiML:
+    """Constructor de respuestas TwiML; todo el texto dinámico se escapa"""
+
+    __slots__ = ('_parts',)
+
+    def __init__(self):
+        self._parts = [XML_HEADER, '<Response>']
+
+    def say(self, text: str, voice: str = 'alice', language: str = 'es') -> 'TwiML':
+        self._parts.append(f'<Say{_attributes(voice=voice, language=language)}>{escape_xml(text)}</Say>')
+        return self
+
+    def pause(self, length: int = 1) -> 'TwiML':
+        self._parts.append(f'<Pause length="{int(length)}"/>')
+        return self
+
+    def gather(self, action: str, prompt: Optional[str] = None, input: str = 'speech', timeout: int = 5,
+               speech_timeout: Optional[int] = None, num_digits: Optional[int] = None, method: str = 'POST') -> 'TwiML':
+        attributes = _attributes(input=input, numDigits=num_digits, timeout=timeout,
+                                 speechTimeout=speech_timeout, action=action, method=method)
+        if prompt is None:
+            self._parts.append(f'<Gather{attributes}/>')
+        else:
+            self._parts.append(f'<Gather{attributes}><Say voice="alice" language="es">{escape_xml(prompt)}</Say></Gather>')
+        return self
+
+    def dial(self, number: str, timeout: Optional[int] = None, caller_id: Optional[str] = None) -> 'TwiML':
+        self._parts.append(
+            f'<Dial{_attributes(timeout=timeout, callerId=caller_id)}><Number>{escape_xml(number)}</Number></Dial>'
+        )
+        return self
+
+    def redirect(self, url: str, method: Optional[str] = None) -> 'TwiML':
+        self._parts.append(f'<Redirect{_attributes(method=method)}>{escape_xml(url)}</Redirect>')
+        return self
+
+    def hangup(self) -> 'TwiML':
+        self._parts.append('<Hangup/>')
+        return self
+
+    def to_xml(self) -> str:
+        return ''.join(self._parts) + '</Response>'
+
+    def to_bytes(self) -> bytes:
+        return self.to_xml().encode('utf-8')
+
+    def __str__(self) -> str:
+        return self.to_xml()
+
+
+def twiml_response(twiml) -> Response:
+    """Respuesta Flask para TwiML ya renderizado (str, bytes o TwiML)"""
+    if isinstance(twiml, TwiML):
+        twiml = twiml.to_bytes()
+    return Response(twiml, mimetype=TWIML_MIMETYPE)
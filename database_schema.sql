@@ -24,6 +24,10 @@ CREATE TABLE assistants (
     description TEXT,
     personality VARCHAR(255) DEFAULT 'profesional y amigable',
     business_context JSONB,
+    -- Igual que tenant_resolver.normalize_channel_key('voice', ...)
+    voice_phone_normalized TEXT GENERATED ALWAYS AS (
+        regexp_replace(business_context->>'voice_phone', '[^0-9+]', '', 'g')
+    ) STORED,
     welcome_message TEXT,
     fallback_message TEXT,
     status VARCHAR(20) DEFAULT 'active',
@@ -75,6 +79,9 @@ CREATE TABLE conversations (
     channel VARCHAR(20) NOT NULL DEFAULT 'whatsapp', -- whatsapp, telegram, email, web
     last_message TEXT,
     message_count INTEGER DEFAULT 0,
+    memory_key VARCHAR(255) UNIQUE, -- asistente|canal|cliente (memoria de conversación)
+    summary TEXT,
+    history JSONB,
     status VARCHAR(20) DEFAULT 'active',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -91,6 +98,19 @@ CREATE TABLE messages (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Registro de mensajes por canal (solo inserciones; lo escribe conversation_log en bloques)
+CREATE TABLE conversation_log (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    assistant_id UUID REFERENCES assistants(id) ON DELETE CASCADE,
+    channel VARCHAR(20) NOT NULL DEFAULT 'whatsapp', -- whatsapp, telegram, web
+    customer_id VARCHAR(255), -- teléfono de WhatsApp o chat_id de Telegram
+    user_message TEXT,
+    bot_response TEXT,
+    answer_tier VARCHAR(20), -- knowledge, semantic, template, cache, llm (answer_engine.TIERS)
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Tabla de métricas y analytics
 CREATE TABLE analytics (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -103,18 +123,88 @@ CREATE TABLE analytics (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Eventos de estado de llamadas (solo inserciones; un registro por CallSid y estado)
+CREATE TABLE call_events (
+    id BIGSERIAL PRIMARY KEY,
+    call_sid VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    tenant_key TEXT NOT NULL DEFAULT '',
+    assistant_id UUID,
+    direction VARCHAR(20),
+    from_phone VARCHAR(32),
+    to_phone VARCHAR(32),
+    duration INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (call_sid, status)
+);
+
+-- Agregados diarios de llamadas por cliente (tenant_key = user_id del asistente)
+CREATE TABLE call_rollups (
+    tenant_key TEXT NOT NULL,
+    day DATE NOT NULL,
+    total_calls INTEGER NOT NULL DEFAULT 0,
+    answered_calls INTEGER NOT NULL DEFAULT 0,
+    missed_calls INTEGER NOT NULL DEFAULT 0,
+    total_duration BIGINT NOT NULL DEFAULT 0,
+    duration_buckets INTEGER[] NOT NULL DEFAULT array_fill(0, ARRAY[11]),
+    hourly_calls INTEGER[] NOT NULL DEFAULT array_fill(0, ARRAY[24]),
+    PRIMARY KEY (tenant_key, day)
+);
+
+-- Estadísticas por cliente, canal y hora (app/services/channel_stats.py)
+CREATE TABLE channel_stat_rollups (
+    tenant_key TEXT NOT NULL,
+    channel VARCHAR(20) NOT NULL,
+    hour_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    conversations INTEGER NOT NULL DEFAULT 0,
+    responses INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    response_count INTEGER NOT NULL DEFAULT 0,
+    response_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    response_sketch JSONB NOT NULL DEFAULT '{}'::jsonb,
+    PRIMARY KEY (tenant_key, channel, hour_start)
+);
+
+-- Datos de entrenamiento (una fila por pregunta normalizada y cliente)
+CREATE TABLE training_data (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    training_type VARCHAR(30) NOT NULL DEFAULT 'faq',
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    category VARCHAR(255),
+    keywords TEXT[] DEFAULT '{}',
+    context JSONB,
+    question_hash CHAR(40) NOT NULL,
+    status VARCHAR(20) DEFAULT 'completed',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (user_id, question_hash)
+);
+
 -- Índices para optimizar consultas
-CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_business_type ON users(business_type);
 CREATE INDEX idx_assistants_user_id ON assistants(user_id);
-CREATE INDEX idx_appointments_user_id ON appointments(user_id);
+CREATE INDEX idx_assistants_active_id ON assistants(id) WHERE status = 'active';
+CREATE INDEX idx_assistants_active_voice_phone ON assistants(voice_phone_normalized) WHERE status = 'active';
+CREATE INDEX idx_assistants_active_whatsapp_id ON assistants((business_context->>'whatsapp_phone_number_id')) WHERE status = 'active';
+CREATE INDEX idx_assistants_active_context ON assistants USING GIN (business_context jsonb_path_ops) WHERE status = 'active';
+CREATE INDEX idx_appointments_user_date_id ON appointments(user_id, appointment_date DESC, id DESC);
+CREATE INDEX idx_appointments_user_status_date_id ON appointments(user_id, status, appointment_date DESC, id DESC);
+CREATE INDEX idx_appointments_active_date ON appointments(appointment_date) WHERE status IN ('scheduled', 'confirmed');
+CREATE UNIQUE INDEX idx_appointments_active_slot ON appointments(user_id, appointment_date, appointment_time) WHERE status IN ('scheduled', 'confirmed');
 CREATE INDEX idx_appointments_date ON appointments(appointment_date);
+CREATE INDEX idx_appointments_updated_at ON appointments(updated_at, id);
 CREATE INDEX idx_subscriptions_user_id ON subscriptions(user_id);
 CREATE INDEX idx_conversations_user_id ON conversations(user_id);
 CREATE INDEX idx_conversations_channel ON conversations(channel);
 CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
+CREATE INDEX idx_conversation_log_assistant_created ON conversation_log(assistant_id, created_at DESC);
+CREATE INDEX idx_conversation_log_created_at ON conversation_log USING BRIN (created_at);
 CREATE INDEX idx_analytics_user_id ON analytics(user_id);
 CREATE INDEX idx_analytics_date ON analytics(date);
+CREATE INDEX idx_call_events_created_at ON call_events USING BRIN (created_at);
+CREATE INDEX idx_training_data_user_created ON training_data(user_id, created_at DESC);
 
 -- Función para actualizar updated_at automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -140,3 +230,138 @@ CREATE TRIGGER update_subscriptions_updated_at BEFORE UPDATE ON subscriptions
 
 CREATE TRIGGER update_conversations_updated_at BEFORE UPDATE ON conversations
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE TRIGGER update_training_data_updated_at BEFORE UPDATE ON training_data
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Registrar un evento de llamada y actualizar su agregado diario en una sola transacción
+CREATE OR REPLACE FUNCTION record_call_event(
+    p_call_sid VARCHAR, p_tenant_key TEXT, p_assistant_id UUID, p_status VARCHAR, p_direction VARCHAR,
+    p_from_phone VARCHAR, p_to_phone VARCHAR, p_duration INTEGER, p_duration_bucket INTEGER,
+    p_terminal BOOLEAN, p_answered BOOLEAN, p_day DATE, p_hour INTEGER
+) RETURNS BOOLEAN AS $$
+BEGIN
+    INSERT INTO call_events (call_sid, status, tenant_key, assistant_id, direction, from_phone, to_phone, duration)
+    VALUES (p_call_sid, p_status, p_tenant_key, p_assistant_id, p_direction, p_from_phone, p_to_phone, p_duration)
+    ON CONFLICT (call_sid, status) DO NOTHING;
+
+    -- Reintento del webhook: el evento ya estaba contabilizado
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    IF p_terminal THEN
+        INSERT INTO call_rollups (tenant_key, day) VALUES (p_tenant_key, p_day)
+        ON CONFLICT (tenant_key, day) DO NOTHING;
+
+        UPDATE call_rollups SET
+            total_calls = total_calls + 1,
+            answered_calls = answered_calls + CASE WHEN p_answered THEN 1 ELSE 0 END,
+            missed_calls = missed_calls + CASE WHEN p_answered THEN 0 ELSE 1 END,
+            total_duration = total_duration + CASE WHEN p_answered THEN p_duration ELSE 0 END,
+            duration_buckets[p_duration_bucket] = duration_buckets[p_duration_bucket] + CASE WHEN p_answered THEN 1 ELSE 0 END,
+            hourly_calls[p_hour + 1] = hourly_calls[p_hour + 1] + 1
+        WHERE tenant_key = p_tenant_key AND day = p_day;
+    END IF;
+
+    RETURN TRUE;
+END;
+$$ language 'plpgsql';
+
+-- Sumar los incrementos horarios de un worker; el histograma se fusiona cubeta a cubeta
+CREATE OR REPLACE FUNCTION merge_count_maps(a JSONB, b JSONB) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, sum(value::bigint) AS total
+        FROM (SELECT * FROM jsonb_each_text(a) UNION ALL SELECT * FROM jsonb_each_text(b)) counts
+        GROUP BY key
+    ) merged;
+$$ language 'sql' IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION record_channel_stats(p_rows JSONB) RETURNS INTEGER AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    INSERT INTO channel_stat_rollups AS r (
+        tenant_key, channel, hour_start, conversations, responses, errors,
+        response_count, response_sum_ms, response_sketch
+    )
+    SELECT tenant_key, channel, hour_start, conversations, responses, errors,
+           response_count, response_sum_ms, COALESCE(response_sketch, '{}'::jsonb)
+    FROM jsonb_to_recordset(p_rows) AS x(
+        tenant_key TEXT, channel VARCHAR, hour_start TIMESTAMP WITH TIME ZONE, conversations INTEGER,
+        responses INTEGER, errors INTEGER, response_count INTEGER, response_sum_ms DOUBLE PRECISION,
+        response_sketch JSONB
+    )
+    ON CONFLICT (tenant_key, channel, hour_start) DO UPDATE SET
+        conversations = r.conversations + EXCLUDED.conversations,
+        responses = r.responses + EXCLUDED.responses,
+        errors = r.errors + EXCLUDED.errors,
+        response_count = r.response_count + EXCLUDED.response_count,
+        response_sum_ms = r.response_sum_ms + EXCLUDED.response_sum_ms,
+        response_sketch = merge_count_maps(r.response_sketch, EXCLUDED.response_sketch);
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ language 'plpgsql';
+
+-- Añadir filas de entrenamiento al custom_knowledge de los asistentes de un usuario
+-- Cada asistente se bloquea (FOR UPDATE) y se fusiona aquí, sin leer-modificar-escribir desde la aplicación
+CREATE OR REPLACE FUNCTION append_training_knowledge(
+    p_assistant_ids UUID[], p_user_id UUID, p_items JSONB, p_max_pairs INTEGER
+) RETURNS TABLE (assistant_id UUID, added INTEGER) AS $$
+DECLARE
+    v_assistant RECORD;
+    v_item JSONB;
+    v_knowledge JSONB;
+    v_known TEXT[];
+    v_count INTEGER;
+    v_added INTEGER;
+    v_category TEXT;
+BEGIN
+    FOR v_assistant IN
+        SELECT a.id, a.business_context FROM assistants a
+        WHERE a.id = ANY(p_assistant_ids) AND a.user_id = p_user_id
+        ORDER BY a.id
+        FOR UPDATE
+    LOOP
+        v_knowledge := COALESCE(v_assistant.business_context->'custom_knowledge', '{}'::jsonb);
+
+        -- Las filas de cargas anteriores traen question_hash; las manuales se comparan por la pregunta
+        SELECT COALESCE(array_agg(COALESCE(qa->>'question_hash', lower(btrim(qa->>'question')))), '{}'), count(*)
+        INTO v_known, v_count
+        FROM jsonb_each(v_knowledge) AS category(name, pairs),
+             jsonb_array_elements(CASE WHEN jsonb_typeof(category.pairs) = 'array' THEN category.pairs ELSE '[]'::jsonb END) AS qa;
+
+        v_added := 0;
+        FOR v_item IN SELECT value FROM jsonb_array_elements(p_items) LOOP
+            EXIT WHEN v_count >= p_max_pairs;
+            CONTINUE WHEN v_item->>'question_hash' = ANY(v_known)
+                OR lower(btrim(v_item->>'question')) = ANY(v_known);
+
+            v_known := v_known || (v_item->>'question_hash');
+            v_category := COALESCE(NULLIF(v_item->>'category', ''), 'General');
+            v_knowledge := jsonb_set(
+                v_knowledge, ARRAY[v_category],
+                COALESCE(v_knowledge->v_category, '[]'::jsonb) || jsonb_build_array(v_item - 'category')
+            );
+            v_count := v_count + 1;
+            v_added := v_added + 1;
+        END LOOP;
+
+        IF v_added > 0 THEN
+            UPDATE assistants SET business_context = COALESCE(business_context, '{}'::jsonb)
+                || jsonb_build_object(
+                    'custom_knowledge', v_knowledge,
+                    'knowledge_version', extract(epoch FROM clock_timestamp())
+                )
+            WHERE id = v_assistant.id;
+
+            assistant_id := v_assistant.id;
+            added := v_added;
+            RETURN NEXT;
+        END IF;
+    END LOOP;
+END;
+$$ language 'plpgsql';
@@ -1,6 +1,7 @@
 from flask import Flask, send_from_directory, request, g
 import os
 import logging
+import uuid
 from app.config import config
 from app.middleware.auth import require_auth, generate_token, verify_token
 from app.middleware.rate_limit import rate_limit
@@ -24,6 +25,7 @@ def create_app(config_name=None):
         app.logger.info("Database initialized successfully")
     except Exception as e:
         app.logger.error(f"Database initialization failed: {e}")
+    db_manager.init_app(app)
     
     # Request logging middleware
     @app.before_request
@@ -39,7 +41,7 @@ def create_app(config_name=None):
     def health_check():
         db_healthy = db_manager.health_check()
         status = 'healthy' if db_healthy else 'unhealthy'
-        return {'status': status, 'database': db_healthy}, 200 if db_healthy else 503
+        return {'status': status, 'database': db_healthy, 'pool': db_manager.get_stats()}, 200 if db_healthy else 503
     
     return app
 
@@ -61,6 +63,20 @@ except ImportError:
     print("Warning: Training blueprint not found, skipping...")
 
 # API Mock endpoints for demo
+def demo_user_id(email):
+    """ID estable por email para el login de demo (el mismo usuario en cada sesión)"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"aiasistentpro:{email.strip().lower()}"))
+
+@app.route('/api/auth/profile', methods=['GET'])
+@require_auth
+def mock_profile():
+    """Validar el token firmado que emiten login y registro (el dashboard conserva sus user_data)"""
+    return {
+        "valid": True,
+        "user_id": request.current_user['user_id'],
+        "email": request.current_user['email']
+    }, 200
+
 @app.route('/api/auth/login', methods=['POST'])
 @rate_limit(limit=5, window=300)  # 5 attempts per 5 minutes
 def mock_login():
@@ -78,10 +94,11 @@ def mock_login():
         # Para demo, aceptamos cualquier email válido con contraseña específica
         # En producción esto se conectaría a una base de datos real
         if '@' in email and len(password) >= 6:
+            user_id = demo_user_id(email)
             return {
-                "access_token": f"demo_token_{email}_{password[:3]}",
+                "access_token": generate_token(user_id, email),
                 "user": {
-                    "id": 1,
+                    "id": user_id,
                     "email": email,
                     "business_name": "Mi Empresa",
                     "phone": "+34123456789",
@@ -115,11 +132,12 @@ def mock_register():
             return {"error": "La contraseña debe tener al menos 6 caracteres"}, 400
 
         # Simular registro exitoso
+        user_id = demo_user_id(email)
         return {
             "message": "Usuario registrado exitosamente",
-            "access_token": f"demo_token_{email}_{password[:3]}",
+            "access_token": generate_token(user_id, email),
             "user": {
-                "id": 2,
+                "id": user_id,
                 "email": email,
                 "business_name": business_name,
                 "phone": data.get('phone', ''),
@@ -346,45 +364,40 @@ def create_checkout_session():
     except Exception as e:
         return {"error": "Error interno del servidor"}, 500
 
+def channel_stats_response(channel):
+    """Estadísticas materializadas del canal para el usuario autenticado"""
+    from app.services.channel_stats import channel_stats, parse_time_range
+
+    try:
+        start, end = parse_time_range(request.args)
+    except ValueError:
+        return {"error": "Rango de fechas inválido"}, 400
+
+    return channel_stats.query(request.current_user.get('user_id'), channel, start, end), 200
+
 # WhatsApp Stats endpoint
 @app.route('/api/whatsapp/stats', methods=['GET'])
+@require_auth
 def whatsapp_stats():
-    return {
-        "conversations": 24,
-        "responses": 18,
-        "success_rate": 85,
-        "avg_response_time": "1.8 min"
-    }, 200
+    return channel_stats_response('whatsapp')
 
 # Telegram Stats endpoint  
 @app.route('/api/telegram/stats', methods=['GET'])
+@require_auth
 def telegram_stats():
-    return {
-        "conversations": 12,
-        "responses": 10,
-        "success_rate": 90,
-        "avg_response_time": "2.1 min"
-    }, 200
+    return channel_stats_response('telegram')
 
 # Email Stats endpoint
 @app.route('/api/email/stats', methods=['GET'])
+@require_auth
 def email_stats():
-    return {
-        "conversations": 8,
-        "responses": 7,
-        "success_rate": 95,
-        "avg_response_time": "4.2 min"
-    }, 200
+    return channel_stats_response('email')
 
 # Calls Stats endpoint
 @app.route('/api/calls/stats', methods=['GET'])
+@require_auth
 def calls_stats():
-    return {
-        "conversations": 5,
-        "responses": 4,
-        "success_rate": 80,
-        "avg_response_time": "3.5 min"
-    }, 200
+    return channel_stats_response('calls')
 
 # Registrar blueprints opcionales si están disponibles
     optional_blueprints = [
@@ -0,0 +1,29 @@
+-- Índices compuestos según las consultas reales de app/routes y app/services
+-- CREATE/DROP INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+-- Comprobar los planes después con: python migrations/check_query_plans.py --database-url postgresql://...
+
+-- GET /api/appointments: user_id [+ status] ORDER BY appointment_date DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_date
+    ON appointments (user_id, appointment_date DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_status_date
+    ON appointments (user_id, status, appointment_date DESC);
+
+-- Recordatorios: ventana de fechas de las citas activas (reminder_scheduler)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_active_date
+    ON appointments (appointment_date) WHERE status IN ('scheduled', 'confirmed');
+
+-- Precarga paginada de asistentes activos (tenant_resolver.preload: status = 'active' ORDER BY id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_assistants_active_id
+    ON assistants (id) WHERE status = 'active';
+
+-- Resolución de asistente por canal (tenant_resolver._lookup)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_assistants_active_voice_phone
+    ON assistants ((business_context->>'voice_phone')) WHERE status = 'active';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_assistants_active_whatsapp_id
+    ON assistants ((business_context->>'whatsapp_phone_number_id')) WHERE status = 'active';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_assistants_active_context
+    ON assistants USING GIN (business_context jsonb_path_ops) WHERE status = 'active';
+
+-- Cubiertos por los compuestos (prefijo user_id) y por UNIQUE (email)
+DROP INDEX CONCURRENTLY IF EXISTS idx_appointments_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_email;
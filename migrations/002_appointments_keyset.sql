@@ -0,0 +1,9 @@
+-- Paginación por cursor de GET /api/appointments: ORDER BY appointment_date DESC, id DESC
+-- El id en el índice resuelve los empates de fecha sin ordenar en memoria
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_date_id
+    ON appointments (user_id, appointment_date DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_status_date_id
+    ON appointments (user_id, status, appointment_date DESC, id DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_appointments_user_date;
+DROP INDEX CONCURRENTLY IF EXISTS idx_appointments_user_status_date;
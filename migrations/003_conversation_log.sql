@@ -0,0 +1,17 @@
+-- Tabla del registro de conversaciones (app/services/conversation_log.py)
+-- Los registros de WhatsApp, Telegram y el chat web usaban columnas que no existen en conversations
+CREATE TABLE IF NOT EXISTS conversation_log (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    assistant_id UUID REFERENCES assistants(id) ON DELETE CASCADE,
+    channel VARCHAR(20) NOT NULL DEFAULT 'whatsapp', -- whatsapp, telegram, web
+    customer_id VARCHAR(255), -- teléfono de WhatsApp o chat_id de Telegram
+    user_message TEXT,
+    bot_response TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversation_log_assistant_created
+    ON conversation_log (assistant_id, created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversation_log_created_at
+    ON conversation_log USING BRIN (created_at);
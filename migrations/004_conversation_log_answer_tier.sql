@@ -0,0 +1,2 @@
+-- Nivel que sirvió cada respuesta (answer_engine.TIERS) en el registro de conversaciones
+ALTER TABLE conversation_log ADD COLUMN IF NOT EXISTS answer_tier VARCHAR(20);
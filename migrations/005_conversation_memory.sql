@@ -0,0 +1,17 @@
+-- Columnas de la memoria de conversación (app/services/conversation_memory.py)
+-- upsert(on_conflict="memory_key") necesita una restricción UNIQUE sobre memory_key
+-- CREATE INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS memory_key VARCHAR(255);
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS history JSONB;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS conversations_memory_key_key
+    ON conversations (memory_key);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'conversations_memory_key_key') THEN
+        ALTER TABLE conversations
+            ADD CONSTRAINT conversations_memory_key_key UNIQUE USING INDEX conversations_memory_key_key;
+    END IF;
+END $$;
@@ -0,0 +1,11 @@
+-- Teléfono de voz normalizado para tenant_resolver._lookup(voice)
+-- business_context->>'voice_phone' se guarda tal cual lo escribe el cliente ("+34 900-000-041");
+-- la columna generada aplica la misma normalización que normalize_channel_key
+-- CREATE/DROP INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+ALTER TABLE assistants ADD COLUMN IF NOT EXISTS voice_phone_normalized TEXT GENERATED ALWAYS AS (
+    regexp_replace(business_context->>'voice_phone', '[^0-9+]', '', 'g')
+) STORED;
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_assistants_active_voice_phone;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_assistants_active_voice_phone
+    ON assistants (voice_phone_normalized) WHERE status = 'active';
@@ -0,0 +1,61 @@
+-- Fusión atómica de datos de entrenamiento en assistants.business_context (training_pipeline.append_knowledge)
+
+-- Añadir filas de entrenamiento al custom_knowledge de los asistentes de un usuario
+-- Cada asistente se bloquea (FOR UPDATE) y se fusiona aquí, sin leer-modificar-escribir desde la aplicación
+CREATE OR REPLACE FUNCTION append_training_knowledge(
+    p_assistant_ids UUID[], p_user_id UUID, p_items JSONB, p_max_pairs INTEGER
+) RETURNS TABLE (assistant_id UUID, added INTEGER) AS $$
+DECLARE
+    v_assistant RECORD;
+    v_item JSONB;
+    v_knowledge JSONB;
+    v_known TEXT[];
+    v_count INTEGER;
+    v_added INTEGER;
+    v_category TEXT;
+BEGIN
+    FOR v_assistant IN
+        SELECT a.id, a.business_context FROM assistants a
+        WHERE a.id = ANY(p_assistant_ids) AND a.user_id = p_user_id
+        ORDER BY a.id
+        FOR UPDATE
+    LOOP
+        v_knowledge := COALESCE(v_assistant.business_context->'custom_knowledge', '{}'::jsonb);
+
+        -- Las filas de cargas anteriores traen question_hash; las manuales se comparan por la pregunta
+        SELECT COALESCE(array_agg(COALESCE(qa->>'question_hash', lower(btrim(qa->>'question')))), '{}'), count(*)
+        INTO v_known, v_count
+        FROM jsonb_each(v_knowledge) AS category(name, pairs),
+             jsonb_array_elements(CASE WHEN jsonb_typeof(category.pairs) = 'array' THEN category.pairs ELSE '[]'::jsonb END) AS qa;
+
+        v_added := 0;
+        FOR v_item IN SELECT value FROM jsonb_array_elements(p_items) LOOP
+            EXIT WHEN v_count >= p_max_pairs;
+            CONTINUE WHEN v_item->>'question_hash' = ANY(v_known)
+                OR lower(btrim(v_item->>'question')) = ANY(v_known);
+
+            v_known := v_known || (v_item->>'question_hash');
+            v_category := COALESCE(NULLIF(v_item->>'category', ''), 'General');
+            v_knowledge := jsonb_set(
+                v_knowledge, ARRAY[v_category],
+                COALESCE(v_knowledge->v_category, '[]'::jsonb) || jsonb_build_array(v_item - 'category')
+            );
+            v_count := v_count + 1;
+            v_added := v_added + 1;
+        END LOOP;
+
+        IF v_added > 0 THEN
+            UPDATE assistants SET business_context = COALESCE(business_context, '{}'::jsonb)
+                || jsonb_build_object(
+                    'custom_knowledge', v_knowledge,
+                    'knowledge_version', extract(epoch FROM clock_timestamp())
+                )
+            WHERE id = v_assistant.id;
+
+            assistant_id := v_assistant.id;
+            added := v_added;
+            RETURN NEXT;
+        END IF;
+    END LOOP;
+END;
+$$ language 'plpgsql';
@@ -0,0 +1,11 @@
+-- Una sola cita activa por usuario, día y hora: dos workers que reservan la misma hora a la
+-- vez chocan aquí (POST/PUT /api/appointments devuelven 409 con 23505). Solo cubre solapes
+-- con la misma hora de inicio; availability.check rechaza las horas fuera de la rejilla
+-- CREATE INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+--
+-- Si ya hay reservas dobles el índice falla; localizarlas antes con:
+--   SELECT user_id, appointment_date, appointment_time, array_agg(id)
+--   FROM appointments WHERE status IN ('scheduled', 'confirmed')
+--   GROUP BY 1, 2, 3 HAVING count(*) > 1;
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_active_slot
+    ON appointments (user_id, appointment_date, appointment_time) WHERE status IN ('scheduled', 'confirmed');
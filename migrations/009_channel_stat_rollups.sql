@@ -0,0 +1,53 @@
+-- Agregados horarios de channel_stats compartidos por todos los workers
+-- Cada worker suma sus incrementos con record_channel_stats cada CHANNEL_STATS_FLUSH_INTERVAL
+
+CREATE TABLE IF NOT EXISTS channel_stat_rollups (
+    tenant_key TEXT NOT NULL,
+    channel VARCHAR(20) NOT NULL,
+    hour_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    conversations INTEGER NOT NULL DEFAULT 0,
+    responses INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    response_count INTEGER NOT NULL DEFAULT 0,
+    response_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    response_sketch JSONB NOT NULL DEFAULT '{}'::jsonb,
+    PRIMARY KEY (tenant_key, channel, hour_start)
+);
+
+-- Sumar los incrementos horarios de un worker; el histograma se fusiona cubeta a cubeta
+CREATE OR REPLACE FUNCTION merge_count_maps(a JSONB, b JSONB) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, sum(value::bigint) AS total
+        FROM (SELECT * FROM jsonb_each_text(a) UNION ALL SELECT * FROM jsonb_each_text(b)) counts
+        GROUP BY key
+    ) merged;
+$$ language 'sql' IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION record_channel_stats(p_rows JSONB) RETURNS INTEGER AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    INSERT INTO channel_stat_rollups AS r (
+        tenant_key, channel, hour_start, conversations, responses, errors,
+        response_count, response_sum_ms, response_sketch
+    )
+    SELECT tenant_key, channel, hour_start, conversations, responses, errors,
+           response_count, response_sum_ms, COALESCE(response_sketch, '{}'::jsonb)
+    FROM jsonb_to_recordset(p_rows) AS x(
+        tenant_key TEXT, channel VARCHAR, hour_start TIMESTAMP WITH TIME ZONE, conversations INTEGER,
+        responses INTEGER, errors INTEGER, response_count INTEGER, response_sum_ms DOUBLE PRECISION,
+        response_sketch JSONB
+    )
+    ON CONFLICT (tenant_key, channel, hour_start) DO UPDATE SET
+        conversations = r.conversations + EXCLUDED.conversations,
+        responses = r.responses + EXCLUDED.responses,
+        errors = r.errors + EXCLUDED.errors,
+        response_count = r.response_count + EXCLUDED.response_count,
+        response_sum_ms = r.response_sum_ms + EXCLUDED.response_sum_ms,
+        response_sketch = merge_count_maps(r.response_sketch, EXCLUDED.response_sketch);
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ language 'plpgsql';
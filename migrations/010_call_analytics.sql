@@ -0,0 +1,66 @@
+-- Tablas y función de app/services/call_analytics.py (hasta ahora solo en database_schema.sql)
+-- CREATE INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+
+-- Eventos de estado de llamadas (solo inserciones; un registro por CallSid y estado)
+CREATE TABLE IF NOT EXISTS call_events (
+    id BIGSERIAL PRIMARY KEY,
+    call_sid VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    tenant_key TEXT NOT NULL DEFAULT '',
+    assistant_id UUID,
+    direction VARCHAR(20),
+    from_phone VARCHAR(32),
+    to_phone VARCHAR(32),
+    duration INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (call_sid, status)
+);
+
+-- Agregados diarios de llamadas por cliente (tenant_key = user_id del asistente)
+CREATE TABLE IF NOT EXISTS call_rollups (
+    tenant_key TEXT NOT NULL,
+    day DATE NOT NULL,
+    total_calls INTEGER NOT NULL DEFAULT 0,
+    answered_calls INTEGER NOT NULL DEFAULT 0,
+    missed_calls INTEGER NOT NULL DEFAULT 0,
+    total_duration BIGINT NOT NULL DEFAULT 0,
+    duration_buckets INTEGER[] NOT NULL DEFAULT array_fill(0, ARRAY[11]),
+    hourly_calls INTEGER[] NOT NULL DEFAULT array_fill(0, ARRAY[24]),
+    PRIMARY KEY (tenant_key, day)
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_call_events_created_at ON call_events USING BRIN (created_at);
+
+-- Registrar un evento de llamada y actualizar su agregado diario en una sola transacción
+CREATE OR REPLACE FUNCTION record_call_event(
+    p_call_sid VARCHAR, p_tenant_key TEXT, p_assistant_id UUID, p_status VARCHAR, p_direction VARCHAR,
+    p_from_phone VARCHAR, p_to_phone VARCHAR, p_duration INTEGER, p_duration_bucket INTEGER,
+    p_terminal BOOLEAN, p_answered BOOLEAN, p_day DATE, p_hour INTEGER
+) RETURNS BOOLEAN AS $$
+BEGIN
+    INSERT INTO call_events (call_sid, status, tenant_key, assistant_id, direction, from_phone, to_phone, duration)
+    VALUES (p_call_sid, p_status, p_tenant_key, p_assistant_id, p_direction, p_from_phone, p_to_phone, p_duration)
+    ON CONFLICT (call_sid, status) DO NOTHING;
+
+    -- Reintento del webhook: el evento ya estaba contabilizado
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    IF p_terminal THEN
+        INSERT INTO call_rollups (tenant_key, day) VALUES (p_tenant_key, p_day)
+        ON CONFLICT (tenant_key, day) DO NOTHING;
+
+        UPDATE call_rollups SET
+            total_calls = total_calls + 1,
+            answered_calls = answered_calls + CASE WHEN p_answered THEN 1 ELSE 0 END,
+            missed_calls = missed_calls + CASE WHEN p_answered THEN 0 ELSE 1 END,
+            total_duration = total_duration + CASE WHEN p_answered THEN p_duration ELSE 0 END,
+            duration_buckets[p_duration_bucket] = duration_buckets[p_duration_bucket] + CASE WHEN p_answered THEN 1 ELSE 0 END,
+            hourly_calls[p_hour + 1] = hourly_calls[p_hour + 1] + 1
+        WHERE tenant_key = p_tenant_key AND day = p_day;
+    END IF;
+
+    RETURN TRUE;
+END;
+$$ language 'plpgsql';
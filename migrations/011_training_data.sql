@@ -0,0 +1,25 @@
+-- Tabla de datos de entrenamiento (app/services/training_pipeline.py)
+-- upsert(on_conflict="user_id,question_hash") necesita la restricción UNIQUE (user_id, question_hash)
+-- CREATE INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+CREATE TABLE IF NOT EXISTS training_data (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    training_type VARCHAR(30) NOT NULL DEFAULT 'faq',
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    category VARCHAR(255),
+    keywords TEXT[] DEFAULT '{}',
+    context JSONB,
+    question_hash CHAR(40) NOT NULL,
+    status VARCHAR(20) DEFAULT 'completed',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (user_id, question_hash)
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_data_user_created
+    ON training_data (user_id, created_at DESC);
+
+DROP TRIGGER IF EXISTS update_training_data_updated_at ON training_data;
+CREATE TRIGGER update_training_data_updated_at BEFORE UPDATE ON training_data
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
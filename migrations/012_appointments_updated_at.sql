@@ -0,0 +1,4 @@
+-- Cursor del programador de recordatorios: lee solo las citas modificadas (keyset sobre updated_at, id)
+-- CREATE INDEX CONCURRENTLY no admite transacciones: aplicar con autocommit (psql -f)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_updated_at
+    ON appointments (updated_at, id);
@@ -0,0 +1,363 @@
+"""Comprobar que las consultas de la aplicación usan índices
+
+Crea el esquema en una base de datos local (SQLite temporal por defecto, o PostgreSQL
+con --database-url), la llena con datos de prueba, ejecuta EXPLAIN sobre las consultas
+que hacen app/routes y app/services y termina con código 1 si alguna recorre una tabla
+entera (Seq Scan / SCAN sin índice).
+
+    python migrations/check_query_plans.py
+    python migrations/check_query_plans.py --database-url postgresql://localhost/plan_check
+
+En PostgreSQL se usa un esquema temporal (query_plan_check) que se borra al terminar;
+hace falta un driver instalado (psycopg2) y PostgreSQL 13+ (gen_random_uuid).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_FILE = os.path.join(ROOT, 'database_schema.sql')
+MIGRATIONS_DIR = os.path.join(ROOT, 'migrations')
+PG_SCHEMA = 'query_plan_check'
+
+USERS = 1000
+ASSISTANTS_PER_USER = 5
+APPOINTMENTS = 50000
+TRAINING_ROWS = 20000
+CONVERSATIONS = 20000
+STATUSES = ['scheduled', 'confirmed', 'completed', 'cancelled']
+SEED_TABLES = ('users', 'assistants', 'appointments', 'conversations', 'training_data')
+
+# Tablas mínimas para SQLite (el esquema de PostgreSQL usa tipos y funciones propios)
+SQLITE_TABLES = """
+CREATE TABLE users (
+    id TEXT PRIMARY KEY, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL,
+    business_name TEXT NOT NULL, business_type TEXT NOT NULL DEFAULT 'clinic'
+);
+CREATE TABLE assistants (
+    id TEXT PRIMARY KEY, user_id TEXT REFERENCES users(id), name TEXT NOT NULL,
+    business_context TEXT, voice_phone_normalized TEXT, status TEXT DEFAULT 'active',
+    total_conversations INTEGER DEFAULT 0, created_at TEXT
+);
+CREATE TABLE appointments (
+    id TEXT PRIMARY KEY, user_id TEXT REFERENCES users(id), assistant_id TEXT REFERENCES assistants(id),
+    customer_name TEXT NOT NULL, customer_phone TEXT NOT NULL, appointment_date TEXT NOT NULL,
+    appointment_time TEXT NOT NULL, service TEXT NOT NULL, status TEXT DEFAULT 'scheduled',
+    created_at TEXT, updated_at TEXT
+);
+CREATE TABLE conversations (
+    id TEXT PRIMARY KEY, user_id TEXT REFERENCES users(id), assistant_id TEXT REFERENCES assistants(id),
+    channel TEXT NOT NULL DEFAULT 'whatsapp', memory_key TEXT UNIQUE, summary TEXT, history TEXT,
+    message_count INTEGER DEFAULT 0, created_at TEXT
+);
+CREATE TABLE training_data (
+    id TEXT PRIMARY KEY, user_id TEXT REFERENCES users(id), training_type TEXT NOT NULL DEFAULT 'faq',
+    question TEXT NOT NULL, answer TEXT NOT NULL, category TEXT, question_hash TEXT NOT NULL,
+    status TEXT DEFAULT 'completed', created_at TEXT, UNIQUE (user_id, question_hash)
+);
+"""
+
+# Consultas tal y como las construyen las rutas y servicios (origen en "source")
+QUERIES = [
+    {
+        "name": "appointments_by_user",
+        "source": "routes/appointments.py:get_appointments",
+        "sql": "SELECT id, customer_name, appointment_date, status FROM appointments WHERE user_id = :user_id "
+               "ORDER BY appointment_date DESC, id DESC LIMIT 11"
+    },
+    {
+        "name": "appointments_by_user_status",
+        "source": "routes/appointments.py:get_appointments?status=",
+        "sql": "SELECT id, customer_name, appointment_date, status FROM appointments "
+               "WHERE user_id = :user_id AND status = :status ORDER BY appointment_date DESC, id DESC LIMIT 11"
+    },
+    {
+        "name": "appointments_next_page",
+        "source": "routes/appointments.py:get_appointments?cursor=",
+        "sql": "SELECT id, customer_name, appointment_date, status FROM appointments WHERE user_id = :user_id "
+               "AND (appointment_date < :after_date OR (appointment_date = :after_date AND id < :appointment_id)) "
+               "ORDER BY appointment_date DESC, id DESC LIMIT 11"
+    },
+    {
+        "name": "appointments_count",
+        "source": "routes/appointments.py:get_appointments?total=exact",
+        "sql": "SELECT COUNT(*) FROM appointments WHERE user_id = :user_id AND status = :status"
+    },
+    {
+        "name": "appointment_by_id_user",
+        "source": "routes/appointments.py:update/delete",
+        "sql": "SELECT id FROM appointments WHERE id = :appointment_id AND user_id = :user_id"
+    },
+    {
+        "name": "reminder_window",
+        "source": "services/reminder_scheduler.py:_load_window",
+        "sql": "SELECT id, appointment_date, appointment_time, status FROM appointments "
+               "WHERE appointment_date >= :start AND appointment_date <= :end "
+               "AND status IN ('scheduled', 'confirmed') ORDER BY id LIMIT 500"
+    },
+    {
+        "name": "reminder_changes",
+        "source": "services/reminder_scheduler.py:_scan_changes",
+        "sql": "SELECT id, updated_at FROM appointments "
+               "WHERE updated_at > :updated_after OR (updated_at = :updated_after AND id > :appointment_id) "
+               "ORDER BY updated_at, id LIMIT 500"
+    },
+    {
+        "name": "assistants_by_user",
+        "source": "routes/assistants.py:get_assistants",
+        "sql": "SELECT * FROM assistants WHERE user_id = :user_id"
+    },
+    {
+        "name": "assistant_by_id_user",
+        "source": "routes/assistants.py:update/delete/chat",
+        "sql": "SELECT * FROM assistants WHERE id = :assistant_id AND user_id = :user_id"
+    },
+    {
+        "name": "active_assistants_page",
+        "source": "services/tenant_resolver.py:preload",
+        "sql": "SELECT id, user_id, name, business_context FROM assistants WHERE status = 'active' "
+               "ORDER BY id LIMIT 1000"
+    },
+    {
+        "name": "tenant_by_whatsapp",
+        "source": "services/tenant_resolver.py:_lookup(whatsapp)",
+        "sql": "SELECT id FROM assistants WHERE status = 'active' "
+               "AND business_context->>'whatsapp_phone_number_id' = :channel_key LIMIT 1"
+    },
+    {
+        "name": "tenant_by_voice",
+        "source": "services/tenant_resolver.py:_lookup(voice)",
+        "sql": "SELECT id FROM assistants WHERE status = 'active' "
+               "AND voice_phone_normalized = :voice_phone LIMIT 1"
+    },
+    {
+        "name": "tenant_by_telegram",
+        "source": "services/tenant_resolver.py:_lookup(telegram)",
+        "sql": "SELECT id FROM assistants WHERE status = 'active' "
+               "AND business_context @> CAST(:telegram_filter AS jsonb) LIMIT 1",
+        "postgres_only": True
+    },
+    {
+        "name": "user_by_email",
+        "source": "routes/auth.py:login/register",
+        "sql": "SELECT * FROM users WHERE email = :email"
+    },
+    {
+        "name": "conversation_memory",
+        "source": "services/conversation_memory.py:_load",
+        "sql": "SELECT summary, history, message_count FROM conversations WHERE memory_key = :memory_key LIMIT 1"
+    },
+    {
+        "name": "training_data_by_user",
+        "source": "routes/training.py:get_training_data",
+        "sql": "SELECT id, question, answer FROM training_data WHERE user_id = :user_id "
+               "ORDER BY created_at DESC LIMIT 100"
+    }
+]
+
+
+def seed_rows():
+    """Datos de prueba con una distribución parecida a la real (muchos clientes, pocas filas por cliente)"""
+    random.seed(42)
+    today = date.today()
+    now = datetime.utcnow()
+
+    users = [{
+        "id": str(uuid.uuid4()), "email": f"user{i}@example.com", "password_hash": "x",
+        "business_name": f"Negocio {i}", "business_type": "clinic"
+    } for i in range(USERS)]
+
+    assistants = []
+    for i, user in enumerate(users):
+        for j in range(ASSISTANTS_PER_USER):
+            n = i * ASSISTANTS_PER_USER + j
+            assistants.append({
+                "id": str(uuid.uuid4()), "user_id": user["id"], "name": f"Asistente {n}",
+                "status": "active" if n % 10 else "inactive",
+                "business_context": json.dumps({
+                    "business_type": "clinic", "voice_phone": f"+3490{n:07d}",
+                    "whatsapp_phone_number_id": f"wa{n}", "telegram_chat_ids": [f"{n}"]
+                }),
+                "created_at": (now - timedelta(minutes=n)).isoformat()
+            })
+
+    appointments = [{
+        "id": str(uuid.uuid4()), "user_id": users[i % USERS]["id"],
+        "assistant_id": assistants[(i % USERS) * ASSISTANTS_PER_USER]["id"],
+        "customer_name": f"Cliente {i}", "customer_phone": f"+346{i:08d}",
+        "appointment_date": (today + timedelta(days=random.randint(-300, 60))).isoformat(),
+        "appointment_time": f"{9 + i % 9:02d}:00:00", "service": "Consulta",
+        "status": random.choice(STATUSES),
+        "created_at": (now - timedelta(seconds=i * 30)).isoformat(),
+        "updated_at": (now - timedelta(seconds=i * 30)).isoformat()
+    } for i in range(APPOINTMENTS)]
+
+    conversations = [{
+        "id": str(uuid.uuid4()), "user_id": users[i % USERS]["id"],
+        "assistant_id": assistants[(i % USERS) * ASSISTANTS_PER_USER]["id"], "channel": "whatsapp",
+        "memory_key": f"assistant|whatsapp|+346{i:08d}", "summary": "", "history": "[]", "message_count": 1,
+        "created_at": (now - timedelta(seconds=i)).isoformat()
+    } for i in range(CONVERSATIONS)]
+
+    training = [{
+        "id": str(uuid.uuid4()), "user_id": users[i % USERS]["id"], "training_type": "faq",
+        "question": f"Pregunta {i}", "answer": f"Respuesta {i}", "category": "Preguntas Frecuentes",
+        "question_hash": uuid.uuid4().hex + "00000000", "status": "completed",
+        "created_at": (now - timedelta(seconds=i)).isoformat()
+    } for i in range(TRAINING_ROWS)]
+
+    params = {
+        "user_id": users[7]["id"], "status": "scheduled", "appointment_id": appointments[70]["id"],
+        "after_date": (today - timedelta(days=30)).isoformat(), "start": today.isoformat(), "end": (today + timedelta(days=2)).isoformat(),
+        "updated_after": appointments[100]["updated_at"], "assistant_id": assistants[35]["id"],
+        "channel_key": "wa41", "voice_phone": "+34900000041", "telegram_filter": json.dumps({"telegram_chat_ids": ["41"]}),
+        "email": "user7@example.com", "memory_key": "assistant|whatsapp|+34600000070"
+    }
+    tables = [
+        ("users", users), ("assistants", assistants), ("appointments", appointments),
+        ("conversations", conversations), ("training_data", training)
+    ]
+    return tables, params
+
+
+def split_statements(sql):
+    """Sentencias de un fichero SQL; los cuerpos $$ ... $$ (funciones, DO) no se parten"""
+    sql = re.sub(r"--[^\n]*", "", sql)
+    statements, current, inside = [], [], False
+    for part in re.split(r"(\$\$)", sql):
+        if part == '$$':
+            inside = not inside
+        if part == '$$' or inside:
+            current.append(part)
+            continue
+        pieces = part.split(';')
+        current.append(pieces[0])
+        for piece in pieces[1:]:
+            statements.append(''.join(current))
+            current = [piece]
+    statements.append(''.join(current))
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def sqlite_indexes():
+    """CREATE INDEX del esquema aplicables a SQLite (sin GIN/BRIN) sobre las tablas de prueba"""
+    with open(SCHEMA_FILE, encoding='utf-8') as schema:
+        statements = split_statements(schema.read().split('-- Función para actualizar')[0])
+    indexes = []
+    for statement in statements:
+        match = re.match(r"CREATE INDEX \w+ ON (\w+)", statement)
+        if match and match.group(1) in SEED_TABLES and ' USING ' not in statement:
+            indexes.append(statement)
+    return indexes
+
+
+def setup(engine):
+    """Crear tablas, índices y datos; devuelve los parámetros de las consultas"""
+    tables, params = seed_rows()
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE")
+            connection.exec_driver_sql(f"CREATE SCHEMA {PG_SCHEMA}")
+            connection.exec_driver_sql(f"SET search_path TO {PG_SCHEMA}, public")
+            with open(SCHEMA_FILE, encoding='utf-8') as schema:
+                connection.exec_driver_sql(schema.read())
+            # CONCURRENTLY no se puede agrupar: una sentencia cada vez
+            for migration in sorted(os.listdir(MIGRATIONS_DIR)):
+                if migration.endswith('.sql'):
+                    with open(os.path.join(MIGRATIONS_DIR, migration), encoding='utf-8') as sql:
+                        for statement in split_statements(sql.read()):
+                            connection.exec_driver_sql(statement)
+        else:
+            for statement in split_statements(SQLITE_TABLES) + sqlite_indexes():
+                connection.exec_driver_sql(statement)
+
+        for table, rows in tables:
+            columns = list(rows[0])
+            insert = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+            connection.execute(insert, rows)
+
+        if engine.dialect.name != 'postgresql':
+            # En PostgreSQL es una columna generada; los teléfonos de prueba ya están normalizados
+            connection.exec_driver_sql(
+                "UPDATE assistants SET voice_phone_normalized = json_extract(business_context, '$.voice_phone')"
+            )
+
+        connection.exec_driver_sql("ANALYZE")
+        if engine.dialect.name != 'postgresql':
+            connection.commit()
+    return params
+
+
+def sequential_scans(connection, dialect, sql, params):
+    """Tablas recorridas enteras en el plan de la consulta"""
+    if dialect == 'postgresql':
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        scans, nodes = [], [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') == 'Seq Scan':
+                scans.append(node.get('Relation Name'))
+            nodes.extend(node.get('Plans', []))
+        return scans, json.dumps(plan[0]['Plan'].get('Node Type'))
+
+    rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+    details = [row[-1] for row in rows]
+    scans = [
+        detail.split()[1] for detail in details
+        if detail.startswith('SCAN ') and ' USING ' not in detail
+    ]
+    return scans, ' / '.join(details)
+
+
+def run(database_url, keep=False):
+    engine = create_engine(database_url)
+    dialect = engine.dialect.name
+    params = setup(engine)
+
+    failures = 0
+    with engine.connect() as connection:
+        if dialect == 'postgresql':
+            connection.exec_driver_sql(f"SET search_path TO {PG_SCHEMA}, public")
+        for query in QUERIES:
+            if query.get('postgres_only') and dialect != 'postgresql':
+                print(f"SKIP  {query['name']:<30} (solo PostgreSQL)")
+                continue
+            scans, plan = sequential_scans(connection, dialect, query['sql'], params)
+            status = 'FAIL' if scans else 'OK'
+            failures += bool(scans)
+            print(f"{status:<5} {query['name']:<30} {query['source']:<45} {plan}")
+
+        if dialect == 'postgresql' and not keep:
+            connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE")
+            connection.commit()
+
+    engine.dispose()
+    print(f"\n{len(QUERIES)} consultas, {failures} con recorrido secuencial")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="PostgreSQL o SQLite de pruebas (por defecto SQLite temporal)")
+    parser.add_argument('--keep', action='store_true', help="No borrar el esquema de prueba en PostgreSQL")
+    args = parser.parse_args()
+
+    if args.database_url:
+        return 1 if run(args.database_url, args.keep) else 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        return 1 if run(f"sqlite:///{os.path.join(directory, 'plan_check.db')}") else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -862,14 +862,10 @@ function openTrainingPage() {
 
 function openDashboard() {
     closeTrainingSuccessModal();
-    // Simular login si no está logueado
+    // Las estadísticas del dashboard requieren un token firmado: sin sesión, pedir login
     if (!localStorage.getItem('auth_token')) {
-        localStorage.setItem('auth_token', 'demo_token_' + Date.now());
-        localStorage.setItem('user_data', JSON.stringify({
-            email: 'demo@aiasistentpro.com',
-            business_name: 'Mi Empresa',
-            phone: '+34123456789'
-        }));
+        showLoginModal();
+        return;
     }
 
     showDashboard();